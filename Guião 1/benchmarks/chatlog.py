@@ -0,0 +1,52 @@
+"""Benchmark: persistent channel log append, restart and replay.
+
+Run from the assignment folder with ``python -m benchmarks.chatlog``."""
+import argparse
+import tempfile
+import time
+
+from src.chatlog import ChatLog
+from src.protocol import TextMessage
+
+
+def timed(label: str, n: int, fn):
+    start = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - start
+    print(f"{label:>24}: {elapsed:7.2f}s {n / elapsed:>12.0f} msgs/s")
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=1000000)
+    parser.add_argument("--channels", type=int, default=100)
+    args = parser.parse_args()
+    n = args.messages
+
+    with tempfile.TemporaryDirectory() as directory:
+        log = ChatLog(directory, segment_bytes=1 << 24)
+        texts = [(f"message number {i}", f"#{i % args.channels}") for i in range(10000)]
+
+        def append():
+            for i in range(n):
+                text, channel = texts[i % len(texts)]
+                log.append(channel, TextMessage(text, channel, 1615852800 + i // 1000))
+            log.flush()
+        timed("append", n, append)
+        log.close()
+
+        log = timed("restart (index rebuild)", n, lambda: ChatLog(directory, segment_bytes=1 << 24))
+
+        def replay_all():
+            count = 0
+            for channel in log.channels():
+                for ts, payload in log.replay(channel):
+                    count += 1
+            return count
+        timed("replay every channel", n, replay_all)
+
+        since = 1615852800 + n // 1000 // 2
+        timed("replay #0 second half", n // args.channels // 2,
+              lambda: sum(1 for _ in log.replay("#0", since)))
+        log.close()
@@ -0,0 +1,25 @@
+"""Benchmark: broadcast throughput of the multi-process server by worker count.
+
+Run from the assignment folder with ``python -m benchmarks.cluster``. The
+load generator is a single process, so use a machine with spare cores
+(or several load runs) to see the server side scale."""
+import argparse
+import os
+
+from .harness import bench
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=5237)
+    parser.add_argument("--clients", type=int, default=200)
+    parser.add_argument("--senders", type=int, default=20)
+    parser.add_argument("--messages", type=int, default=100)
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    workers = 1
+    print(f"{'workers':>8} {'msgs/sec':>10} {'p99':>9} {'delivered':>14}")
+    while workers <= args.max_workers:
+        r = bench("cluster", args.port, workers, clients=args.clients, senders=args.senders, messages=args.messages)
+        print(f"{workers:>8} {r['msgs_per_sec']:>10.0f} {r['p99_ms']:>7.2f}ms {r['delivered']:>7}/{r['expected']}")
+        workers *= 2
@@ -0,0 +1,31 @@
+"""Benchmark: JSON vs binary CDProto encoding.
+
+Reports bytes per frame and encode/decode time per message. Messages
+cache their payloads, so every encode is timed on a new message (built
+the same way for both encodings) to measure the encoder and not the
+cache. Run from the assignment folder with ``python -m benchmarks.encoding``."""
+import timeit
+
+from src.protocol import CDProto, HEADER_SIZE, JoinMessage, TextMessage
+
+SAMPLES = {
+    "join": lambda: JoinMessage("#cd"),
+    "short text": lambda: TextMessage("Hello World", "#cd", 1615852800),
+    "1 KiB text": lambda: TextMessage("Olá Mundo " * 100, "#computacao-distribuida", 1615852800),
+}
+
+
+def per_op(stmt, number: int = 20000) -> float:
+    return min(timeit.repeat(stmt, number=number, repeat=5)) / number
+
+
+if __name__ == "__main__":
+    print(f"{'message':>12} {'encoding':>8} {'bytes':>6} {'encode':>9} {'decode':>9}")
+    for name, make in SAMPLES.items():
+        for binary in (False, True):
+            frame = CDProto.encode(make(), binary)
+            payload = frame[HEADER_SIZE:]
+            encode = per_op(lambda: CDProto.encode(make(), binary))
+            decode = per_op(lambda: CDProto.decode(payload))
+            print(f"{name:>12} {'binary' if binary else 'json':>8} {len(frame):>6}"
+                  f" {encode * 1e6:>7.2f}us {decode * 1e6:>7.2f}us")
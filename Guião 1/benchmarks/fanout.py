@@ -0,0 +1,42 @@
+"""Microbenchmark: per-recipient encoding vs encode-once channel fan-out.
+
+Run from the assignment folder with ``python -m benchmarks.fanout``."""
+import timeit
+
+from src.protocol import CDProto, CDProtoWriter, TextMessage
+
+SIZES = (1, 10, 100, 1000, 10000)
+
+
+def per_recipient(writers, msg):
+    for writer in writers:
+        writer.put(CDProto.encode(msg))
+
+
+def encode_once(writers, msg):
+    frame = CDProto.encode(msg)
+    for writer in writers:
+        writer.put(frame)
+
+
+def run(size: int, repeat: int = 5) -> tuple:
+    msg = TextMessage("Hello darkness, my old friend", "#cd")
+    number = max(1, 20000 // size)
+    results = []
+    for fn in (per_recipient, encode_once):
+        writers = [CDProtoWriter() for _ in range(size)]
+
+        def bench():
+            fn(writers, msg)
+            for writer in writers:
+                writer.drop_oldest()
+
+        results.append(min(timeit.repeat(bench, number=number, repeat=repeat)) / number)
+    return tuple(results)
+
+
+if __name__ == "__main__":
+    print(f"{'members':>8} {'per-recipient':>14} {'encode-once':>12} {'speedup':>8}")
+    for size in SIZES:
+        naive, once = run(size)
+        print(f"{size:>8} {naive * 1e6:>12.1f}us {once * 1e6:>10.1f}us {naive / once:>7.1f}x")
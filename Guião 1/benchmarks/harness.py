@@ -0,0 +1,141 @@
+"""Shared load harness for the chat servers.
+
+Servers run in a subprocess, by default with logging disabled; the load is driven by
+AsyncClient sessions that all join one channel, so every message is
+fanned out to every client."""
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import time
+
+from src.aioclient import AsyncClient
+from src.protocol import CDProto, TextMessage
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+LOGGING = {
+    "off": "import logging; logging.disable(logging.CRITICAL); ",
+    "sync": "import logging; logging.basicConfig(filename='bench.log', level=logging.DEBUG); ",
+    "async": "from src import log; log.configure('bench.log'); ",
+}
+
+SERVERS = {
+    "selectors": "from src.server import Server; Server(('localhost', {port})).loop()",
+    "asyncio": "from src.aioserver import main; main(('localhost', {port}))",
+    "cluster": "from src.cluster import serve; serve({workers}, ('localhost', {port}))",
+}
+
+
+def start_server(kind: str, port: int, workers: int = 1, logging: str = "off") -> subprocess.Popen:
+    """Launches a chat server and waits until it accepts connections.
+
+    logging is "off", "sync" (plain logging.basicConfig at DEBUG) or
+    "async" (src.log pipeline at DEBUG); both write to bench.log."""
+    code = LOGGING[logging] + SERVERS[kind].format(port=port, workers=workers)
+    proc = subprocess.Popen([sys.executable, "-c", code], cwd=ROOT)
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("localhost", port), timeout=0.1).close()
+            return proc
+        except OSError:
+            time.sleep(0.05)
+    proc.kill()
+    raise RuntimeError(f"{kind} server did not start on port {port}")
+
+
+def process_tree(pid: int) -> list:
+    """The pid and its descendants, as listed in /proc."""
+    pids = [pid]
+    for p in pids:
+        try:
+            with open(f"/proc/{p}/task/{p}/children") as f:
+                pids.extend(int(child) for child in f.read().split())
+        except OSError:
+            pass
+    return pids
+
+
+def server_usage(pid: int) -> tuple:
+    """CPU seconds and resident bytes of a server and its workers (Linux only)."""
+    ticks = os.sysconf("SC_CLK_TCK")
+    cpu = rss = 0
+    for p in process_tree(pid):
+        try:
+            with open(f"/proc/{p}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+        except OSError:
+            continue
+        cpu += (int(fields[11]) + int(fields[12])) / ticks
+        rss += int(fields[21]) * os.sysconf("SC_PAGE_SIZE")
+    return cpu, rss
+
+
+def percentile(values: list, p: float) -> float:
+    if not values:
+        return float("nan")
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+async def receive(client: AsyncClient, latencies: list, expected: int):
+    count = 0
+    while count < expected:
+        d = await client.recv()
+        if d is None:
+            break
+        if isinstance(d, TextMessage):
+            latencies.append(time.monotonic() - float(d.message))
+            count += 1
+
+
+async def send(client: AsyncClient, channel: str, messages: int):
+    for _ in range(messages):
+        await client.send(TextMessage(repr(time.monotonic()), channel))
+
+
+async def run_load(port: int, clients: int = 50, senders: int = 5, messages: int = 200,
+                   channel: str = "#bench", timeout: float = 60) -> dict:
+    """Floods one channel and reports delivered msgs/sec and fan-out latency."""
+    sessions = []
+    for i in range(clients):
+        client = AsyncClient(f"bench{i}")
+        await client.connect(("localhost", port))
+        await client.send(CDProto.join(channel))
+        sessions.append(client)
+    await asyncio.sleep(0.2)
+
+    latencies = []
+    expected = senders * messages
+    start = time.monotonic()
+    receivers = [asyncio.ensure_future(receive(c, latencies, expected)) for c in sessions]
+    await asyncio.gather(*(send(c, channel, messages) for c in sessions[:senders]))
+    await asyncio.wait(receivers, timeout=timeout)
+    elapsed = time.monotonic() - start
+    for task in receivers:
+        task.cancel()
+    for client in sessions:
+        await client.close()
+
+    return {
+        "clients": clients,
+        "senders": senders,
+        "sent": expected,
+        "delivered": len(latencies),
+        "expected": expected * clients,
+        "msgs_per_sec": len(latencies) / elapsed,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+    }
+
+
+def bench(kind: str, port: int, workers: int = 1, logging: str = "off", **load) -> dict:
+    """Starts a server of the given kind, runs one load and stops it."""
+    proc = start_server(kind, port, workers, logging)
+    try:
+        return asyncio.run(run_load(port, **load))
+    finally:
+        proc.terminate()
+        proc.wait()
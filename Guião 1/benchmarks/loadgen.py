@@ -0,0 +1,190 @@
+"""Load generator for the chat servers.
+
+Opens many CDProto connections to a server, spreads them over a number of
+channels and lets some of them send a mix of channel messages and
+join/leave pairs. Reports delivered messages/sec, fan-out latency
+percentiles and the server CPU and peak RSS of the median of a few runs,
+and can save the results as JSON and compare them against an earlier run:
+
+    python -m benchmarks.loadgen --clients 2000 --channels 20 --output new.json
+    python -m benchmarks.loadgen --clients 2000 --channels 20 --compare new.json
+
+Run from the assignment folder. The CPU and RSS figures come from /proc."""
+import argparse
+import asyncio
+import json
+import platform
+import random
+import subprocess
+import sys
+import time
+
+from src.aioclient import AsyncClient
+from src.protocol import CDProto, TextMessage
+
+from .harness import ROOT, SERVERS, percentile, server_usage, start_server
+
+# Result fields compared by --compare, with the direction that is better.
+METRICS = {"msgs_per_sec": 1, "p50_ms": -1, "p99_ms": -1, "server_cpu_s": -1, "server_rss_mb": -1}
+
+
+async def connect(port: int, clients: int, channels: int, binary: bool, batch: int = 100) -> list:
+    """Connects the clients in batches; client i joins channel i % channels."""
+    sessions = []
+
+    async def session(i):
+        client = AsyncClient(f"load{i}", binary)
+        await client.connect(("localhost", port))
+        await client.send(CDProto.join(f"#load{i % channels}"))
+        return client
+
+    for first in range(0, clients, batch):
+        sessions += await asyncio.gather(*(session(i) for i in range(first, min(first + batch, clients))))
+    return sessions
+
+
+async def receive(client: AsyncClient, latencies: list, done: asyncio.Event, expected: int):
+    while True:
+        d = await client.recv()
+        if d is None:
+            return
+        if isinstance(d, TextMessage):
+            latencies.append(time.monotonic() - float(d.message))
+            if len(latencies) >= expected:
+                done.set()
+
+
+async def send(client: AsyncClient, channel: str, messages: int, join_ratio: float, rate: float, rng: random.Random):
+    """Sends messages to channel, with join/leave pairs mixed in at join_ratio.
+
+    With rate, messages are paced at that many per second."""
+    interval = 1 / rate if rate else 0
+    start = time.monotonic()
+    for n in range(messages):
+        if rng.random() < join_ratio:
+            churn = f"#churn{rng.randrange(16)}"
+            await client.send(CDProto.join(churn))
+            await client.send(CDProto.leave(churn))
+        await client.send(TextMessage(repr(time.monotonic()), channel))
+        if interval:
+            await asyncio.sleep(max(0, start + (n + 1) * interval - time.monotonic()))
+
+
+async def run(port: int, pid: int, clients: int = 1000, channels: int = 10, senders: int = 10, messages: int = 100,
+              join_ratio: float = 0.0, rate: float = 0.0, binary: bool = False, seed: int = 0, timeout: float = 120) -> dict:
+    """Runs one load against the server listening on port, whose process is pid."""
+    rng = random.Random(seed)
+    sessions = await connect(port, clients, channels, binary)
+    await asyncio.sleep(0.5)
+
+    members = [len(range(c, clients, channels)) for c in range(channels)]
+    expected = sum(members[i % channels] for i in range(senders)) * messages
+    latencies = []
+    done = asyncio.Event()
+    if not expected:
+        done.set()
+
+    cpu, rss = server_usage(pid)
+    peak = rss
+    start = time.monotonic()
+    receivers = [asyncio.ensure_future(receive(c, latencies, done, expected)) for c in sessions]
+    senders_done = asyncio.gather(*(send(c, f"#load{i % channels}", messages, join_ratio, rate, rng)
+                                    for i, c in enumerate(sessions[:senders])))
+    waiter = asyncio.ensure_future(done.wait())
+    deadline = start + timeout
+    while not waiter.done() and time.monotonic() < deadline:
+        await asyncio.wait([waiter], timeout=0.1)
+        peak = max(peak, server_usage(pid)[1])
+    elapsed = time.monotonic() - start
+    await senders_done
+    used = server_usage(pid)[0] - cpu
+    waiter.cancel()
+    for task in receivers:
+        task.cancel()
+    for client in sessions:
+        client.writer.close()
+
+    return {
+        "sent": senders * messages,
+        "delivered": len(latencies),
+        "expected": expected,
+        "seconds": elapsed,
+        "msgs_per_sec": len(latencies) / elapsed,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p90_ms": percentile(latencies, 90) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "max_ms": max(latencies, default=float("nan")) * 1000,
+        "server_cpu_s": used,
+        "server_cpu_pct": 100 * used / elapsed,
+        "server_rss_mb": peak / (1 << 20),
+    }
+
+
+def version() -> str:
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], cwd=ROOT,
+                              capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return ""
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> bool:
+    """Prints the change of every metric. Returns False on a regression."""
+    ok = True
+    for name, better in METRICS.items():
+        old, new = baseline["results"].get(name), results["results"].get(name)
+        if not old or new is None:
+            continue
+        change = (new - old) / old
+        worse = -change * better > tolerance
+        ok = ok and not worse
+        print(f"{name:>14} {old:>10.2f} -> {new:>10.2f} {change:>+8.1%}{'  REGRESSION' if worse else ''}")
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--server", choices=SERVERS, default="selectors")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--port", type=int, default=5250)
+    parser.add_argument("--clients", type=int, default=1000)
+    parser.add_argument("--channels", type=int, default=10)
+    parser.add_argument("--senders", type=int, default=10)
+    parser.add_argument("--messages", type=int, default=100, help="messages per sender")
+    parser.add_argument("--join-ratio", type=float, default=0.0, help="join/leave pairs per message")
+    parser.add_argument("--rate", type=float, default=0.0, help="messages/sec per sender, 0 for unpaced")
+    parser.add_argument("--binary", action="store_true")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--repeat", type=int, default=3, help="runs, the median by msgs/sec is reported")
+    parser.add_argument("--output", help="save the results to this JSON file")
+    parser.add_argument("--compare", help="JSON file of an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="relative change counted as a regression")
+    args = parser.parse_args()
+
+    config = {k: v for k, v in vars(args).items() if k not in ("port", "output", "compare", "tolerance")}
+    proc = start_server(args.server, args.port, args.workers)
+    try:
+        runs = [asyncio.run(run(args.port, proc.pid, args.clients, args.channels, args.senders, args.messages,
+                                args.join_ratio, args.rate, args.binary, args.seed, args.timeout))
+                for _ in range(args.repeat)]
+    finally:
+        proc.terminate()
+        proc.wait()
+
+    runs.sort(key=lambda r: r["msgs_per_sec"])
+    results = runs[len(runs) // 2]
+    report = {"version": version(), "python": platform.python_version(), "time": time.time(),
+              "config": config, "results": results, "runs": [r["msgs_per_sec"] for r in runs]}
+    for name, value in results.items():
+        print(f"{name:>14} {value:>10.2f}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline.get("config") != config:
+            print("warning: the baseline was run with a different configuration")
+        if not compare(report, baseline, args.tolerance):
+            sys.exit(1)
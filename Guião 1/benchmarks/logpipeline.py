@@ -0,0 +1,48 @@
+"""Benchmark: selectors Server throughput with logging off, synchronous
+DEBUG logging and the batched background pipeline, plus the cost of one
+logging.debug call as seen by the event loop in each mode.
+
+Run from the assignment folder with ``python -m benchmarks.logpipeline``."""
+import argparse
+import os
+import subprocess
+import sys
+
+from .harness import LOGGING, ROOT, bench
+
+CALL = """
+import time
+from src.protocol import TextMessage
+msg = TextMessage("Hello darkness, my old friend", "#cd")
+start = time.perf_counter()
+for _ in range({n}):
+    logging.debug('received "%s"', msg)
+print((time.perf_counter() - start) / {n})
+"""
+
+
+def call_cost(mode: str, n: int = 100000) -> float:
+    code = LOGGING[mode] + "import logging\n" + CALL.format(n=n)
+    out = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True, check=True)
+    return float(out.stdout)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=5238)
+    parser.add_argument("--clients", type=int, default=50)
+    parser.add_argument("--senders", type=int, default=5)
+    parser.add_argument("--messages", type=int, default=200)
+    args = parser.parse_args()
+
+    print(f"{'logging':>8} {'msgs/sec':>10} {'p99':>9} {'delivered':>12}")
+    for mode in LOGGING:
+        r = bench("selectors", args.port, logging=mode,
+                  clients=args.clients, senders=args.senders, messages=args.messages)
+        print(f"{mode:>8} {r['msgs_per_sec']:>10.0f} {r['p99_ms']:>7.2f}ms {r['delivered']:>6}/{r['expected']}")
+
+    print(f"\n{'logging':>8} {'per debug call':>15}")
+    for mode in LOGGING:
+        print(f"{mode:>8} {call_cost(mode) * 1e6:>13.2f}us")
+    path = os.path.join(ROOT, "bench.log")
+    if os.path.exists(path):
+        os.remove(path)
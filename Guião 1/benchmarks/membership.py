@@ -0,0 +1,73 @@
+"""Benchmark: channel membership updates with list scans vs the set index.
+
+10k connections spread over 1k channels join, move to another channel and
+disconnect. Run from the assignment folder with
+``python -m benchmarks.membership``."""
+import time
+
+from src.server import Server
+
+CONNECTIONS = 10000
+CHANNELS = 1000
+
+
+class ListMembership:
+    """The original list based bookkeeping of Server.read."""
+
+    def __init__(self):
+        self.users = {"Initial": []}
+
+    def join(self, conn, channel):
+        self.users.setdefault(channel, [])
+        for key in self.users.keys():
+            if conn in self.users[key]:
+                self.users[key].remove(conn)
+        self.users[channel].append(conn)
+
+    def disconnect(self, conn):
+        for key in self.users.keys():
+            if conn in self.users[key]:
+                self.users[key].remove(conn)
+
+
+class SetMembership:
+    """Server.join/Server.part on a server bound to an ephemeral port."""
+
+    def __init__(self):
+        self.server = Server(("localhost", 0))
+
+    def join(self, conn, channel):
+        self.server.part(conn)
+        self.server.join(conn, channel)
+
+    def disconnect(self, conn):
+        self.server.part(conn)
+
+
+def run(impl) -> dict:
+    conns = range(CONNECTIONS)
+    timings = {}
+
+    start = time.perf_counter()
+    for conn in conns:
+        impl.join(conn, f"#{conn % CHANNELS}")
+    timings["join"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for conn in conns:
+        impl.join(conn, f"#{(conn + 1) % CHANNELS}")
+    timings["move"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for conn in conns:
+        impl.disconnect(conn)
+    timings["disconnect"] = time.perf_counter() - start
+    return timings
+
+
+if __name__ == "__main__":
+    print(f"{CONNECTIONS} connections over {CHANNELS} channels")
+    for impl in (ListMembership, SetMembership):
+        timings = run(impl())
+        print(f"{impl.__name__:>15}: " + "  ".join(
+            f"{op} {t * 1e6 / CONNECTIONS:8.2f}us/op" for op, t in timings.items()))
@@ -0,0 +1,50 @@
+"""Benchmark: size and allocation cost of the CDProto message objects.
+
+Measures with tracemalloc the memory held by a batch of live TextMessages
+and the bytes allocated per message on the server hot path (decode, log
+the message, encode it for two formats), and times each step. Run from
+the assignment folder with ``python -m benchmarks.messages``."""
+import timeit
+import tracemalloc
+
+from src.protocol import CDProto, TextMessage
+
+N = 100000
+FRAME = CDProto.encode(TextMessage("Hello darkness, my old friend", "#cd", 1615852800))
+
+
+def hot_path():
+    msg = CDProto.decode_frame(FRAME)
+    repr(msg)
+    CDProto.encode(msg)
+    CDProto.encode(msg, True, True)
+    return msg
+
+
+def traced(fn) -> tuple:
+    """Bytes still held after fn() and the peak reached while running it."""
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    before = tracemalloc.get_traced_memory()[0]
+    result = fn()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return current - before, peak - before
+
+
+def per_op(stmt, number: int = 20000) -> float:
+    return min(timeit.repeat(stmt, number=number, repeat=5)) / number
+
+
+if __name__ == "__main__":
+    held, peak = traced(lambda: [TextMessage("Hello", "#cd") for _ in range(N)])
+    print(f"{'live TextMessage':>22} {held / N:>8.1f} B/msg")
+    held, peak = traced(lambda: [hot_path() for _ in range(N)])
+    print(f"{'decoded + encoded':>22} {held / N:>8.1f} B/msg held {peak / N:>8.1f} B/msg peak")
+
+    print(f"{'new TextMessage':>22} {per_op(lambda: TextMessage('Hello', '#cd')) * 1e6:>8.2f} us")
+    print(f"{'decode':>22} {per_op(lambda: CDProto.decode_frame(FRAME)) * 1e6:>8.2f} us")
+    msg = CDProto.decode_frame(FRAME)
+    print(f"{'encode json again':>22} {per_op(lambda: CDProto.encode(msg)) * 1e6:>8.2f} us")
+    print(f"{'hot path':>22} {per_op(hot_path) * 1e6:>8.2f} us")
@@ -0,0 +1,44 @@
+"""Benchmark: a bot posting bursts of messages over a socket pair.
+
+Bursts of frames are sent either with one sendall per frame or joined in
+a single sendall, like the Client console does, and read back with
+CDProtoReader.recv, which reads a whole burst with one recv. Reports
+messages/sec for each. Run from the assignment folder with
+``python -m benchmarks.pipelining``."""
+import socket
+import time
+
+from src.protocol import CDProto, CDProtoReader, TextMessage
+
+BURST = 50
+BURSTS = 2000
+
+
+def run(coalesce: bool) -> float:
+    a, b = socket.socketpair()
+    b.setblocking(False)
+    frames = [CDProto.encode(TextMessage(f"message {i}", "#burst", i)) for i in range(BURST)]
+    reader = CDProtoReader()
+    start = time.perf_counter()
+    for _ in range(BURSTS):
+        if coalesce:
+            a.sendall(b"".join(frames))
+        else:
+            for frame in frames:
+                a.sendall(frame)
+        received = 0
+        while received < BURST:
+            reader.recv(b)
+            while reader.pop() is not None:
+                received += 1
+    elapsed = time.perf_counter() - start
+    a.close()
+    b.close()
+    return BURST * BURSTS / elapsed
+
+
+if __name__ == "__main__":
+    print(f"{'send':>12} {'msgs/s':>10}")
+    for coalesce in (False, True):
+        rate = max(run(coalesce) for _ in range(3))
+        print(f"{'coalesced' if coalesce else 'per message':>12} {rate:>10.0f}")
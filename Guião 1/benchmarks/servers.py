@@ -0,0 +1,20 @@
+"""Benchmark: selectors Server vs asyncio AsyncServer.
+
+Run from the assignment folder with ``python -m benchmarks.servers``."""
+import argparse
+
+from .harness import SERVERS, bench
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=5236)
+    parser.add_argument("--clients", type=int, default=50)
+    parser.add_argument("--senders", type=int, default=5)
+    parser.add_argument("--messages", type=int, default=200)
+    args = parser.parse_args()
+
+    print(f"{'server':>10} {'msgs/sec':>10} {'p50':>9} {'p99':>9} {'delivered':>12}")
+    for kind in SERVERS:
+        r = bench(kind, args.port, clients=args.clients, senders=args.senders, messages=args.messages)
+        print(f"{kind:>10} {r['msgs_per_sec']:>10.0f} {r['p50_ms']:>7.2f}ms {r['p99_ms']:>7.2f}ms"
+              f" {r['delivered']:>6}/{r['expected']}")
@@ -0,0 +1,62 @@
+"""Benchmark: idle timeouts on a timer wheel vs scanning every connection.
+
+N connections have a 30 s idle timeout. In the "active" run every
+connection sends something every 10 s, so no timeout is due; in the
+"idle" run nobody does and every connection is due once per 30 s. Reports
+the time per 1 s tick spent finding the expired connections, with the
+TimerWheel (advance) and with a full scan of a deadline dict, and the
+cost of postponing one timer. Run from the assignment folder with
+``python -m benchmarks.timers``."""
+import time
+
+from src.timers import TimerWheel
+
+SIZES = (1000, 10000, 100000, 300000)
+IDLE = 30.0
+EVERY = 10
+TICKS = 120
+
+
+def wheel(n: int, active: bool) -> tuple:
+    w = TimerWheel(tick=1.0, clock=lambda: 0.0)
+    for conn in range(n):
+        w.schedule(conn, IDLE * (conn + 1) / n)
+    checking = touching = 0.0
+    for t in range(1, TICKS + 1):
+        start = time.perf_counter()
+        expired = w.advance(float(t))
+        checking += time.perf_counter() - start
+        start = time.perf_counter()
+        for conn in expired:
+            w.schedule(conn, IDLE)
+        if active:
+            for conn in range(t % EVERY, n, EVERY):
+                w.schedule(conn, IDLE)
+        touching += time.perf_counter() - start
+    touches = TICKS * n / EVERY if active else TICKS * n / IDLE
+    return checking / TICKS, touching / touches
+
+
+def scan(n: int, active: bool) -> tuple:
+    deadlines = {conn: IDLE * (conn + 1) / n for conn in range(n)}
+    checking = 0.0
+    for t in range(1, TICKS + 1):
+        now = float(t)
+        start = time.perf_counter()
+        expired = [conn for conn, deadline in deadlines.items() if deadline <= now]
+        checking += time.perf_counter() - start
+        for conn in expired:
+            deadlines[conn] = now + IDLE
+        if active:
+            for conn in range(t % EVERY, n, EVERY):
+                deadlines[conn] = now + IDLE
+    return checking / TICKS, None
+
+
+if __name__ == "__main__":
+    print(f"{'connections':>12} {'run':>7} {'wheel/tick':>11} {'scan/tick':>11} {'postpone':>9}")
+    for n in SIZES:
+        for active in (True, False):
+            w, postpone = wheel(n, active)
+            s, _ = scan(n, active)
+            print(f"{n:>12} {'active' if active else 'idle':>7} {w * 1e3:>9.3f}ms {s * 1e3:>9.3f}ms {postpone * 1e9:>7.0f}ns")
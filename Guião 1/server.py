@@ -1,6 +1,20 @@
-from src.server import Server
+import argparse
+
+from src.cluster import serve
 
 if __name__ == "__main__":
-    s = Server()
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=1, help="worker processes sharing the port (0: one per core)")
+    parser.add_argument("--log-dir", help="keep a persistent channel log in this directory")
+    parser.add_argument("--admin", type=int, help="serve Prometheus metrics on this localhost port")
+    parser.add_argument("--rate", type=float, help="messages per second allowed to each client")
+    parser.add_argument("--burst", type=float, help="messages a client may send at once (default: twice the rate)")
+    parser.add_argument("--channel-rate", type=float, help="messages per second allowed to each channel, per worker")
+    parser.add_argument("--channel-burst", type=float, help="messages a channel may get at once")
+    parser.add_argument("--heartbeat", type=float, help="ping clients idle for this many seconds (default: never)")
+    parser.add_argument("--ping-timeout", type=float, default=10, help="seconds a pinged client has to answer")
+    args = parser.parse_args()
 
-    s.loop()
+    serve(args.workers, log_dir=args.log_dir, admin=("localhost", args.admin) if args.admin else None,
+          rate=args.rate, burst=args.burst, channel_rate=args.channel_rate, channel_burst=args.channel_burst,
+          heartbeat=args.heartbeat, ping_timeout=args.ping_timeout)
@@ -0,0 +1,21 @@
+"""Event loop shared by the asyncio server and client."""
+import asyncio
+
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
+
+def new_event_loop() -> asyncio.AbstractEventLoop:
+    """A new event loop, from uvloop when it is installed."""
+    if uvloop is not None:
+        return uvloop.new_event_loop()
+    return asyncio.new_event_loop()
+
+
+def run(coro):
+    """Runs a coroutine on uvloop when it is installed, asyncio otherwise."""
+    if uvloop is not None:
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    return asyncio.run(coro)
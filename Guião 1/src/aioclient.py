@@ -0,0 +1,205 @@
+"""CD Chat client library on top of asyncio, and the terminal console of
+client.Client built on it."""
+import asyncio
+import logging
+import os
+import sys
+
+from .console import show
+from .protocol import (CDProto, CDProtoBadFormat, CDProtoReader, DirectMessage, JoinMessage, LeaveMessage, ListMessage, Message,
+                       PingMessage, PongMessage, TextMessage, WhoMessage)
+
+
+class AsyncClient:
+    """Chat Client speaking CDProto over asyncio streams.
+
+    Does no I/O besides its connection, so many sessions can share one
+    event loop:
+
+        async with AsyncClient("bot") as client:
+            await client.connect(address)
+            await client.join("#cd")
+            async for msg in client:
+                ...
+
+    Pings from the server are answered while receiving."""
+
+    def __init__(self, name: str = "Foo", binary: bool = False, varint: bool = False):
+        self.name = name
+        self.binary = binary
+        self.varint = varint
+        self.channel = None     # channel of say() when none is given
+        self.channels = []
+        self.reader = CDProtoReader(varint=varint)
+        self.stream = None
+        self.writer = None
+
+    async def connect(self, address: tuple = ('localhost', 1236)):
+        """Connect to chat server and register the username."""
+        self.stream, self.writer = await asyncio.open_connection(*address)
+        register = CDProto.register(self.name, "binary" if self.binary else None, "varint" if self.varint else None)
+        self.writer.write(CDProto.encode(register, self.binary))
+        await self.writer.drain()
+
+    async def send(self, *msgs: Message):
+        """Sends Message objects, in a single write."""
+        self.writer.write(b"".join(CDProto.encode(msg, self.binary, self.varint) for msg in msgs))
+        await self.writer.drain()
+
+    def joined(self, channel: str):
+        """Notes a join: the channel becomes the current one."""
+        if channel not in self.channels:
+            self.channels.append(channel)
+        self.channel = channel
+
+    def left(self, channel: str):
+        """Notes a leave: the last joined channel left becomes the current."""
+        if channel in self.channels:
+            self.channels.remove(channel)
+        if self.channel == channel:
+            self.channel = self.channels[-1] if self.channels else None
+
+    async def join(self, channel: str):
+        """Joins a channel, which becomes the current one."""
+        self.joined(channel)
+        await self.send(JoinMessage(channel))
+
+    async def leave(self, channel: str):
+        """Leaves a channel. The last joined one left becomes the current."""
+        self.left(channel)
+        await self.send(LeaveMessage(channel))
+
+    async def say(self, text: str, channel: str = None):
+        """Sends text to a channel, the current one by default."""
+        await self.send(TextMessage(text, channel or self.channel))
+
+    async def direct(self, to: str, text: str):
+        """Sends text to the user to only."""
+        await self.send(DirectMessage(text, to))
+
+    async def who(self, channel: str = None):
+        """Asks for the users of a channel, or online; the answer is a WhoMessage."""
+        await self.send(WhoMessage(channel))
+
+    async def list(self):
+        """Asks for the channels; the answer is a ListMessage."""
+        await self.send(ListMessage())
+
+    async def recv(self) -> Message:
+        """Waits for the next message from the server. Returns None on EOF.
+
+        Pings are answered here and not returned."""
+        while True:
+            try:
+                d = self.reader.pop()
+            except CDProtoBadFormat:
+                continue
+            if isinstance(d, PingMessage):
+                self.writer.write(CDProto.encode(PongMessage(), self.binary, self.varint))
+                continue
+            if d is not None:
+                return d
+            data = await self.stream.read(self.reader.bufsize)
+            if not data:
+                return None
+            self.reader.feed(data)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> Message:
+        d = await self.recv()
+        if d is None:
+            raise StopAsyncIteration
+        return d
+
+    async def close(self):
+        if self.writer is None:
+            return
+        self.writer.close()
+        try:
+            await self.writer.wait_closed()
+        except ConnectionError:
+            pass
+        self.writer = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+
+def command(client: AsyncClient, line: str) -> Message:
+    """The message for an input line: a /command or text for the current
+    channel. Joins and leaves are noted on the client right away, so the
+    next lines go to the right channel."""
+    if line.startswith("/join"):
+        channel = line.replace("/join", "").strip()
+        client.joined(channel)
+        return JoinMessage(channel)
+    elif line.startswith("/leave"):
+        channel = line.replace("/leave", "").strip()
+        client.left(channel)
+        return LeaveMessage(channel)
+    elif line.startswith("/who"):
+        return WhoMessage(line.replace("/who", "").strip() or None)
+    elif line.startswith("/list"):
+        return ListMessage()
+    elif line.startswith("/msg "):
+        to, _, text = line[len("/msg "):].lstrip().partition(" ")
+        return DirectMessage(text, to)
+    return TextMessage(line, client.channel)
+
+
+async def send(client: AsyncClient, msgs: list):
+    """Sends the messages of the lines read at once in a single write,
+    leaving out the ones too long for the framing."""
+    if not msgs:
+        return
+    try:
+        await client.send(*msgs)
+    except OverflowError:
+        for msg in msgs:
+            try:
+                await client.send(msg)
+            except OverflowError:
+                logging.warning('message too long, not sent')
+    for msg in msgs:
+        logging.debug('sent "%s"', msg)
+
+
+async def print_messages(client: AsyncClient):
+    async for d in client:
+        text = show(d)
+        if text is not None:
+            print(text)
+        logging.debug('received "%s"', d)
+
+
+async def console(client: AsyncClient):
+    """Prints received messages and sends stdin lines until exit."""
+    chunks = asyncio.Queue()
+    loop = asyncio.get_running_loop()
+    # Raw reads: sys.stdin.readline() would keep any further lines in its buffer, where the selector does not see them.
+    loop.add_reader(sys.stdin, lambda: chunks.put_nowait(os.read(sys.stdin.fileno(), 65536)))
+    receiver = asyncio.ensure_future(print_messages(client))
+    pending = b""
+    try:
+        while True:
+            chunk = await chunks.get()
+            if not chunk:
+                break
+            *lines, pending = (pending + chunk).split(b"\n")
+            msgs = []
+            for line in lines:
+                line = line.decode()
+                if line.rstrip() == "exit":
+                    await send(client, msgs)
+                    return
+                msgs.append(command(client, line + "\n"))
+            await send(client, msgs)
+    finally:
+        loop.remove_reader(sys.stdin)
+        receiver.cancel()
+        await client.close()
@@ -0,0 +1,132 @@
+"""CD Chat server program on top of asyncio."""
+import asyncio
+import logging
+
+from .aio import run
+from .history import ChannelHistory
+from .protocol import (CDProto, CDProtoBadFormat, CDProtoReader, DirectMessage, JoinMessage, LeaveMessage, ListMessage,
+                       PingMessage, PongMessage, RegisterMessage, TextMessage, WhoMessage)
+from .server import Channels
+
+
+class AsyncServer(Channels):
+    """Chat Server speaking CDProto over asyncio streams."""
+    def __init__(self, address: tuple = ('localhost', 1236), max_buffer: int = 1 << 22, history: int = 100, history_bytes: int = 1 << 20):
+        super().__init__()
+        self.address = address
+        self.max_buffer = max_buffer
+        self.formats = {}
+        self.history = ChannelHistory(history, history_bytes)
+        self.server = None
+
+    async def start(self):
+        """Starts listening on the server address."""
+        host, port = self.address
+        self.server = await asyncio.start_server(self.serve, host, port)
+        return self.server
+
+    async def loop(self):
+        """Serve indefinetely."""
+        if self.server is None:
+            await self.start()
+        async with self.server:
+            await self.server.serve_forever()
+
+    async def serve(self, stream: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Handles one client connection until it is closed."""
+        reader = CDProtoReader()
+        try:
+            while True:
+                data = await stream.read(reader.bufsize)
+                if not data:
+                    break
+                reader.feed(data)
+                self.process(writer, reader)
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self.part(writer)
+            self.formats.pop(writer, None)
+            self.presence.unregister(writer)
+            writer.close()
+
+    def process(self, writer, reader):
+        """Handles the complete frames buffered for a connection."""
+        self.presence.touch(writer)
+        while True:
+            try:
+                d = reader.pop()
+            except CDProtoBadFormat as e:
+                logging.warning('bad frame "%s"', e.original_msg)
+                continue
+            if d is None:
+                break
+            logging.debug('received "%s"', d)
+            if isinstance(d, RegisterMessage):
+                self.formats[writer] = (d.encoding == "binary", d.framing == "varint")
+                reader.varint = d.framing == "varint"
+                self.presence.register(writer, d.user)
+                self.join(writer, "Initial")
+
+            elif isinstance(d, JoinMessage):
+                self.leave(writer, "Initial")
+                self.join(writer, d.channel)
+                fmt = self.formats.get(writer, (False, False))
+                for frame in self.history.replay(d.channel, fmt, d.ts):
+                    self.send(writer, frame)
+
+            elif isinstance(d, LeaveMessage):
+                self.leave(writer, d.channel)
+
+            elif isinstance(d, TextMessage):
+                recipients = self.recipients(writer, d)
+                if not recipients:
+                    continue
+                frames = self.multicast(recipients, d)
+                self.history.add("Initial" if d.channel is None else d.channel, d, frames)
+                logging.debug('sent "%s" to %d clients', d, len(recipients))
+
+            elif isinstance(d, DirectMessage):
+                d = self.sign(writer, d)
+                if d is not None:
+                    self.multicast(self.presence.connections(d.to), d)
+
+            elif isinstance(d, WhoMessage):
+                self.multicast((writer,), WhoMessage(d.channel, self.who(d.channel)))
+
+            elif isinstance(d, ListMessage):
+                self.multicast((writer,), ListMessage(list(self.users)))
+
+            elif isinstance(d, PingMessage):
+                self.multicast((writer,), PongMessage())
+
+    def multicast(self, recipients, msg) -> dict:
+        """Writes a message to some clients, encoded once per format."""
+        frames = {}
+        for client in list(recipients):
+            fmt = self.formats.get(client, (False, False))
+            frame = frames.get(fmt)
+            if frame is None:
+                try:
+                    frame = frames[fmt] = CDProto.encode(msg, *fmt)
+                except OverflowError:
+                    frame = frames[fmt] = b""
+            if frame:
+                self.send(client, frame)
+        return frames
+
+    def send(self, writer, frame):
+        """Writes a frame to a client, dropping clients that stopped reading."""
+        if writer.is_closing():
+            return
+        if writer.transport.get_write_buffer_size() > self.max_buffer:
+            logging.warning('disconnecting slow client %s', writer.get_extra_info("peername"))
+            self.part(writer)
+            writer.close()
+            return
+        writer.write(frame)
+
+
+def main(address: tuple = ('localhost', 1236)):
+    run(AsyncServer(address).loop())
@@ -0,0 +1,197 @@
+"""Append-only persistent log of the chat channel messages."""
+import logging
+import mmap
+import os
+import time
+from array import array
+from bisect import bisect_left
+from struct import Struct
+
+from .protocol import TextMessage
+
+# Record header: payload length, index timestamp, channel length. The
+# channel name and the binary encoded TextMessage payload follow.
+RECORD = Struct(">IqH")
+SEGMENT_BITS = 40
+
+
+class ChatLog:
+    """Segmented append-only log of channel messages.
+
+    Records are appended to numbered segment files in a directory. A
+    segment is sealed once it reaches segment_bytes or gets older than
+    segment_seconds; sealed segments are deleted when they fall out of the
+    retention time or when the log exceeds max_bytes.
+
+    Every channel has an in-memory offset index: the timestamps of its
+    records and their locations (segment << 40 | offset), in two arrays
+    rebuilt by scanning the segments on startup. Replays memory-map the
+    segments and yield views into them, so nothing is copied or parsed
+    besides the records that are actually returned."""
+
+    def __init__(self, directory: str, segment_bytes: int = 1 << 26, segment_seconds: float = 86400,
+                 retention: float = None, max_bytes: int = None):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.segment_seconds = segment_seconds
+        self.retention = retention
+        self.max_bytes = max_bytes
+        self.index = {}     # channel -> (timestamps, locations)
+        self.segments = []  # [number, size, created, time of last record], oldest first
+        self.maps = {}      # sealed segment number -> mmap
+        self.file = None
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+
+    def _path(self, number: int) -> str:
+        return os.path.join(self.directory, f"{number:010d}.log")
+
+    def _load(self):
+        numbers = sorted(int(name[:-4]) for name in os.listdir(self.directory)
+                         if name.endswith(".log") and name[:-4].isdigit())
+        for number in numbers:
+            size = self._scan(number)
+            mtime = os.path.getmtime(self._path(number))
+            self.segments.append([number, size, mtime, mtime])
+        if not self.segments:
+            self.segments.append([0, 0, time.time(), time.time()])
+        number, size = self.segments[-1][:2]
+        self.file = open(self._path(number), "ab")
+        self.file.truncate(size)
+
+    def _scan(self, number: int) -> int:
+        """Indexes the records of a segment. Returns the size of its valid part."""
+        path = self._path(number)
+        if not os.path.getsize(path):
+            return 0
+        with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            pos, end = 0, len(mm)
+            while pos + RECORD.size <= end:
+                size, ts, name = RECORD.unpack_from(mm, pos)
+                stop = pos + RECORD.size + name + size
+                if stop > end:
+                    break
+                channel = mm[pos + RECORD.size:pos + RECORD.size + name].decode("utf-8", errors="replace")
+                self._index(channel, ts, number << SEGMENT_BITS | pos)
+                pos = stop
+        if pos != end:
+            logging.warning('truncating %d bytes of partial record in %s', end - pos, path)
+        return pos
+
+    def _index(self, channel: str, ts: int, location: int) -> int:
+        entry = self.index.get(channel)
+        if entry is None:
+            entry = self.index[channel] = (array("q"), array("Q"))
+        timestamps, locations = entry
+        # Timestamps come from the clients; keep the index sorted.
+        if timestamps and ts < timestamps[-1]:
+            ts = timestamps[-1]
+        timestamps.append(ts)
+        locations.append(location)
+        return ts
+
+    def append(self, channel: str, msg: TextMessage):
+        """Appends a message to the active segment."""
+        segment = self.segments[-1]
+        now = time.time()
+        if segment[1] >= self.segment_bytes or (segment[1] and now - segment[2] > self.segment_seconds):
+            self.rotate()
+            segment = self.segments[-1]
+        payload = msg.to_bytes()
+        name = channel.encode("utf-8")
+        ts = self._index(channel, msg.ts, segment[0] << SEGMENT_BITS | segment[1])
+        self.file.write(RECORD.pack(len(payload), ts, len(name)) + name + payload)
+        segment[1] += RECORD.size + len(name) + len(payload)
+        segment[3] = now
+
+    def flush(self):
+        """Hands the buffered records to the operating system."""
+        self.file.flush()
+
+    def rotate(self):
+        """Seals the active segment, starts a new one and applies retention."""
+        self.file.close()
+        number = self.segments[-1][0] + 1
+        self.segments.append([number, 0, time.time(), time.time()])
+        self.file = open(self._path(number), "ab")
+        self.expire()
+
+    def expire(self):
+        """Deletes the sealed segments that are past retention."""
+        now = time.time()
+        total = sum(segment[1] for segment in self.segments)
+        while len(self.segments) > 1:
+            number, size, created, last = self.segments[0]
+            old = self.retention is not None and now - last > self.retention
+            big = self.max_bytes is not None and total > self.max_bytes
+            if not (old or big):
+                break
+            self.segments.pop(0)
+            self.maps.pop(number, None)
+            os.remove(self._path(number))
+            total -= size
+            self._forget(self.segments[0][0] << SEGMENT_BITS)
+
+    def _forget(self, first: int):
+        """Drops the index entries that point before location first."""
+        for channel in list(self.index):
+            timestamps, locations = self.index[channel]
+            n = bisect_left(locations, first)
+            if n == len(locations):
+                del self.index[channel]
+            elif n:
+                del timestamps[:n]
+                del locations[:n]
+
+    def _map(self, number: int) -> mmap.mmap:
+        if number == self.segments[-1][0]:
+            # The active segment grows, map what has been written so far.
+            self.flush()
+            with open(self._path(number), "rb") as f:
+                return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        mm = self.maps.get(number)
+        if mm is None:
+            with open(self._path(number), "rb") as f:
+                mm = self.maps[number] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return mm
+
+    def replay(self, channel: str, since: int = None, limit: int = None):
+        """Yields (ts, payload) of the records of a channel, oldest first.
+
+        With since only records with ts >= since are returned, with limit
+        only the last limit of them. Payloads are memoryviews into the
+        mapped segments holding the binary encoded TextMessage."""
+        entry = self.index.get(channel)
+        if entry is None:
+            return
+        timestamps, locations = entry
+        start = 0 if since is None else bisect_left(timestamps, since)
+        if limit is not None:
+            start = max(start, len(locations) - limit)
+        timestamps, locations = timestamps[start:], locations[start:]
+        mask = (1 << SEGMENT_BITS) - 1
+        number, mm, view = None, None, None
+        for ts, location in zip(timestamps, locations):
+            if location >> SEGMENT_BITS != number:
+                number = location >> SEGMENT_BITS
+                try:
+                    mm = self._map(number)
+                    view = memoryview(mm)
+                except (FileNotFoundError, ValueError):
+                    mm = None
+            if mm is None:
+                continue
+            pos = location & mask
+            size, _, name = RECORD.unpack_from(mm, pos)
+            start = pos + RECORD.size + name
+            yield ts, view[start:start + size]
+
+    def channels(self) -> list:
+        return list(self.index)
+
+    def __len__(self) -> int:
+        return sum(len(locations) for _, locations in self.index.values())
+
+    def close(self):
+        self.file.close()
+        self.maps.clear()
@@ -0,0 +1,168 @@
+"""Multi-process CD Chat server.
+
+Every worker is a selectors Server listening on the same port with
+SO_REUSEPORT, so the kernel spreads the connections between them. The
+workers are linked by a mesh of Unix datagram socket pairs: a channel
+message broadcast by one worker is forwarded as one datagram to each of
+the others, which deliver it to their local members of that channel. Direct messages
+are forwarded the same way to the local connections of their recipient.
+Messages larger than the bus datagram size only reach the local members;
+the others wait in an outbox while the bus is full.
+who and list are answered from the registry of the worker."""
+import logging
+import os
+import selectors
+import signal
+import socket
+import sys
+from collections import deque
+
+from . import log
+from .chatlog import ChatLog
+from .protocol import CDProto, CDProtoBadFormat, DirectMessage, TextMessage
+from .server import Server
+
+MAX_DATAGRAM = 1 << 20
+
+
+class WorkerServer(Server):
+    """Chat Server that also routes channel messages through the worker bus.
+
+    When the bus to a worker is full, the datagrams wait in an outbox and
+    are sent when it is writable again. At most max_queue datagrams wait
+    for each worker; past that the oldest is dropped."""
+    def __init__(self, address: tuple, peers: list, **kwargs):
+        super().__init__(address, reuse_port=True, **kwargs)
+        self.peers = peers
+        self.outbox = {}    # peer -> datagrams waiting for room on the bus
+        for peer in peers:
+            peer.setblocking(False)
+            self.outbox[peer] = deque()
+            self.sel.register(peer, selectors.EVENT_READ, self.bus)
+
+    def broadcast(self, conn, msg: TextMessage) -> dict:
+        frames = super().broadcast(conn, msg)
+        if frames:
+            if (True, True) not in frames:
+                frames[True, True] = CDProto.encode(msg, True, True)
+            self.publish("Initial" if msg.channel is None else msg.channel, frames[True, True])
+        return frames
+
+    def direct(self, conn, msg: DirectMessage) -> DirectMessage:
+        msg = super().direct(conn, msg)
+        if msg is not None:
+            self.publish("", CDProto.encode(msg, True, True))
+        return msg
+
+    def publish(self, channel: str, frame: bytes):
+        """Forwards a binary, varint framed frame to the other workers."""
+        name = channel.encode("utf-8")
+        datagram = len(name).to_bytes(2, "big") + name + frame
+        for peer in self.peers:
+            outbox = self.outbox[peer]
+            if len(outbox) >= self.max_queue:
+                logging.warning('worker bus full, dropped the oldest message waiting for it')
+                outbox.popleft()
+            outbox.append(datagram)
+            if len(outbox) == 1:
+                self.flush(peer)
+
+    def flush(self, peer):
+        """Sends the datagrams waiting for a worker while the bus has room."""
+        outbox = self.outbox[peer]
+        while outbox:
+            try:
+                peer.send(outbox[0])
+            except (BlockingIOError, InterruptedError):
+                break
+            except OSError:
+                logging.warning('message too large for the worker bus')
+            outbox.popleft()
+        events = selectors.EVENT_READ | selectors.EVENT_WRITE if outbox else selectors.EVENT_READ
+        if self.sel.get_key(peer).events != events:
+            self.sel.modify(peer, events, self.bus)
+
+    def bus(self, peer, mask):
+        """Dispatches the selector events of the bus to another worker."""
+        if mask & selectors.EVENT_WRITE:
+            self.flush(peer)
+        if mask & selectors.EVENT_READ:
+            self.deliver(peer, mask)
+
+    def deliver(self, peer, mask):
+        """Hands the frames forwarded by another worker to the local members."""
+        while True:
+            try:
+                datagram = peer.recv(MAX_DATAGRAM)
+            except (BlockingIOError, InterruptedError):
+                return
+            if not datagram:
+                return
+            size = int.from_bytes(datagram[:2], "big")
+            channel = datagram[2:2 + size].decode("utf-8")
+            frame = datagram[2 + size:]
+            try:
+                msg = CDProto.decode_frame(frame, varint=True)
+            except CDProtoBadFormat:
+                logging.warning('bad frame from the worker bus')
+                continue
+            if isinstance(msg, DirectMessage):
+                self.deliver_direct(msg)
+                continue
+            self.fanout(self.users.get(channel, ()), msg, frames={(True, True): frame})
+
+
+def serve(workers: int = None, address: tuple = ('localhost', 1236), log_dir: str = None, admin: tuple = None, **kwargs):
+    """Forks the workers and waits for them. Stops them all on SIGINT/SIGTERM.
+
+    With log_dir every worker keeps its own ChatLog in a subdirectory; all
+    of them log every channel message, including the forwarded ones.
+    With admin worker i serves its metrics on the admin port + i."""
+    workers = workers or os.cpu_count() or 1
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    if workers == 1:
+        chatlog = ChatLog(log_dir) if log_dir else None
+        Server(address, log=chatlog, admin=admin, **kwargs).loop()
+        return
+
+    links = {}
+    for i in range(workers):
+        for j in range(i + 1, workers):
+            links[i, j], links[j, i] = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+            for sock in (links[i, j], links[j, i]):
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, MAX_DATAGRAM)
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, MAX_DATAGRAM)
+
+    pids = []
+    for i in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            peers = [sock for (a, b), sock in links.items() if a == i]
+            for (a, b), sock in links.items():
+                if a != i:
+                    sock.close()
+            try:
+                chatlog = ChatLog(os.path.join(log_dir, f"worker{i}")) if log_dir else None
+                port = (admin[0], admin[1] + i) if admin else None
+                WorkerServer(address, peers, log=chatlog, admin=port, **kwargs).loop()
+            finally:
+                log.shutdown()
+                os._exit(0)
+        pids.append(pid)
+
+    for sock in links.values():
+        sock.close()
+
+    def stop(signum, frame):
+        for pid in pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    try:
+        for _ in pids:
+            os.wait()
+    except KeyboardInterrupt:
+        stop(signal.SIGINT, None)
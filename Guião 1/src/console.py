@@ -0,0 +1,15 @@
+"""Text of the received messages printed by the chat client console."""
+from .protocol import DirectMessage, ListMessage, Message, TextMessage, WhoMessage
+
+
+def show(msg: Message) -> str:
+    """Text to print for a received message, or None."""
+    if isinstance(msg, TextMessage):
+        return msg.message
+    if isinstance(msg, DirectMessage):
+        return f"[{msg.sender}] {msg.message}"
+    if isinstance(msg, WhoMessage):
+        return f"{msg.channel or 'online'}: {', '.join(msg.users or ())}"
+    if isinstance(msg, ListMessage):
+        return f"channels: {', '.join(msg.channels or ())}"
+    return None
@@ -0,0 +1,68 @@
+"""Recent message history of the chat channels."""
+from collections import deque
+
+from .protocol import CDProto, TextMessage
+
+
+class ChannelHistory:
+    """Bounded ring buffer of the last messages of every channel.
+
+    Messages are kept together with the frames they were broadcast as,
+    keyed by (binary, varint) format like in Server.fanout, so a replay
+    writes the same bytes instead of serializing the messages again.
+    Each channel keeps at most max_messages entries and max_bytes of
+    frames; the oldest entries are evicted first."""
+
+    def __init__(self, max_messages: int = 100, max_bytes: int = 1 << 20):
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes
+        self.channels = {}  # channel -> deque of [ts, msg, frames, size]
+        self.sizes = {}     # channel -> bytes of frames kept
+
+    def add(self, channel: str, msg: TextMessage, frames: dict):
+        """Records a broadcast message and the frames it was encoded to."""
+        if not self.max_messages:
+            return
+        entries = self.channels.get(channel)
+        if entries is None:
+            entries = self.channels[channel] = deque()
+            self.sizes[channel] = 0
+        size = sum(len(frame) for frame in frames.values())
+        entries.append([msg.ts, msg, frames, size])
+        self.sizes[channel] += size
+        self._evict(channel)
+
+    def replay(self, channel: str, fmt: tuple = (False, False), since: int = None) -> list:
+        """Frames of the kept messages of a channel, oldest first.
+
+        With since, only messages with ts >= since are returned."""
+        entries = self.channels.get(channel)
+        if not entries:
+            return []
+        start = len(entries)
+        if since is None:
+            start = 0
+        else:
+            while start and entries[start - 1][0] >= since:
+                start -= 1
+        replay = []
+        for i in range(start, len(entries)):
+            entry = entries[i]
+            frames = entry[2]
+            frame = frames.get(fmt)
+            if frame is None:
+                try:
+                    frame = frames[fmt] = CDProto.encode(entry[1], *fmt)
+                except OverflowError:
+                    frame = frames[fmt] = b""
+                entry[3] += len(frame)
+                self.sizes[channel] += len(frame)
+            if frame:
+                replay.append(frame)
+        self._evict(channel)
+        return replay
+
+    def _evict(self, channel: str):
+        entries = self.channels[channel]
+        while entries and (len(entries) > self.max_messages or self.sizes[channel] > self.max_bytes):
+            self.sizes[channel] -= entries.popleft()[3]
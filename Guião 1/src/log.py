@@ -0,0 +1,115 @@
+"""Common logging configuration.
+
+Records are put on a queue by the event loop and written to the file by
+a background thread, in batches with one flush per batch and at most
+one wakeup per interval while the queue is not backed up. Messages are
+formatted in that thread too, so a logging call on the hot path costs a
+level check and, when enabled, a queue put."""
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+import time
+
+BATCH = 256
+INTERVAL = 0.05
+
+_writers = []
+
+
+class BatchFileHandler(logging.FileHandler):
+    """FileHandler that leaves flushing to the end of each batch."""
+
+    def emit(self, record):
+        try:
+            if self.stream is None:
+                self.stream = self._open()
+            self.stream.write(self.format(record) + self.terminator)
+        except Exception:
+            self.handleError(record)
+
+
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that defers formatting to the writer thread."""
+
+    def __init__(self, writer):
+        super().__init__(None)
+        self.writer = writer
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        self.writer.queue.put(record)
+
+
+class Writer:
+    """Background thread draining the log queue into a handler."""
+
+    def __init__(self, handler: logging.Handler, batch: int = BATCH, interval: float = INTERVAL):
+        self.handler = handler
+        self.batch = batch
+        self.interval = interval
+        self.queue = queue.SimpleQueue()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name="log-writer", daemon=True)
+        self.thread.start()
+
+    def restart(self):
+        """Replaces the queue and thread lost by a fork."""
+        self.queue = queue.SimpleQueue()
+        self.start()
+
+    def run(self):
+        while True:
+            records = [self.queue.get()]
+            while len(records) < self.batch:
+                try:
+                    records.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            for record in records:
+                if record is None:
+                    self.handler.flush()
+                    return
+                self.handler.emit(record)
+            self.handler.flush()
+            if len(records) < self.batch:
+                # Let records pile up instead of waking up for every one.
+                time.sleep(self.interval)
+
+    def stop(self):
+        """Writes out the queued records and stops the thread."""
+        if self.thread is not None and self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+
+
+def configure(filename: str, level: int = logging.DEBUG, batch: int = BATCH) -> Writer:
+    """Sends the root logger records through a batched background writer.
+
+    Like logging.basicConfig, nothing is done when the root logger already
+    has handlers."""
+    root = logging.getLogger()
+    if root.handlers:
+        return None
+    handler = BatchFileHandler(filename)
+    handler.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+    writer = Writer(handler, batch)
+    writer.start()
+    root.addHandler(LazyQueueHandler(writer))
+    root.setLevel(level)
+    _writers.append(writer)
+    os.register_at_fork(after_in_child=writer.restart)
+    return writer
+
+
+@atexit.register
+def shutdown():
+    """Writes out every queued record. Call it before os._exit."""
+    for writer in _writers:
+        writer.stop()
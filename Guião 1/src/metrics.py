@@ -0,0 +1,143 @@
+"""Counters of the chat server, exported in the Prometheus text format."""
+from bisect import bisect_left
+
+# Upper bounds, in seconds, of the loop lag histogram buckets.
+LOOP_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0)
+
+
+def _quote(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class ChannelStats:
+    """Counters of one channel."""
+    __slots__ = ("messages", "deliveries", "bytes")
+
+    def __init__(self):
+        self.messages = 0
+        self.deliveries = 0
+        self.bytes = 0
+
+
+class Metrics:
+    """Server wide counters.
+
+    The per-connection counters live in the CDProtoReader and CDProtoWriter
+    of every connection and are only read when the metrics are rendered;
+    the ones of closed connections are added to closed. Channel counters
+    are slots objects created when a channel gets its first message, so
+    counting a message is a few integer additions."""
+
+    def __init__(self):
+        self.accepted = 0
+        self.reaped = 0
+        self.throttled = 0
+        self.closed = [0, 0, 0, 0, 0]     # frames in, bytes in, frames out, bytes out, dropped
+        self.encodes = 0
+        self.encode_seconds = 0.0
+        self.loop_lag = [0] * (len(LOOP_BUCKETS) + 1)
+        self.loop_seconds = 0.0
+        self.loop_max = 0.0               # since the last render
+        self.channels = {}                # channel -> ChannelStats
+
+    def channel(self, name: str) -> ChannelStats:
+        stats = self.channels.get(name)
+        if stats is None:
+            stats = self.channels[name] = ChannelStats()
+        return stats
+
+    def observe_loop(self, seconds: float):
+        """Records the time spent handling one batch of selector events."""
+        self.loop_lag[bisect_left(LOOP_BUCKETS, seconds)] += 1
+        self.loop_seconds += seconds
+        if seconds > self.loop_max:
+            self.loop_max = seconds
+
+    def close(self, reader, writer):
+        """Keeps the counters of a connection that is going away."""
+        closed = self.closed
+        closed[0] += reader.frames
+        closed[1] += reader.received
+        closed[2] += writer.frames
+        closed[3] += writer.sent
+        closed[4] += writer.dropped
+
+    def render(self, server) -> str:
+        """The counters of a Server in the Prometheus text exposition format."""
+        lines = []
+
+        def metric(name, kind, text, samples):
+            lines.append(f"# HELP chat_{name} {text}")
+            lines.append(f"# TYPE chat_{name} {kind}")
+            for labels, value in samples:
+                lines.append(f"chat_{name}{labels} {value}")
+
+        totals = list(self.closed)
+        connections = []
+        for conn, reader in server.readers.items():
+            writer = server.writers[conn]
+            totals[0] += reader.frames
+            totals[1] += reader.received
+            totals[2] += writer.frames
+            totals[3] += writer.sent
+            totals[4] += writer.dropped
+            user = _quote(server.presence.names.get(conn, ""))
+            connections.append((f'{{connection="{conn.fileno()}",user="{user}"}}', conn, reader, writer))
+
+        metric("connections", "gauge", "Open client connections.", [("", len(server.readers))])
+        metric("users", "gauge", "Registered usernames online.", [("", len(server.presence.users))])
+        metric("connections_accepted_total", "counter", "Accepted client connections.", [("", self.accepted)])
+        metric("connections_reaped_total", "counter", "Clients disconnected for not answering a ping.", [("", self.reaped)])
+        metric("throttled_total", "counter", "Times a client was stopped for going over a rate limit.", [("", self.throttled)])
+        metric("frames_in_total", "counter", "Frames received from clients.", [("", totals[0])])
+        metric("bytes_in_total", "counter", "Bytes received from clients.", [("", totals[1])])
+        metric("frames_out_total", "counter", "Frames queued to clients.", [("", totals[2])])
+        metric("bytes_out_total", "counter", "Bytes sent to clients.", [("", totals[3])])
+        metric("frames_dropped_total", "counter", "Frames dropped from full queues.", [("", totals[4])])
+        metric("encodes_total", "counter", "Messages encoded for a fan-out.", [("", self.encodes)])
+        metric("encode_seconds_total", "counter", "Time spent encoding fan-out frames.", [("", self.encode_seconds)])
+
+        buckets, count = [], 0
+        for bound, n in zip(LOOP_BUCKETS + ("+Inf",), self.loop_lag):
+            count += n
+            buckets.append((f'{{le="{bound}"}}', count))
+        lines.append("# HELP chat_loop_lag_seconds Time spent handling one batch of selector events.")
+        lines.append("# TYPE chat_loop_lag_seconds histogram")
+        lines.extend(f"chat_loop_lag_seconds_bucket{labels} {value}" for labels, value in buckets)
+        lines.append(f"chat_loop_lag_seconds_sum {self.loop_seconds}")
+        lines.append(f"chat_loop_lag_seconds_count {count}")
+        metric("loop_lag_max_seconds", "gauge", "Longest batch of selector events since the last scrape.",
+               [("", self.loop_max)])
+        self.loop_max = 0.0
+
+        for name in list(self.channels):
+            if name not in server.users:
+                del self.channels[name]
+        channels = [(f'{{channel="{_quote(name)}"}}', stats) for name, stats in self.channels.items()]
+        metric("channel_members", "gauge", "Members of a channel.",
+               [(f'{{channel="{_quote(name)}"}}', len(members)) for name, members in server.users.items()])
+        metric("channel_messages_total", "counter", "Messages sent to a channel.",
+               [(labels, stats.messages) for labels, stats in channels])
+        metric("channel_deliveries_total", "counter", "Messages queued to the members of a channel.",
+               [(labels, stats.deliveries) for labels, stats in channels])
+        metric("channel_bytes_total", "counter", "Frame bytes queued to the members of a channel.",
+               [(labels, stats.bytes) for labels, stats in channels])
+
+        metric("connection_frames_in_total", "counter", "Frames received from a client.",
+               [(labels, reader.frames) for labels, conn, reader, writer in connections])
+        metric("connection_bytes_in_total", "counter", "Bytes received from a client.",
+               [(labels, reader.received) for labels, conn, reader, writer in connections])
+        metric("connection_frames_out_total", "counter", "Frames queued to a client.",
+               [(labels, writer.frames) for labels, conn, reader, writer in connections])
+        metric("connection_bytes_out_total", "counter", "Bytes sent to a client.",
+               [(labels, writer.sent) for labels, conn, reader, writer in connections])
+        metric("connection_frames_dropped_total", "counter", "Frames dropped from a client queue.",
+               [(labels, writer.dropped) for labels, conn, reader, writer in connections])
+        metric("connection_queue_depth", "gauge", "Frames waiting to be sent to a client.",
+               [(labels, writer.depth) for labels, conn, reader, writer in connections])
+        metric("connection_queue_bytes", "gauge", "Bytes waiting to be sent to a client.",
+               [(labels, len(writer)) for labels, conn, reader, writer in connections])
+        seen = server.presence.seen
+        metric("connection_last_activity_seconds", "gauge", "Time of the last message from a client.",
+               [(labels, seen[conn]) for labels, conn, reader, writer in connections if conn in seen])
+        return "\n".join(lines) + "\n"
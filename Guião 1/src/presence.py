@@ -0,0 +1,55 @@
+"""Registry of the users connected to a chat server."""
+import time
+
+
+class Presence:
+    """Index of the registered users and of their last activity.
+
+    A username may be registered by several connections at once; direct
+    messages reach all of them. Lookups by name or by connection are
+    dictionary accesses and listings cost the size of the result."""
+
+    def __init__(self):
+        self.users = {}     # username -> connections
+        self.names = {}     # connection -> username
+        self.seen = {}      # connection -> time of its last message
+
+    def register(self, conn, user: str):
+        """Records the username of a connection, replacing an earlier one."""
+        self.unregister(conn)
+        self.users.setdefault(user, set()).add(conn)
+        self.names[conn] = user
+        self.seen[conn] = time.time()
+
+    def unregister(self, conn):
+        """Forgets a connection."""
+        user = self.names.pop(conn, None)
+        self.seen.pop(conn, None)
+        if user is None:
+            return
+        conns = self.users[user]
+        conns.discard(conn)
+        if not conns:
+            del self.users[user]
+
+    def touch(self, conn):
+        """Marks a registered connection as active now."""
+        if conn in self.seen:
+            self.seen[conn] = time.time()
+
+    def connections(self, user: str):
+        """Connections of a username."""
+        return self.users.get(user, ())
+
+    def online(self) -> list:
+        """Usernames with at least one connection."""
+        return list(self.users)
+
+    def who(self, members) -> list:
+        """Usernames of the registered connections among members."""
+        names = self.names
+        return list(dict.fromkeys(names[conn] for conn in members if conn in names))
+
+    def last_seen(self, user: str) -> float:
+        """Time of the last message from any connection of a user, or None."""
+        return max((self.seen[conn] for conn in self.users.get(user, ())), default=None)
@@ -1,64 +1,322 @@
 """Protocol for chat server - Computação Distribuida Assignment 1."""
 import json
-from datetime import datetime
+import time
+from collections import deque
+from itertools import islice
 from socket import socket
 
+HEADER_SIZE = 2
+MAX_FRAME = 1 << 24
+
+# Command byte of the binary encoding. JSON payloads always start with "{",
+# so the first byte of a frame tells both encodings apart.
+BINARY_COMMANDS = {"register": 1, "join": 2, "leave": 3, "message": 4, "who": 5, "list": 6, "direct": 7, "ping": 8, "pong": 9}
+
+
+def _varint(n: int) -> bytes:
+    """Unsigned LEB128 encoding of n."""
+    if n < 0x80:
+        return bytes((n,))
+    out=bytearray()
+    while n >= 0x80:
+        out.append((n & 0x7f) | 0x80)
+        n>>=7
+    out.append(n)
+    return bytes(out)
+
+
+def _read_varint(data: bytes, pos: int) -> tuple:
+    """Reads an unsigned LEB128 integer. Returns (value, next position)."""
+    n=data[pos]
+    if n < 0x80:
+        return n, pos+1
+    n&=0x7f
+    shift=7
+    while True:
+        pos+=1
+        b=data[pos]
+        n|=(b & 0x7f) << shift
+        if b < 0x80:
+            return n, pos+1
+        shift+=7
+
+
+def _pack_str(value: str) -> bytes:
+    data=value.encode("utf-8")
+    return _varint(len(data))+data
+
+
+def _read_str(data: bytes, pos: int) -> tuple:
+    size, pos=_read_varint(data, pos)
+    if pos+size > len(data):
+        raise IndexError
+    return data[pos:pos+size].decode("utf-8"), pos+size
+
+
+def _pack_optional(value: str) -> bytes:
+    return b"\x00" if value is None else b"\x01"+_pack_str(value)
+
+
+def _read_optional(data: bytes, pos: int) -> tuple:
+    if data[pos]:
+        return _read_str(data, pos+1)
+    return None, pos+1
+
+
+def _pack_list(values: list) -> bytes:
+    """Optional list of strings: flag, count and the strings."""
+    if values is None:
+        return b"\x00"
+    return b"\x01"+_varint(len(values))+b"".join(_pack_str(v) for v in values)
+
+
+def _read_list(data: bytes, pos: int) -> tuple:
+    if not data[pos]:
+        return None, pos+1
+    count, pos=_read_varint(data, pos+1)
+    values=[]
+    for _ in range(count):
+        value, pos=_read_str(data, pos)
+        values.append(value)
+    return values, pos
+
+
+def _str_list(values) -> list:
+    if values is None:
+        return None
+    if not isinstance(values, list) or not all(isinstance(v, str) for v in values):
+        raise TypeError
+    return values
+
+
+def _str(value, optional: bool = False) -> str:
+    if value is None and optional:
+        return None
+    if not isinstance(value, str):
+        raise TypeError
+    return value
+
+
+def _ts(value, optional: bool = False) -> int:
+    if value is None and optional:
+        return None
+    if type(value) is not int or value < 0:
+        raise TypeError
+    return value
+
 
 class Message:
-    """Message Type."""
+    """Message Type.
+
+    Messages are not changed once built: the JSON and binary payloads are
+    cached the first time they are encoded."""
+    __slots__=("command", "_json", "_binary")
+
     def __init__(self, command):
         self.command=command
+        self._json=None
+        self._binary=None
 
     def __repr__(self):
-        return json.dumps({"command" : self.command })
+        return self.to_json().decode("utf-8")
+
+    def to_json(self) -> bytes:
+        """JSON encoding, as UTF-8 bytes."""
+        if self._json is None:
+            self._json=json.dumps(self._dict()).encode("utf-8")
+        return self._json
+
+    def to_bytes(self) -> bytes:
+        """Binary encoding: command byte followed by the fields."""
+        if self._binary is None:
+            self._binary=bytes((BINARY_COMMANDS[self.command],))+self._fields()
+        return self._binary
+
+    def _dict(self) -> dict:
+        return {"command" : self.command }
+
+    def _fields(self) -> bytes:
+        return b""
     
 class JoinMessage(Message):
-    """Message to join a chat channel."""
-    def __init__(self, channel):
+    """Message to join a chat channel.
+
+    ts asks the server to replay the channel history from that timestamp."""
+    __slots__=("channel", "ts")
+
+    def __init__(self, channel, ts = None):
         super().__init__("join")
         self.channel=channel
+        self.ts=ts
 
-    def __repr__(self):
-        return json.dumps({"command" : self.command , "channel" : self.channel})
+    def _dict(self):
+        if self.ts is None:
+            return {"command" : self.command , "channel" : self.channel}
+        return {"command" : self.command , "channel" : self.channel , "ts": self.ts}
+
+    def _fields(self):
+        ts=b"" if self.ts is None else _varint(self.ts)
+        return _pack_str(self.channel)+ts
+
+class LeaveMessage(Message):
+    """Message to leave a chat channel."""
+    __slots__=("channel",)
+
+    def __init__(self, channel):
+        super().__init__("leave")
+        self.channel=channel
+
+    def _dict(self):
+        return {"command" : self.command , "channel" : self.channel}
+
+    def _fields(self):
+        return _pack_str(self.channel)
 
 class RegisterMessage(Message):
-    """Message to register username in the server."""
-    def __init__(self, user):
+    """Message to register username in the server.
+
+    encoding="binary" asks the server to send binary frames from then on and
+    framing="varint" switches both directions to a varint length header,
+    which lifts the 64 KiB frame limit. The register frame itself always
+    uses the 2 byte header."""
+    __slots__=("user", "encoding", "framing")
+
+    def __init__(self, user, encoding = None, framing = None):
         super().__init__("register")
         self.user=user
-    def __repr__(self):
-        return json.dumps({"command" : self.command , "user" : self.user})
+        self.encoding=encoding
+        self.framing=framing
+
+    def _dict(self):
+        msg={"command" : self.command , "user" : self.user}
+        if self.encoding is not None:
+            msg["encoding"]=self.encoding
+        if self.framing is not None:
+            msg["framing"]=self.framing
+        return msg
+
+    def _fields(self):
+        return _pack_str(self.user)+(b"\x01" if self.framing == "varint" else b"")
     
 class TextMessage(Message):
-    """Message to chat with other clients."""
+    """Message to chat with other clients.
+
+    Without ts the message is stamped with the current time in seconds."""
+    __slots__=("message", "channel", "ts")
+
     def __init__(self, message, channel = None, ts = None):
         super().__init__("message")
         self.message=message
         self.channel=channel
-        if ts is None:
-            self.ts = int(datetime.now().timestamp())
-        else:
-            self.ts=ts
+        self.ts=int(time.time()) if ts is None else ts
 
-    def __repr__(self):
+    def _dict(self):
         if self.channel is None:
-            return json.dumps({"command" : self.command , "message" : self.message , "ts": self.ts})
+            return {"command" : self.command , "message" : self.message , "ts": self.ts}
         else:
-            return json.dumps({"command" : self.command , "message" : self.message , "channel" : self.channel , "ts": self.ts})
+            return {"command" : self.command , "message" : self.message , "channel" : self.channel , "ts": self.ts}
+
+    def _fields(self):
+        channel=b"\x00" if self.channel is None else b"\x01"+_pack_str(self.channel)
+        return _varint(self.ts)+_pack_str(self.message)+channel
+
+class DirectMessage(Message):
+    """Message to one user, delivered to its connections only.
+
+    The server fills in sender with the username of the connection the
+    message came from."""
+    __slots__=("message", "to", "sender", "ts")
+
+    def __init__(self, message, to, sender = None, ts = None):
+        super().__init__("direct")
+        self.message=message
+        self.to=to
+        self.sender=sender
+        self.ts=int(time.time()) if ts is None else ts
+
+    def _dict(self):
+        msg={"command" : self.command , "message" : self.message , "to" : self.to}
+        if self.sender is not None:
+            msg["from"]=self.sender
+        msg["ts"]=self.ts
+        return msg
+
+    def _fields(self):
+        return _varint(self.ts)+_pack_str(self.message)+_pack_str(self.to)+_pack_optional(self.sender)
+
+class WhoMessage(Message):
+    """Asks who is online, or in a channel.
+
+    The server answers with a WhoMessage with the usernames in users."""
+    __slots__=("channel", "users")
+
+    def __init__(self, channel = None, users = None):
+        super().__init__("who")
+        self.channel=channel
+        self.users=users
+
+    def _dict(self):
+        msg={"command" : self.command}
+        if self.channel is not None:
+            msg["channel"]=self.channel
+        if self.users is not None:
+            msg["users"]=self.users
+        return msg
+
+    def _fields(self):
+        return _pack_optional(self.channel)+_pack_list(self.users)
+
+class ListMessage(Message):
+    """Asks for the open channels.
+
+    The server answers with a ListMessage with the channel names in channels."""
+    __slots__=("channels",)
+
+    def __init__(self, channels = None):
+        super().__init__("list")
+        self.channels=channels
+
+    def _dict(self):
+        if self.channels is None:
+            return {"command" : self.command}
+        return {"command" : self.command , "channels" : self.channels}
+
+    def _fields(self):
+        return _pack_list(self.channels)
+
+
+class PingMessage(Message):
+    """Heartbeat sent by the server to an idle client, answered with a PongMessage."""
+    __slots__=()
+
+    def __init__(self):
+        super().__init__("ping")
+
+class PongMessage(Message):
+    """Answer to a PingMessage."""
+    __slots__=()
+
+    def __init__(self):
+        super().__init__("pong")
 
 
 class CDProto:
     """Computação Distribuida Protocol."""
 
     @classmethod
-    def register(cls, username: str) -> RegisterMessage:
+    def register(cls, username: str, encoding: str = None, framing: str = None) -> RegisterMessage:
         """Creates a RegisterMessage object."""
-        return RegisterMessage(username)
+        return RegisterMessage(username, encoding, framing)
 
     @classmethod
-    def join(cls, channel: str) -> JoinMessage:
+    def join(cls, channel: str, ts: int = None) -> JoinMessage:
         """Creates a JoinMessage object."""
-        return JoinMessage(channel)
+        return JoinMessage(channel, ts)
+
+    @classmethod
+    def leave(cls, channel: str) -> LeaveMessage:
+        """Creates a LeaveMessage object."""
+        return LeaveMessage(channel)
 
     @classmethod
     def message(cls, message: str, channel: str = None) -> TextMessage:
@@ -66,28 +324,71 @@ class CDProto:
         return TextMessage(message, channel)
 
     @classmethod
-    def send_msg(cls, connection: socket, msg: Message):
-        """Sends through a connection a Message object."""
-        st=str(msg)
-        connection.send(len(st).to_bytes(2,"big")+st.encode("utf-8"))
+    def direct(cls, message: str, to: str) -> DirectMessage:
+        """Creates a DirectMessage object."""
+        return DirectMessage(message, to)
 
     @classmethod
-    def recv_msg(cls, connection: socket) -> Message:
-        """Receives through a connection a Message object."""
-        s=int.from_bytes(connection.recv(2), "big")
+    def who(cls, channel: str = None) -> WhoMessage:
+        """Creates a WhoMessage object."""
+        return WhoMessage(channel)
 
-        if s == 0:
-            return None
-            
-        original=connection.recv(s)
-        msg=original.decode("utf-8")
+    @classmethod
+    def list(cls) -> ListMessage:
+        """Creates a ListMessage object."""
+        return ListMessage()
+
+    @classmethod
+    def encode(cls, msg: Message, binary: bool = False, varint: bool = False) -> bytes:
+        """Serializes a Message object into a length prefixed frame.
+
+        The length counts encoded bytes. Without varint framing payloads
+        over 65535 bytes raise OverflowError."""
+        data=msg.to_bytes() if binary else msg.to_json()
+        if varint:
+            return _varint(len(data))+data
+        return len(data).to_bytes(HEADER_SIZE,"big")+data
 
+    @classmethod
+    def reencode(cls, payload: bytes, binary: bool = False, varint: bool = False) -> bytes:
+        """Frames a binary encoded payload in the given format."""
+        payload=bytes(payload)
+        if not binary:
+            return cls.encode(cls.decode(payload), False, varint)
+        if varint:
+            return _varint(len(payload))+payload
+        return len(payload).to_bytes(HEADER_SIZE,"big")+payload
+
+    @classmethod
+    def decode_frame(cls, frame: bytes, varint: bool = False) -> Message:
+        """Builds a Message object from a whole frame, header included."""
+        if varint:
+            try:
+                s, pos=_read_varint(frame, 0)
+            except IndexError:
+                raise CDProtoBadFormat(frame)
+        else:
+            pos=HEADER_SIZE
+        return cls.decode(frame[pos:])
+
+    @classmethod
+    def decode(cls, original: bytes) -> Message:
+        """Builds a Message object from the payload of a frame."""
+        if original and original[0] != 0x7b:
+            return cls._decode_binary(original)
         try:
-            msg=json.loads(msg)
+            return cls._decode_json(original)
+        except (ValueError, TypeError):
+            raise CDProtoBadFormat(original)
+
+    @classmethod
+    def _decode_json(cls, original: bytes) -> Message:
+        try:
+            msg=json.loads(original.decode("utf-8"))
         except:
             raise CDProtoBadFormat(original)
 
-        if "command" not in msg.keys():
+        if not isinstance(msg, dict) or "command" not in msg.keys():
             raise CDProtoBadFormat(original)
 
         case=msg["command"]
@@ -96,20 +397,288 @@ class CDProto:
                 raise CDProtoBadFormat(original)
             if "ts" not in msg.keys():
                 raise CDProtoBadFormat(original)
-            if "channel" not in msg.keys():
-                return TextMessage(msg["message"], ts=int(msg["ts"]))
-            else:
-                return TextMessage(msg["message"], msg["channel"], int(msg["ts"]))
+            return TextMessage(_str(msg["message"]), _str(msg.get("channel"), True), _ts(msg["ts"]))
         elif case == "join" :
             if "channel" not in msg.keys():
                 raise CDProtoBadFormat(original)
-            return JoinMessage(msg["channel"])
+            return JoinMessage(_str(msg["channel"]), _ts(msg.get("ts"), True))
+        elif case == "leave" :
+            if "channel" not in msg.keys():
+                raise CDProtoBadFormat(original)
+            return LeaveMessage(_str(msg["channel"]))
         elif case == "register":
             if "user" not in msg.keys():
                 raise CDProtoBadFormat(original)
-            return RegisterMessage(msg["user"])   
+            return RegisterMessage(_str(msg["user"]), _str(msg.get("encoding"), True), _str(msg.get("framing"), True))
+        elif case == "direct":
+            if "message" not in msg.keys() or "to" not in msg.keys() or "ts" not in msg.keys():
+                raise CDProtoBadFormat(original)
+            return DirectMessage(_str(msg["message"]), _str(msg["to"]), _str(msg.get("from"), True), _ts(msg["ts"]))
+        elif case == "who":
+            return WhoMessage(_str(msg.get("channel"), True), _str_list(msg.get("users")))
+        elif case == "list":
+            return ListMessage(_str_list(msg.get("channels")))
+        elif case == "ping":
+            return PingMessage()
+        elif case == "pong":
+            return PongMessage()
+        raise CDProtoBadFormat(original)
+
+    @classmethod
+    def _decode_binary(cls, original: bytes) -> Message:
+        try:
+            case=original[0]
+            if case == 4:
+                ts, pos=_read_varint(original, 1)
+                message, pos=_read_str(original, pos)
+                channel=None
+                if original[pos]:
+                    channel, pos=_read_str(original, pos+1)
+                else:
+                    pos+=1
+                msg=TextMessage(message, channel, ts)
+            elif case == 2:
+                channel, pos=_read_str(original, 1)
+                ts=None
+                if pos < len(original):
+                    ts, pos=_read_varint(original, pos)
+                msg=JoinMessage(channel, ts)
+            elif case == 3:
+                channel, pos=_read_str(original, 1)
+                msg=LeaveMessage(channel)
+            elif case == 1:
+                user, pos=_read_str(original, 1)
+                framing=None
+                if pos < len(original) and original[pos] == 1:
+                    framing="varint"
+                    pos+=1
+                msg=RegisterMessage(user, "binary", framing)
+            elif case == 7:
+                ts, pos=_read_varint(original, 1)
+                message, pos=_read_str(original, pos)
+                to, pos=_read_str(original, pos)
+                sender, pos=_read_optional(original, pos)
+                msg=DirectMessage(message, to, sender, ts)
+            elif case == 5:
+                channel, pos=_read_optional(original, 1)
+                users, pos=_read_list(original, pos)
+                msg=WhoMessage(channel, users)
+            elif case == 6:
+                channels, pos=_read_list(original, 1)
+                msg=ListMessage(channels)
+            elif case == 8:
+                msg, pos=PingMessage(), 1
+            elif case == 9:
+                msg, pos=PongMessage(), 1
+            else:
+                raise CDProtoBadFormat(original)
+        except (IndexError, UnicodeDecodeError):
+            raise CDProtoBadFormat(original)
+        if pos != len(original):
+            raise CDProtoBadFormat(original)
+        return msg
+
+    @classmethod
+    def send_msg(cls, connection: socket, msg: Message, binary: bool = False, varint: bool = False):
+        """Sends through a connection a Message object."""
+        connection.sendall(cls.encode(msg, binary, varint))
+
+    @classmethod
+    def recv_msg(cls, connection: socket) -> Message:
+        """Receives through a connection a Message object."""
+        s=int.from_bytes(cls._recv_exact(connection, HEADER_SIZE), "big")
+
+        if s == 0:
+            return None
+
+        return cls.decode(cls._recv_exact(connection, s))
+
+    @classmethod
+    def _recv_exact(cls, connection: socket, size: int) -> bytes:
+        """Keeps reading from a blocking connection until size bytes arrive."""
+        data=b""
+        while len(data) < size:
+            chunk=connection.recv(size-len(data))
+            if not chunk:
+                break
+            data+=chunk
+        return data
+
+
+class CDProtoReader:
+    """Incremental frame decoder for one non-blocking connection.
 
+    Bytes are accumulated in a reusable buffer until whole frames are
+    available, so a readable event may produce zero or more messages.
+    recv reads up to bufsize bytes at once, so a burst of frames costs
+    one system call. received and frames count the bytes and frames read.
+    Setting varint switches to the varint length header; frames longer
+    than max_frame are skipped without being buffered."""
+
+    def __init__(self, bufsize: int = 65536, varint: bool = False, max_frame: int = MAX_FRAME):
+        self.bufsize=bufsize
+        self.varint=varint
+        self.max_frame=max_frame
+        self._buffer=bytearray()
+        self._pos=0
+        self._skip=0
+        self.received=0
+        self.frames=0
+
+    def recv(self, connection: socket) -> bool:
+        """Pulls the available bytes into the buffer. Returns False on EOF."""
+        try:
+            data=connection.recv(self.bufsize)
+        except (BlockingIOError, InterruptedError):
+            return True
+        if not data:
+            return False
+        self.feed(data)
+        return True
+
+    def feed(self, data: bytes):
+        """Appends raw bytes to the buffer."""
+        self.received+=len(data)
+        if self._pos == len(self._buffer):
+            self._buffer.clear()
+            self._pos=0
+        elif self._pos:
+            del self._buffer[:self._pos]
+            self._pos=0
+        self._buffer+=data
+        if self._skip:
+            self._discard()
+
+    def _discard(self):
+        n=min(self._skip, len(self._buffer)-self._pos)
+        self._pos+=n
+        self._skip-=n
+
+    def pop(self) -> Message:
+        """Returns the next complete message or None if there is none yet.
+
+        A malformed frame is consumed before CDProtoBadFormat is raised, so
+        the caller can keep popping the frames that follow it."""
+        if self._skip:
+            return None
+        if self.varint:
+            try:
+                s, start=_read_varint(self._buffer, self._pos)
+            except IndexError:
+                if len(self._buffer)-self._pos > 9:
+                    raise CDProtoBadFormat(bytes(self._buffer[self._pos:]))
+                return None
+        else:
+            start=self._pos+HEADER_SIZE
+            if len(self._buffer) < start:
+                return None
+            s=int.from_bytes(self._buffer[self._pos:start], "big")
+        if s > self.max_frame:
+            original=bytes(self._buffer[start:start+64])
+            self._pos=start
+            self._skip=s
+            self._discard()
+            raise CDProtoBadFormat(original)
+        if len(self._buffer) < start+s:
+            return None
+        with memoryview(self._buffer) as view:
+            original=bytes(view[start:start+s])
+        self._pos=start+s
+        self.frames+=1
+        return CDProto.decode(original)
+
+    def __len__(self) -> int:
+        return len(self._buffer)-self._pos
+
+
+class CDProtoWriter:
+    """Outbound frame queue for one non-blocking connection.
+
+    Frames stay queued until the selector reports the connection writable.
+    The queue is bounded by maxlen frames; what happens when it is full is
+    decided by the caller (see the full property and drop_oldest).
+    Each flush sends at most bufsize bytes, so a large frame goes out in
+    chunks across several writable events instead of in one long burst.
+    frames, dropped and sent count the frames queued and dropped and the
+    bytes sent."""
+
+    def __init__(self, maxlen: int = None, bufsize: int = 65536):
+        self.maxlen=maxlen
+        self.bufsize=bufsize
+        self._frames=deque()
+        self._offset=0
+        self._size=0
+        self.frames=0
+        self.dropped=0
+        self.sent=0
+
+    @property
+    def depth(self) -> int:
+        """Number of frames waiting to be sent."""
+        return len(self._frames)
+
+    @property
+    def full(self) -> bool:
+        return self.maxlen is not None and len(self._frames) >= self.maxlen
+
+    def put(self, data: bytes) -> bool:
+        """Queues a frame. Returns True if the queue was empty before."""
+        self._frames.append(data)
+        self._size+=len(data)
+        self.frames+=1
+        return len(self._frames) == 1
+
+    def drop_oldest(self) -> bool:
+        """Discards the oldest frame that has not started being sent."""
+        i=1 if self._offset else 0
+        if len(self._frames) <= i:
+            return False
+        frame=self._frames[i]
+        del self._frames[i]
+        self._size-=len(frame)
+        self.dropped+=1
+        return True
+
+    def write(self, connection: socket, data: bytes) -> bool:
+        """Queues a frame and sends what the connection accepts right away.
+        Returns True while bytes remain queued."""
+        self.put(data)
+        return self.flush(connection)
+
+    def flush(self, connection: socket) -> bool:
+        """Sends up to bufsize queued bytes, coalescing small frames into a
+        single send. Returns True while bytes remain queued."""
+        if not self._frames:
+            return False
+        head=memoryview(self._frames[0])[self._offset:self._offset+self.bufsize]
+        size=len(head)
+        if size < self.bufsize and len(self._frames) > 1:
+            chunk=[head]
+            for frame in islice(self._frames, 1, None):
+                if size >= self.bufsize:
+                    break
+                chunk.append(frame)
+                size+=len(frame)
+            head=b"".join(chunk)
+        self._consume(self._send(connection, head))
+        return bool(self._frames)
+
+    def _consume(self, sent: int):
+        self._size-=sent
+        self.sent+=sent
+        sent+=self._offset
+        while self._frames and sent >= len(self._frames[0]):
+            sent-=len(self._frames.popleft())
+        self._offset=sent
+
+    def _send(self, connection: socket, data) -> int:
+        try:
+            return connection.send(data)
+        except (BlockingIOError, InterruptedError):
+            return 0
 
+    def __len__(self) -> int:
+        return self._size
 
 
 class CDProtoBadFormat(Exception):
@@ -122,4 +691,4 @@ class CDProtoBadFormat(Exception):
     @property
     def original_msg(self) -> str:
         """Retrieve original message as a string."""
-        return self._original.decode("utf-8")
+        return self._original.decode("utf-8", errors="replace")
@@ -0,0 +1,23 @@
+"""Token buckets for the chat server rate limits."""
+
+
+class TokenBucket:
+    """Allows rate events per second on average, in bursts of up to burst."""
+    __slots__ = ("rate", "burst", "tokens", "stamp")
+
+    def __init__(self, rate: float, burst: float, now: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.stamp = now
+
+    def refill(self, now: float) -> float:
+        """Adds the tokens earned since the last refill. Returns the tokens."""
+        if now > self.stamp:
+            self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+            self.stamp = now
+        return self.tokens
+
+    def wait(self) -> float:
+        """Seconds until the bucket holds a whole token again."""
+        return max(0.0, (1 - self.tokens) / self.rate)
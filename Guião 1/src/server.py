@@ -1,62 +1,597 @@
 """CD Chat server program."""
+import heapq
 import logging
 import selectors
 import socket
-from .protocol import CDProto, JoinMessage, TextMessage
-logging.basicConfig(filename="server.log", level=logging.DEBUG)
+from collections import deque
+from enum import Enum
+from time import perf_counter
+from . import log
+from .chatlog import ChatLog
+from .history import ChannelHistory
+from .metrics import Metrics
+from .presence import Presence
+from .ratelimit import TokenBucket
+from .protocol import (CDProto, CDProtoBadFormat, CDProtoReader, CDProtoWriter, DirectMessage, JoinMessage, LeaveMessage, ListMessage,
+                       PingMessage, PongMessage, RegisterMessage, TextMessage, WhoMessage)
+from .timers import TimerWheel
+log.configure("server.log")
 
+PING = PingMessage()
 
-class Server:
-    """Chat Server process."""
+
+class OverflowPolicy(Enum):
+    """What to do when a client output queue is full."""
+
+    DROP_OLDEST = 1
+    DISCONNECT = 2
+    BLOCK = 3
+
+
+class Channels:
+    """Channel membership and registered users shared by the chat servers."""
     def __init__(self):
-        
+        self.users = {"Initial" : set() }   # channel -> connections
+        self.channels = {}                   # connection -> channels
+        self.presence = Presence()
+
+    def join(self, conn, channel):
+        """Adds a connection to a channel."""
+        self.users.setdefault(channel, set()).add(conn)
+        self.channels.setdefault(conn, set()).add(channel)
+
+    def leave(self, conn, channel):
+        """Removes a connection from one channel."""
+        members = self.users.get(channel)
+        if members is None or conn not in members:
+            return
+        members.discard(conn)
+        if not members and channel != "Initial":
+            del self.users[channel]
+        self.channels[conn].discard(channel)
+
+    def part(self, conn):
+        """Removes a connection from every channel it is in."""
+        for channel in list(self.channels.get(conn, ())):
+            self.leave(conn, channel)
+        self.channels.pop(conn, None)
+
+    def recipients(self, conn, msg: TextMessage):
+        """Members of the channel a message is sent to.
+
+        Nothing is returned when the sender has not joined that channel."""
+        channel = "Initial" if msg.channel is None else msg.channel
+        members = self.users.get(channel, ())
+        if conn not in members:
+            logging.debug('dropped message to unjoined channel "%s"', channel)
+            return ()
+        return members
+
+    def who(self, channel: str = None) -> list:
+        """Usernames online, or in a channel."""
+        if channel is None:
+            return self.presence.online()
+        return self.presence.who(self.users.get(channel, ()))
+
+    def sign(self, conn, msg: DirectMessage) -> DirectMessage:
+        """The direct message as forwarded, from the username of conn.
+
+        Returns None when conn has not registered."""
+        sender = self.presence.names.get(conn)
+        if sender is None:
+            logging.debug('dropped direct message from unregistered client')
+            return None
+        return DirectMessage(msg.message, msg.to, sender, msg.ts)
+
+
+class Server(Channels):
+    """Chat Server process.
+
+    With heartbeat set, a client that sends nothing for heartbeat seconds
+    gets a PingMessage ({"command": "ping"}) and is disconnected if it
+    still sends nothing within ping_timeout; any frame counts as an answer,
+    a PongMessage ({"command": "pong"}) being the usual one. This is off by
+    default, as clients that predate ping would be reaped when idle, and
+    also when ping_timeout is None.
+
+    rate and burst limit the frames of every client, channel_rate and
+    channel_burst the messages to every channel (burst defaults to twice
+    the rate). A client over a limit is not read from until it is back
+    under it. At most max_frames frames of a client are handled per loop
+    iteration, the rest wait for the next one."""
+    def __init__(self, address: tuple = ('localhost', 1236), max_queue: int = 1024, overflow: OverflowPolicy = OverflowPolicy.DROP_OLDEST, reuse_port: bool = False,
+                 history: int = 100, history_bytes: int = 1 << 20, log: ChatLog = None, admin: tuple = None,
+                 heartbeat: float = None, ping_timeout: float = 10, rate: float = None, burst: float = None,
+                 channel_rate: float = None, channel_burst: float = None, max_frames: int = 64):
+        super().__init__()
+
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        self.sock.bind(('localhost', 1236))
+        if reuse_port:
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        self.sock.bind(address)
         self.sock.listen()
         self.sel = selectors.DefaultSelector()
         self.sel.register(self.sock, selectors.EVENT_READ, self.accept)
-        self.users = {"Initial" : [] }
+        self.max_queue = max_queue
+        self.overflow = overflow
+        self.readers = {}
+        self.writers = {}
+        self.formats = {}   # client -> (binary, varint) it registered with
+        self.history = ChannelHistory(history, history_bytes)
+        self.log = log
+        self.replays = {}   # client -> pending replay from the log, None once only deferred frames are left
+        self.deferred = {}  # replaying client -> live channel frames it gets after the replay
+        if log is not None:
+            self.restore()
+        self.paused = {}    # sender -> slow clients it is waiting for
+        self.blocked = {}   # slow client -> senders waiting for it
+        self.metrics = Metrics()
+        self.scrapes = {}   # admin connection -> CDProtoWriter with the response
+        self.heartbeat = heartbeat if ping_timeout else None
+        self.ping_timeout = ping_timeout
+        self.timers = TimerWheel(tick=min(1.0, ping_timeout / 4) if self.heartbeat else 1.0)
+        self.pinged = set() # clients that have not answered a ping yet
+        self.pings = {}     # ping frame by format
+        self.rate = rate
+        self.burst = burst or (rate and 2 * rate)
+        self.channel_rate = channel_rate
+        self.channel_burst = channel_burst or (channel_rate and 2 * channel_rate)
+        self.max_frames = max_frames
+        self.buckets = {}           # client -> TokenBucket
+        self.channel_buckets = {}   # channel -> TokenBucket
+        self.held = {}              # throttled client -> message it is waiting to send
+        self.throttled = {}         # throttled client -> time it may go on
+        self.resumes = []           # heap of (time, client id, client)
+        self.backlog = {}           # clients with frames left over from the last iteration
+        if admin is not None:
+            self.admin = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.admin.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self.admin.bind(admin)
+            self.admin.listen()
+            self.sel.register(self.admin, selectors.EVENT_READ, self.admin_accept)
 
     def loop(self):
         """Loop indefinetely."""
         while True:
-            events = self.sel.select()
+            events = self.sel.select(self.timeout())
+            start = perf_counter()
+            for conn in self.timers.advance():
+                self.expire(conn)
+            self.resume()
             for key, mask in events:
                 callback = key.data
                 callback(key.fileobj, mask)
+            for conn in list(self.backlog):
+                self.process(conn)
+            if self.log is not None:
+                self.log.flush()
+            self.metrics.observe_loop(perf_counter() - start)
+
+    def timeout(self) -> float:
+        """How long select may wait for the next event."""
+        if self.backlog:
+            return 0
+        timeout = self.timers.timeout()
+        if self.resumes:
+            wait = max(0.0, self.resumes[0][0] - self.timers.clock())
+            timeout = wait if timeout is None else min(timeout, wait)
+        return timeout
+
+    def restore(self):
+        """Loads the end of every channel in the log into the history."""
+        for channel in self.log.channels():
+            for ts, payload in self.log.replay(channel, limit=self.history.max_messages):
+                try:
+                    msg = CDProto.decode(bytes(payload))
+                except CDProtoBadFormat:
+                    continue
+                self.history.add(channel, msg, {})
 
     def accept(self, sock, mask):
         conn, mask = sock.accept()
         conn.setblocking(False)
-        d=CDProto.recv_msg(conn)
-        self.users["Initial"].append(conn)
-        self.sel.register(conn, selectors.EVENT_READ, self.read)
-        logging.debug('received "%s"', str(d))
-
-    def read(self, conn, mask):
-        d=CDProto.recv_msg(conn)
-        logging.debug('received "%s"', str(d))
-        if d:
-            if isinstance(d,JoinMessage) :
-                self.users.setdefault(d.channel, [] ) 
-                for key in self.users.keys():
-                    if conn in self.users[key]:
-                        self.users[key].remove(conn)
-                self.users[d.channel].append(conn) 
+        self.readers[conn] = CDProtoReader()
+        self.writers[conn] = CDProtoWriter(self.max_queue)
+        self.sel.register(conn, selectors.EVENT_READ, self.handle)
+        self.metrics.accepted += 1
+        if self.heartbeat:
+            self.timers.schedule(conn, self.heartbeat)
+        if self.rate:
+            self.buckets[conn] = TokenBucket(self.rate, self.burst, self.timers.now)
 
-            elif isinstance(d,TextMessage):
-                if d.channel is None:
-                    for client in self.users["Initial"]:
-                        CDProto.send_msg(client, d) 
-                        logging.debug('sent "%s"', str(d))
+    def handle(self, conn, mask):
+        """Dispatches the selector events of a client connection."""
+        if conn not in self.writers:
+            return
+        if mask & selectors.EVENT_WRITE:
+            self.write(conn)
+        if mask & selectors.EVENT_READ and conn in self.readers:
+            self.read(conn)
+
+    def read(self, conn):
+        try:
+            alive = self.readers[conn].recv(conn)
+        except OSError:
+            alive = False
+        if not alive:
+            self.disconnect(conn)
+            return
+        if self.heartbeat:
+            self.timers.schedule(conn, self.heartbeat)
+            self.pinged.discard(conn)
+        self.process(conn)
+
+    def process(self, conn):
+        """Handles the complete frames buffered for a connection."""
+        self.backlog.pop(conn, None)
+        reader = self.readers.get(conn)
+        if reader is None:
+            # disconnected earlier in this iteration
+            return
+        self.presence.touch(conn)
+        frames = 0
+        while conn in self.readers and conn not in self.paused and conn not in self.throttled:
+            if frames == self.max_frames:
+                self.backlog[conn] = True
+                break
+            d = self.held.pop(conn, None)
+            if d is None:
+                try:
+                    d = reader.pop()
+                except CDProtoBadFormat as e:
+                    logging.warning('bad frame "%s"', e.original_msg)
+                    continue
+                if d is None:
+                    break
+            if not self.admit(conn, d):
+                self.held[conn] = d
+                break
+            frames += 1
+            logging.debug('received "%s"', d)
+            if isinstance(d,RegisterMessage):
+                self.formats[conn] = (d.encoding == "binary", d.framing == "varint")
+                reader.varint = d.framing == "varint"
+                self.presence.register(conn, d.user)
+                self.join(conn, "Initial")
+
+            elif isinstance(d,JoinMessage) :
+                self.leave(conn, "Initial")
+                self.join(conn, d.channel)
+                if self.log is not None and d.ts is not None:
+                    self.replays[conn] = self.log.replay(d.channel, d.ts)
+                    self.pump(conn)
                 else:
-                    for client in self.users[d.channel]:
-                        CDProto.send_msg(client, d) 
-                        logging.debug('sent "%s"', str(d))
+                    fmt = self.formats.get(conn, (False, False))
+                    for frame in self.history.replay(d.channel, fmt, d.ts):
+                        self.send(conn, frame, conn)
+
+            elif isinstance(d,LeaveMessage):
+                self.leave(conn, d.channel)
+
+            elif isinstance(d,TextMessage):
+                self.broadcast(conn, d)
+
+            elif isinstance(d,DirectMessage):
+                self.direct(conn, d)
+
+            elif isinstance(d,WhoMessage):
+                self.reply(conn, WhoMessage(d.channel, self.who(d.channel)))
+
+            elif isinstance(d,ListMessage):
+                self.reply(conn, ListMessage(list(self.users)))
+
+            elif isinstance(d,PingMessage):
+                self.reply(conn, PongMessage())
+
+    def admit(self, conn, msg) -> bool:
+        """Takes the tokens for a message, or throttles its sender."""
+        now = self.timers.now
+        bucket = self.buckets.get(conn)
+        channel = None
+        if self.channel_rate and isinstance(msg, TextMessage):
+            name = "Initial" if msg.channel is None else msg.channel
+            channel = self.channel_buckets.get(name)
+            if channel is None:
+                channel = self.channel_buckets[name] = TokenBucket(self.channel_rate, self.channel_burst, now)
+        for limit in (bucket, channel):
+            if limit is not None and limit.refill(now) < 1:
+                self.throttle(conn, now + limit.wait())
+                return False
+        for limit in (bucket, channel):
+            if limit is not None:
+                limit.tokens -= 1
+        return True
+
+    def throttle(self, conn, until: float):
+        """Stops reading from a client until the given time."""
+        self.throttled[conn] = until
+        heapq.heappush(self.resumes, (until, id(conn), conn))
+        self.metrics.throttled += 1
+        self.update(conn)
+
+    def resume(self):
+        """Goes on with the throttled clients whose time has come."""
+        now = self.timers.clock()
+        self.timers.now = now
+        while self.resumes and self.resumes[0][0] <= now:
+            until, _, conn = heapq.heappop(self.resumes)
+            if self.throttled.get(conn) != until:
+                continue
+            del self.throttled[conn]
+            self.update(conn)
+            self.process(conn)
+
+    def leave(self, conn, channel):
+        super().leave(conn, channel)
+        if channel not in self.users:
+            self.channel_buckets.pop(channel, None)
+
+    def expire(self, conn):
+        """Pings an idle client, or disconnects it if it did not answer."""
+        if conn not in self.writers:
+            return
+        if conn in self.paused:
+            # Its input is not being read on purpose.
+            self.timers.schedule(conn, self.heartbeat)
+        elif conn in self.pinged:
+            logging.warning('disconnecting unresponsive client %s', conn)
+            self.metrics.reaped += 1
+            self.disconnect(conn)
         else:
-            for key in self.users.keys():
-                if conn in self.users[key]:
-                    self.users[key].remove(conn)
+            self.pinged.add(conn)
+            self.send(conn, self.frame(PING, self.formats.get(conn, (False, False)), self.pings))
+            self.timers.schedule(conn, self.ping_timeout)
+
+    def reply(self, conn, msg):
+        """Sends a message to one client only."""
+        frame = self.frame(msg, self.formats.get(conn, (False, False)), {})
+        if frame:
+            self.send(conn, frame, conn)
+
+    def direct(self, conn, msg: DirectMessage) -> DirectMessage:
+        """Delivers a direct message to the connections of its recipient,
+        without going through any channel. Returns it as forwarded."""
+        msg = self.sign(conn, msg)
+        if msg is not None:
+            self.deliver_direct(msg, conn)
+        return msg
+
+    def deliver_direct(self, msg: DirectMessage, sender=None):
+        frames = {}
+        targets = self.presence.connections(msg.to)
+        for client in list(targets):
+            frame = self.frame(msg, self.formats.get(client, (False, False)), frames)
+            if frame:
+                self.send(client, frame, sender)
+        logging.debug('sent "%s" to %d connections', msg, len(targets))
+
+    def frame(self, msg, fmt: tuple, frames: dict) -> bytes:
+        """The frame of msg in a format, encoded once and kept in frames.
+        Empty when the message does not fit the format."""
+        frame = frames.get(fmt)
+        if frame is None:
+            start = perf_counter()
+            try:
+                frame = frames[fmt] = CDProto.encode(msg, *fmt)
+            except OverflowError:
+                frame = frames[fmt] = b""
+            self.metrics.encode_seconds += perf_counter() - start
+            self.metrics.encodes += 1
+        return frame
+
+    def broadcast(self, conn, msg: TextMessage) -> dict:
+        """Fans a message out to its channel. Returns the encoded frames."""
+        recipients = self.recipients(conn, msg)
+        if not recipients:
+            return {}
+        return self.fanout(recipients, msg, conn)
+
+    def fanout(self, recipients, msg: TextMessage, sender=None, frames: dict = None) -> dict:
+        """Queues a message on every recipient.
+
+        The message is encoded at most once per (binary, varint) format and
+        that frame is shared by the recipients. Clients on the 2 byte header
+        do not get messages over 64 KiB."""
+        frames = {} if frames is None else frames
+        deliveries = size = 0
+        for client in list(recipients):
+            frame = self.frame(msg, self.formats.get(client, (False, False)), frames)
+            if frame:
+                if client in self.replays:
+                    queued = self.defer(client, frame)
+                else:
+                    queued = self.send(client, frame, sender)
+                if queued:
+                    deliveries += 1
+                    size += len(frame)
+        channel = "Initial" if msg.channel is None else msg.channel
+        stats = self.metrics.channel(channel)
+        stats.messages += 1
+        stats.deliveries += deliveries
+        stats.bytes += size
+        self.history.add(channel, msg, frames)
+        if self.log is not None:
+            self.log.append(channel, msg)
+        logging.debug('sent "%s" to %d clients', msg, deliveries)
+        return frames
+
+    def send(self, conn, frame, sender=None) -> bool:
+        """Queues an encoded frame on a connection, applying the overflow policy.
+        Returns whether it was queued.
+
+        With BLOCK, a full queue pauses the client whose message it is (the
+        sender, or the client itself for its replies and history) and still
+        takes that frame; a paused client is not read from, so each one adds
+        at most one frame. Frames with no sender to pause are dropped.
+        The same frame object is shared by every recipient of a broadcast."""
+        writer = self.writers.get(conn)
+        if writer is None:
+            return False
+        if writer.full:
+            if self.overflow is OverflowPolicy.DISCONNECT:
+                logging.warning('disconnecting slow client %s', conn)
+                self.disconnect(conn)
+                return False
+            elif self.overflow is OverflowPolicy.DROP_OLDEST:
+                writer.drop_oldest()
+            elif sender is not None and sender in self.writers:
+                self.paused.setdefault(sender, set()).add(conn)
+                self.blocked.setdefault(conn, set()).add(sender)
+                self.update(sender)
+            else:
+                writer.dropped += 1
+                return False
+        if writer.put(frame):
+            self.update(conn)
+        return True
+
+    def write(self, conn):
+        """Drains the frames queued on a writable connection."""
+        writer = self.writers[conn]
+        try:
+            writer.flush(conn)
+        except OSError:
+            self.disconnect(conn)
+            return
+        self.update(conn)
+        if conn in self.replays:
+            self.pump(conn)
+        if not writer.full:
+            self.release(conn)
+
+    def defer(self, conn, frame) -> bool:
+        """Holds a channel message for a client until its replay is over, so
+        it gets the history in order. At most max_queue frames are held; past
+        that the client is disconnected or, with any other policy, the
+        oldest held frame is dropped. Returns whether the frame is held."""
+        deferred = self.deferred.setdefault(conn, deque())
+        if len(deferred) >= self.max_queue:
+            if self.overflow is OverflowPolicy.DISCONNECT:
+                logging.warning('disconnecting slow client %s', conn)
+                self.disconnect(conn)
+                return False
+            deferred.popleft()
+            self.writers[conn].dropped += 1
+        deferred.append(frame)
+        return True
+
+    def pump(self, conn):
+        """Moves a log replay, then the messages deferred during it, into the
+        output queue as the client drains it, so long replays neither fill
+        the queue nor get dropped."""
+        replay = self.replays[conn]
+        writer = self.writers[conn]
+        deferred = self.deferred.get(conn)
+        fmt = self.formats.get(conn, (False, False))
+        while writer.depth < self.max_queue // 2 + 1:
+            if replay is None:
+                if not deferred:
+                    del self.replays[conn]
+                    self.deferred.pop(conn, None)
+                    break
+                writer.put(deferred.popleft())
+                continue
+            try:
+                ts, payload = next(replay)
+            except StopIteration:
+                replay = self.replays[conn] = None
+                continue
+            try:
+                writer.put(CDProto.reencode(payload, *fmt))
+            except (CDProtoBadFormat, OverflowError):
+                continue
+        self.update(conn)
+
+    def release(self, conn):
+        """Resumes the senders that were blocked by a slow client."""
+        for sender in self.blocked.pop(conn, ()):
+            waiting = self.paused.get(sender)
+            if waiting is None:
+                continue
+            waiting.discard(conn)
+            if not waiting:
+                del self.paused[sender]
+                self.update(sender)
+                self.process(sender)
+
+    def update(self, conn):
+        """Registers the selector events a connection is waiting for."""
+        if conn not in self.writers:
+            return
+        events = 0 if conn in self.paused or conn in self.throttled else selectors.EVENT_READ
+        if self.writers[conn]:
+            events |= selectors.EVENT_WRITE
+        key = self.sel.get_map().get(conn)
+        if not events:
+            if key is not None:
+                self.sel.unregister(conn)
+        elif key is None:
+            self.sel.register(conn, events, self.handle)
+        elif key.events != events:
+            self.sel.modify(conn, events, self.handle)
+
+    def queue_depth(self, conn) -> int:
+        """Number of frames waiting to be sent to a client."""
+        writer = self.writers.get(conn)
+        return writer.depth if writer is not None else 0
+
+    def queue_depths(self) -> dict:
+        """Queue depth of every client, to spot slow consumers."""
+        return {conn: writer.depth for conn, writer in self.writers.items()}
+
+    def disconnect(self, conn):
+        """Forgets a client connection and closes it."""
+        self.part(conn)
+        reader = self.readers.pop(conn, None)
+        writer = self.writers.pop(conn, None)
+        if reader is not None:
+            self.metrics.close(reader, writer)
+        self.formats.pop(conn, None)
+        self.presence.unregister(conn)
+        self.timers.cancel(conn)
+        self.pinged.discard(conn)
+        self.buckets.pop(conn, None)
+        self.held.pop(conn, None)
+        self.throttled.pop(conn, None)
+        self.backlog.pop(conn, None)
+        self.replays.pop(conn, None)
+        self.deferred.pop(conn, None)
+        for slow in self.paused.pop(conn, ()):
+            self.blocked.get(slow, set()).discard(conn)
+        if conn in self.sel.get_map():
             self.sel.unregister(conn)
-            conn.close()
\ No newline at end of file
+        conn.close()
+        self.release(conn)
+
+    def admin_accept(self, sock, mask):
+        conn, _ = sock.accept()
+        conn.setblocking(False)
+        self.sel.register(conn, selectors.EVENT_READ, self.scrape)
+
+    def scrape(self, conn, mask):
+        """Answers any request on the admin socket with the metrics, as HTTP."""
+        if mask & selectors.EVENT_READ:
+            try:
+                request = conn.recv(4096)
+            except OSError:
+                request = b""
+            if not request:
+                self.sel.unregister(conn)
+                conn.close()
+                return
+            body = self.metrics.render(self).encode("utf-8")
+            writer = self.scrapes[conn] = CDProtoWriter()
+            writer.put(b"HTTP/1.0 200 OK\r\nContent-Type: text/plain; version=0.0.4\r\n"
+                       b"Content-Length: %d\r\nConnection: close\r\n\r\n" % len(body) + body)
+            self.sel.modify(conn, selectors.EVENT_WRITE, self.scrape)
+        else:
+            writer = self.scrapes[conn]
+            try:
+                pending = writer.flush(conn)
+            except OSError:
+                pending = False
+            if not pending:
+                del self.scrapes[conn]
+                self.sel.unregister(conn)
+                conn.close()
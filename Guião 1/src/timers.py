@@ -0,0 +1,86 @@
+"""Hashed timer wheel for per-connection timeouts."""
+import time
+
+
+class TimerWheel:
+    """Hashed timing wheel of timeouts, one per key.
+
+    Time is cut in ticks of tick seconds and a timer sits in the slot of
+    the tick it expires on, modulo the number of slots. advance only
+    looks at the slots of the ticks that went by, so its cost depends on
+    the timers that are due, not on how many exist.
+
+    Postponing a timer, which happens on every read from a connection,
+    only updates its deadline: the timer stays in its slot and is moved
+    when that slot comes up. Timers further away than one turn of the
+    wheel are moved the same way."""
+
+    def __init__(self, tick: float = 1.0, slots: int = 512, clock=time.monotonic):
+        self.tick = tick
+        self.clock = clock
+        self.slots = [set() for _ in range(slots)]
+        self.deadlines = {}     # key -> deadline
+        self.where = {}         # key -> absolute tick of the slot it is in
+        self.now = clock()
+        self.current = int(self.now / tick)
+
+    def schedule(self, key, delay: float):
+        """Sets the timer of key to expire delay seconds from now, as of the
+        last advance."""
+        deadline = self.now + delay
+        self.deadlines[key] = deadline
+        at = self.where.get(key)
+        if at is None or deadline < at * self.tick:
+            self._place(key, deadline)
+
+    def _place(self, key, deadline: float):
+        at = self.where.get(key)
+        if at is not None:
+            self.slots[at % len(self.slots)].discard(key)
+        at = max(int(deadline / self.tick) + 1, self.current + 1)
+        self.where[key] = at
+        self.slots[at % len(self.slots)].add(key)
+
+    def cancel(self, key):
+        """Removes the timer of key, if any."""
+        at = self.where.pop(key, None)
+        if at is not None:
+            self.slots[at % len(self.slots)].discard(key)
+            del self.deadlines[key]
+
+    def advance(self, now: float = None) -> list:
+        """Moves the wheel to now. Returns the keys whose timers expired,
+        which are removed."""
+        self.now = now = self.clock() if now is None else now
+        target = int(now / self.tick)
+        expired = []
+        where, deadlines = self.where, self.deadlines
+        # After a long stall every slot has been passed at most once.
+        first = max(self.current + 1, target - len(self.slots) + 1)
+        for at in range(first, target + 1):
+            slot = self.slots[at % len(self.slots)]
+            if not slot:
+                continue
+            due = {key for key in slot if where[key] <= target}
+            slot -= due
+            for key in due:
+                deadline = deadlines[key]
+                if deadline <= now:
+                    del where[key]
+                    del deadlines[key]
+                    expired.append(key)
+                else:
+                    later = int(deadline / self.tick) + 1
+                    where[key] = later
+                    self.slots[later % len(self.slots)].add(key)
+        self.current = max(self.current, target)
+        return expired
+
+    def timeout(self) -> float:
+        """Seconds until the next tick, or None when no timer is set."""
+        if not self.deadlines:
+            return None
+        return max(0.0, (self.current + 1) * self.tick - self.clock())
+
+    def __len__(self) -> int:
+        return len(self.deadlines)
@@ -0,0 +1,96 @@
+"""Tests for the asyncio chat server and client."""
+import asyncio
+
+from src.aioclient import AsyncClient, command
+from src.aioserver import AsyncServer
+from src.protocol import CDProto, DirectMessage, JoinMessage, LeaveMessage, PingMessage, PongMessage, TextMessage
+
+
+async def chat():
+    server = AsyncServer(("localhost", 0))
+    await server.start()
+    address = server.server.sockets[0].getsockname()
+
+    foo, bar = AsyncClient("Foo", binary=True), AsyncClient("Bar")
+    await foo.connect(address)
+    await bar.connect(address)
+    await foo.send(CDProto.join("#cd"))
+    await bar.send(CDProto.join("#cd"))
+    await bar.send(CDProto.join("#other"))
+    await asyncio.sleep(0.1)
+
+    await foo.send(CDProto.message("Olá Mundo", "#cd"))
+    await foo.send(CDProto.message("nobody hears this", "#other"))
+    await bar.send(CDProto.message("Hello World", "#other"))
+    received = [await asyncio.wait_for(bar.recv(), 2) for _ in range(2)]
+
+    await foo.close()
+    await bar.close()
+    server.server.close()
+    return received
+
+
+def test_channels():
+    received = asyncio.run(chat())
+    assert all(isinstance(d, TextMessage) for d in received)
+    assert [d.message for d in received] == ["Olá Mundo", "Hello World"]
+
+
+async def bots(n):
+    server = AsyncServer(("localhost", 0))
+    await server.start()
+    address = server.server.sockets[0].getsockname()
+
+    clients = [AsyncClient(f"bot{i}") for i in range(n)]
+    for client in clients:
+        await client.connect(address)
+        await client.join("#bots")
+    await asyncio.sleep(0.2)
+    await clients[0].say("hello bots")
+    await clients[0].direct("bot1", "psst")
+
+    async def first(client, count):
+        got = []
+        async for msg in client:
+            got.append(msg.message)
+            if len(got) == count:
+                return got
+
+    received = await asyncio.wait_for(asyncio.gather(*(first(c, 2 if c.name == "bot1" else 1) for c in clients)), 5)
+    for client in clients:
+        await client.close()
+    server.server.close()
+    return received
+
+
+def test_many_bot_sessions():
+    received = asyncio.run(bots(200))
+    assert received[1] == ["hello bots", "psst"]
+    assert all(got == ["hello bots"] for i, got in enumerate(received) if i != 1)
+
+
+async def ping(binary):
+    server = AsyncServer(("localhost", 0))
+    await server.start()
+    client = AsyncClient("Foo", binary=binary)
+    await client.connect(server.server.sockets[0].getsockname())
+    await client.send(PingMessage())
+    reply = await asyncio.wait_for(client.recv(), 2)
+    await client.close()
+    server.server.close()
+    return reply
+
+
+def test_ping_is_answered():
+    assert isinstance(asyncio.run(ping(False)), PongMessage)
+    assert isinstance(asyncio.run(ping(True)), PongMessage)
+
+
+def test_console_commands():
+    client = AsyncClient("foo")
+    lines = ["/join #cd\n", "/join #other\n", "hello\n", "/leave #other\n", "bye\n", "/msg bar psst\n"]
+    msgs = [command(client, line) for line in lines]
+    assert [type(msg) for msg in msgs] == [JoinMessage, JoinMessage, TextMessage, LeaveMessage, TextMessage, DirectMessage]
+    assert (msgs[2].channel, msgs[4].channel) == ("#other", "#cd")
+    assert (msgs[5].to, msgs[5].message) == ("bar", "psst\n")
+    assert client.channels == ["#cd"]
@@ -0,0 +1,93 @@
+"""Tests for channel membership."""
+import socket
+
+from src.protocol import CDProto, JoinMessage, LeaveMessage, TextMessage
+from src.server import Channels, Server
+
+
+def members(channels):
+    """The (channel, connection) pairs of both indexes, which must agree."""
+    by_channel = {(channel, conn) for channel, conns in channels.users.items() for conn in conns}
+    by_conn = {(channel, conn) for conn, joined in channels.channels.items() for channel in joined}
+    assert by_channel == by_conn
+    return by_channel
+
+
+def test_join():
+    channels = Channels()
+    channels.join("foo", "#cd")
+    channels.join("foo", "#cd")
+    channels.join("bar", "#cd")
+    channels.join("foo", "#sd")
+    assert members(channels) == {("#cd", "foo"), ("#cd", "bar"), ("#sd", "foo")}
+    assert channels.users["Initial"] == set()
+
+
+def test_leave():
+    channels = Channels()
+    channels.join("foo", "#cd")
+    channels.join("bar", "#cd")
+    channels.join("foo", "Initial")
+
+    channels.leave("foo", "#cd")
+    assert members(channels) == {("#cd", "bar"), ("Initial", "foo")}
+    channels.leave("bar", "#cd")
+    assert "#cd" not in channels.users
+    channels.leave("foo", "Initial")
+    assert channels.users["Initial"] == set()
+
+    # leaving what was never joined changes nothing
+    channels.leave("foo", "#cd")
+    channels.leave("baz", "Initial")
+    assert members(channels) == set()
+
+
+def test_part():
+    channels = Channels()
+    for channel in ("Initial", "#cd", "#sd"):
+        channels.join("foo", channel)
+    channels.join("bar", "#sd")
+
+    channels.part("foo")
+    assert members(channels) == {("#sd", "bar")}
+    assert "foo" not in channels.channels
+    assert set(channels.users) == {"Initial", "#sd"}
+    channels.part("foo")
+    channels.part("baz")
+    assert members(channels) == {("#sd", "bar")}
+
+
+def test_recipients():
+    channels = Channels()
+    channels.join("foo", "Initial")
+    channels.join("bar", "#cd")
+    channels.join("baz", "#cd")
+    assert channels.recipients("foo", TextMessage("Olá")) == {"foo"}
+    assert channels.recipients("bar", TextMessage("Olá", "#cd")) == {"bar", "baz"}
+    assert channels.recipients("foo", TextMessage("Olá", "#cd")) == ()
+    assert channels.recipients("foo", TextMessage("Olá", "#sd")) == ()
+
+
+def test_broadcast_reaches_channel_members():
+    server = Server(("localhost", 0))
+    clients = [socket.create_connection(server.sock.getsockname()) for _ in range(3)]
+    for _ in clients:
+        server.accept(server.sock, None)
+    conns = {conn.getpeername(): conn for conn in server.readers}
+    foo, bar, baz = (conns[sock.getsockname()] for sock in clients)
+    for conn, name, frames in ((foo, "foo", [JoinMessage("#cd")]), (bar, "bar", [JoinMessage("#cd"), LeaveMessage("#cd")]),
+                               (baz, "baz", [])):
+        server.readers[conn].feed(b"".join(CDProto.encode(msg) for msg in [CDProto.register(name)] + frames))
+        server.process(conn)
+    assert members(server) == {("#cd", foo), ("Initial", baz)}
+
+    depths = {conn: server.writers[conn].depth for conn in (foo, bar, baz)}
+    server.broadcast(foo, TextMessage("Olá Mundo", "#cd"))
+    server.broadcast(bar, TextMessage("Olá Mundo", "#cd"))
+    server.broadcast(baz, TextMessage("Olá Mundo"))
+    assert {conn: server.writers[conn].depth - depth for conn, depth in depths.items()} == {foo: 1, bar: 0, baz: 1}
+
+    server.disconnect(foo)
+    assert members(server) == {("Initial", baz)}
+    for sock in clients:
+        sock.close()
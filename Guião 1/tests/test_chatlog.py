@@ -0,0 +1,89 @@
+"""Tests for the persistent channel log."""
+import os
+import socket
+import threading
+import time
+
+from src.chatlog import ChatLog
+from src.protocol import CDProto, CDProtoReader, JoinMessage, TextMessage
+from src.server import Server
+
+PORT = 5297
+
+
+def messages(log, channel, **kwargs):
+    return [CDProto.decode(bytes(payload)).message for ts, payload in log.replay(channel, **kwargs)]
+
+
+def test_survives_restart(tmp_path):
+    log = ChatLog(str(tmp_path))
+    for i in range(10):
+        log.append("#cd" if i % 2 else "#other", TextMessage(str(i), ts=100 + i))
+    log.close()
+
+    log = ChatLog(str(tmp_path))
+    assert messages(log, "#cd") == ["1", "3", "5", "7", "9"]
+    assert messages(log, "#other", since=106) == ["6", "8"]
+    assert messages(log, "#cd", limit=2) == ["7", "9"]
+
+    log.append("#cd", TextMessage("10", ts=110))
+    assert messages(log, "#cd", since=109) == ["9", "10"]
+
+
+def test_partial_record_is_truncated(tmp_path):
+    log = ChatLog(str(tmp_path))
+    log.append("#cd", TextMessage("whole", ts=1))
+    log.append("#cd", TextMessage("torn", ts=2))
+    log.close()
+    path = os.path.join(str(tmp_path), "0000000000.log")
+    os.truncate(path, os.path.getsize(path) - 3)
+
+    log = ChatLog(str(tmp_path))
+    assert messages(log, "#cd") == ["whole"]
+    log.append("#cd", TextMessage("after", ts=3))
+    log.close()
+    assert messages(ChatLog(str(tmp_path)), "#cd") == ["whole", "after"]
+
+
+def test_rotation_and_retention(tmp_path):
+    log = ChatLog(str(tmp_path), segment_bytes=200, max_bytes=600)
+    for i in range(100):
+        log.append("#cd", TextMessage(f"message {i}", ts=i))
+    log.flush()
+
+    assert 1 < len(os.listdir(str(tmp_path))) <= 5
+    kept = messages(log, "#cd")
+    assert kept == [f"message {i}" for i in range(100 - len(kept), 100)]
+    assert len(log) == len(kept)
+
+
+def test_live_messages_wait_for_the_replay(tmp_path):
+    log = ChatLog(str(tmp_path))
+    for i in range(2000):
+        log.append("#cd", TextMessage(f"{i} " + "x" * 1000, "#cd", ts=1 + i))
+    log.flush()
+    server = Server(("localhost", PORT), max_queue=16, log=log)
+    threading.Thread(target=server.loop, daemon=True).start()
+
+    late = socket.socket()
+    late.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+    late.connect(("localhost", PORT))
+    late.settimeout(5)
+    CDProto.send_msg(late, CDProto.register("late"))
+    CDProto.send_msg(late, JoinMessage("#cd", 0))
+    live = socket.create_connection(("localhost", PORT))
+    CDProto.send_msg(live, CDProto.register("live"))
+    CDProto.send_msg(live, JoinMessage("#cd"))
+    time.sleep(0.2)
+    assert len(server.replays) == 1  # still replaying
+    CDProto.send_msg(live, TextMessage("live", "#cd"))
+
+    reader, got = CDProtoReader(), []
+    while not got or got[-1] != "live":
+        assert reader.recv(late)
+        while (msg := reader.pop()) is not None:
+            got.append(msg.message.split(" ")[0])
+    assert got == [str(i) for i in range(2000)] + ["live"]
+    assert not server.replays and not server.deferred
+    late.close()
+    live.close()
@@ -0,0 +1,73 @@
+"""Tests for the routing between the workers of the multi-process server."""
+import socket
+import threading
+import time
+
+from src.cluster import WorkerServer
+from src.protocol import CDProto, CDProtoReader, DirectMessage, JoinMessage, TextMessage
+
+
+def workers(**kwargs):
+    a, b = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+    return WorkerServer(("localhost", 0), [a], **kwargs), WorkerServer(("localhost", 0), [b], **kwargs)
+
+
+def client(server, name, channel):
+    sock = socket.create_connection(server.sock.getsockname())
+    sock.settimeout(3)
+    CDProto.send_msg(sock, CDProto.register(name))
+    CDProto.send_msg(sock, JoinMessage(channel))
+    return sock
+
+
+def receive(sock, count):
+    reader, got = CDProtoReader(), []
+    while len(got) < count:
+        assert reader.recv(sock)
+        while (msg := reader.pop()) is not None:
+            got.append(msg)
+    return got
+
+
+def wait_for(condition):
+    deadline = time.monotonic() + 3
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_messages_reach_the_other_worker():
+    first, second = workers()
+    for server in (first, second):
+        threading.Thread(target=server.loop, daemon=True).start()
+    foo, bar, baz = client(first, "foo", "#cd"), client(second, "bar", "#cd"), client(second, "baz", "#other")
+    wait_for(lambda: len(first.users.get("#cd", ())) == 1 and len(second.users.get("#other", ())) == 1)
+
+    CDProto.send_msg(foo, TextMessage("Olá Mundo", "#cd"))
+    CDProto.send_msg(foo, DirectMessage("psst", "baz"))
+    assert [msg.message for msg in receive(bar, 1)] == ["Olá Mundo"]
+    direct, = receive(baz, 1)
+    assert isinstance(direct, DirectMessage) and (direct.message, direct.sender) == ("psst", "foo")
+    for sock in (foo, bar, baz):
+        sock.close()
+
+
+def test_full_bus_delays_messages():
+    first, second = workers()
+    bar = socket.create_connection(second.sock.getsockname())
+    bar.settimeout(3)
+    second.accept(second.sock, None)
+    conn, = second.readers
+    second.readers[conn].feed(CDProto.encode(CDProto.register("bar")) + CDProto.encode(JoinMessage("#cd")))
+    second.process(conn)
+
+    # nobody reads the bus yet, so most of these wait in the outbox
+    for i in range(100):
+        first.publish("#cd", CDProto.encode(TextMessage(f"{i} " + "x" * 8000, "#cd"), True, True))
+    assert first.outbox[first.peers[0]]
+    for server in (first, second):
+        threading.Thread(target=server.loop, daemon=True).start()
+
+    assert [msg.message.split()[0] for msg in receive(bar, 100)] == [str(i) for i in range(100)]
+    wait_for(lambda: not first.outbox[first.peers[0]])
+    bar.close()
@@ -0,0 +1,55 @@
+"""Tests for the encode-once fan-out of channel messages."""
+import socket
+import threading
+
+from src.protocol import CDProto, CDProtoReader, JoinMessage, TextMessage
+from src.server import OverflowPolicy, Server
+
+
+def connect(server, *registers):
+    """Clients of the given register messages, joined to #cd, and their
+    connections on the server, whose loop is not running yet."""
+    clients = [socket.create_connection(server.sock.getsockname()) for _ in registers]
+    for _ in registers:
+        server.accept(server.sock, None)
+    conns = {conn.getpeername(): conn for conn in server.readers}
+    for sock, register in zip(clients, registers):
+        sock.settimeout(3)
+        conn = conns[sock.getsockname()]
+        server.readers[conn].feed(CDProto.encode(register) + CDProto.encode(JoinMessage("#cd")))
+        server.process(conn)
+    return clients, [conns[sock.getsockname()] for sock in clients]
+
+
+def test_encoded_once_per_format():
+    server = Server(("localhost", 0))
+    clients, conns = connect(server, CDProto.register("foo"), CDProto.register("bar", "binary"),
+                             CDProto.register("baz"), CDProto.register("qux", "binary", "varint"))
+    encodes = server.metrics.encodes
+    frames = server.broadcast(conns[0], TextMessage("Olá Mundo", "#cd"))
+
+    assert sorted(frames) == [(False, False), (True, False), (True, True)]
+    assert server.metrics.encodes - encodes == 3
+    assert server.metrics.channel("#cd").deliveries == 4
+
+    threading.Thread(target=server.loop, daemon=True).start()
+    for sock, varint in zip(clients, (False, False, False, True)):
+        reader = CDProtoReader(varint=varint)
+        assert reader.recv(sock)
+        assert reader.pop().message == "Olá Mundo"
+        sock.close()
+
+
+def test_deliveries_count_queued_frames():
+    server = Server(("localhost", 0), max_queue=2, overflow=OverflowPolicy.DISCONNECT)
+    clients, (foo, bar, baz) = connect(server, CDProto.register("foo"), CDProto.register("bar"), CDProto.register("baz"))
+    for _ in range(2):
+        server.send(baz, CDProto.encode(TextMessage("old", "#cd")))
+
+    server.broadcast(foo, TextMessage("Olá Mundo", "#cd"))
+    stats = server.metrics.channel("#cd")
+    assert baz not in server.writers
+    assert stats.deliveries == 2
+    assert stats.bytes == 2 * len(CDProto.encode(TextMessage("Olá Mundo", "#cd")))
+    for sock in clients:
+        sock.close()
@@ -0,0 +1,169 @@
+"""Tests for the incremental frame reader and writer."""
+import pytest
+from src.protocol import (
+    CDProto,
+    CDProtoReader,
+    CDProtoWriter,
+    TextMessage,
+    JoinMessage,
+    LeaveMessage,
+    DirectMessage,
+    WhoMessage,
+    ListMessage,
+    CDProtoBadFormat,
+)
+
+
+def test_partial_frames():
+    data = CDProto.encode(JoinMessage("#cd")) + CDProto.encode(TextMessage("Olá", "#cd", 1))
+    r = CDProtoReader()
+
+    r.feed(data[:1])
+    assert r.pop() is None
+    r.feed(data[1:10])
+    assert r.pop() is None
+    r.feed(data[10:])
+
+    assert isinstance(r.pop(), JoinMessage)
+    m = r.pop()
+    assert isinstance(m, TextMessage) and m.message == "Olá"
+    assert r.pop() is None
+    assert len(r) == 0
+
+
+def test_bad_frame_is_skipped():
+    r = CDProtoReader()
+    r.feed(len(b"junk").to_bytes(2, "big") + b"junk" + CDProto.encode(JoinMessage("#cd")))
+
+    with pytest.raises(CDProtoBadFormat):
+        r.pop()
+    assert isinstance(r.pop(), JoinMessage)
+
+
+class slow_socket:
+    def __init__(self, limit):
+        self.limit = limit
+        self.data = b""
+
+    def send(self, data):
+        if self.limit == 0:
+            raise BlockingIOError()
+        n = min(self.limit, len(data))
+        self.data += bytes(data[:n])
+        return n
+
+
+def test_writer_queues_leftover():
+    frame = CDProto.encode(TextMessage("Hello World", ts=1))
+    s = slow_socket(3)
+    w = CDProtoWriter()
+
+    assert w.write(s, frame)
+    assert len(w) == len(frame) - 3
+    s.limit = 0
+    assert w.flush(s)
+    s.limit = 1024
+    assert not w.flush(s)
+    assert s.data == frame
+
+
+def test_writer_bounded_queue():
+    w = CDProtoWriter(maxlen=2)
+    frames = [CDProto.encode(TextMessage(str(i), ts=1)) for i in range(3)]
+
+    assert w.put(frames[0])
+    assert not w.put(frames[1])
+    assert w.full and w.depth == 2
+
+    assert w.drop_oldest()
+    w.put(frames[2])
+    s = slow_socket(1024)
+    assert not w.flush(s)
+    assert s.data == frames[1] + frames[2]
+
+
+def test_drop_oldest_keeps_partial_frame():
+    w = CDProtoWriter(maxlen=2)
+    frames = [CDProto.encode(TextMessage(str(i), ts=1)) for i in range(3)]
+    w.put(frames[0])
+    w.put(frames[1])
+    s = slow_socket(3)
+    w.flush(s)
+
+    assert w.drop_oldest()
+    w.put(frames[2])
+    s.limit = 1024
+    w.flush(s)
+    assert s.data == frames[0] + frames[2]
+
+
+def test_leave_roundtrip():
+    r = CDProtoReader()
+    r.feed(CDProto.encode(CDProto.leave("#cd")))
+    m = r.pop()
+    assert isinstance(m, LeaveMessage) and m.channel == "#cd"
+
+
+def test_binary_roundtrip():
+    msgs = [
+        CDProto.register("student", "binary"),
+        CDProto.join("#cd"),
+        CDProto.leave("#cd"),
+        TextMessage("Olá Mundo" * 50, ts=1615852800),
+        TextMessage("Hello World", "#cd", 1615852800),
+        DirectMessage("psst", "bar", "foo", 1615852800),
+        WhoMessage("#cd", ["foo", "bar"]),
+        ListMessage(["Initial", "#cd"]),
+    ]
+    r = CDProtoReader()
+    for m in msgs:
+        frame = CDProto.encode(m, binary=True)
+        assert len(frame) < len(CDProto.encode(m))
+        r.feed(frame)
+    assert [str(r.pop()) for _ in msgs] == [str(m) for m in msgs]
+
+
+def test_binary_truncated():
+    frame = CDProto.encode(TextMessage("Hello World", "#cd", 1), binary=True)
+    with pytest.raises(CDProtoBadFormat):
+        CDProto.decode(frame[2:-1])
+
+
+def test_varint_large_frame():
+    msg = TextMessage("€" * 40000, "#cd", 1)
+    with pytest.raises(OverflowError):
+        CDProto.encode(msg)
+
+    frame = CDProto.encode(msg, varint=True)
+    r = CDProtoReader(varint=True)
+    for i in range(0, len(frame), 1000):
+        r.feed(frame[i:i + 1000])
+    assert r.pop().message == msg.message
+    assert CDProto.decode_frame(frame, varint=True).message == msg.message
+
+
+def test_oversized_frame_is_skipped():
+    big = CDProto.encode(TextMessage("x" * 500, ts=1), varint=True)
+    r = CDProtoReader(varint=True, max_frame=100)
+    r.feed(big[:50])
+    with pytest.raises(CDProtoBadFormat):
+        r.pop()
+    r.feed(big[50:] + CDProto.encode(JoinMessage("#cd"), varint=True))
+    assert isinstance(r.pop(), JoinMessage)
+
+
+def test_burst_in_one_recv():
+    import socket
+    a, b = socket.socketpair()
+    frames = [CDProto.encode(TextMessage(f"burst {i}", "#cd", i)) for i in range(100)]
+    a.sendall(b"".join(frames))
+    b.setblocking(False)
+    r = CDProtoReader()
+
+    assert r.recv(b)
+    received = []
+    while (m := r.pop()) is not None:
+        received.append(m.message)
+    assert received == [f"burst {i}" for i in range(100)]
+    a.close()
+    b.close()
@@ -0,0 +1,48 @@
+"""Tests for the server heartbeat."""
+import socket
+import threading
+import time
+
+from src.protocol import CDProto, CDProtoReader, PingMessage, PongMessage
+from src.server import Server
+
+PORT = 5299
+
+
+def client(name):
+    sock = socket.create_connection(("localhost", PORT))
+    CDProto.send_msg(sock, CDProto.register(name))
+    sock.settimeout(3)
+    return sock
+
+
+def test_idle_clients_are_pinged_and_reaped():
+    server = Server(("localhost", PORT), heartbeat=0.2, ping_timeout=0.4)
+    threading.Thread(target=server.loop, daemon=True).start()
+    quiet, alive = client("quiet"), client("alive")
+
+    reader = CDProtoReader()
+    reader.recv(quiet)
+    assert isinstance(reader.pop(), PingMessage)
+
+    deadline = time.monotonic() + 1.5
+    while time.monotonic() < deadline:
+        reader = CDProtoReader()
+        assert reader.recv(alive)
+        assert isinstance(reader.pop(), PingMessage)
+        CDProto.send_msg(alive, PongMessage())
+    assert quiet.recv(1) == b""
+    assert list(server.presence.online()) == ["alive"]
+    assert server.metrics.reaped == 1
+    quiet.close()
+    alive.close()
+
+
+def test_off_by_default():
+    for server in (Server(("localhost", 0)), Server(("localhost", 0), heartbeat=0.2, ping_timeout=None)):
+        client = socket.create_connection(server.sock.getsockname())
+        server.accept(server.sock, None)
+        assert server.heartbeat is None
+        assert not server.timers.deadlines
+        client.close()
+        server.sock.close()
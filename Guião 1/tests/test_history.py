@@ -0,0 +1,49 @@
+"""Tests for the channel history ring buffer."""
+from src.history import ChannelHistory
+from src.protocol import CDProto, TextMessage
+
+
+def add(history, text, ts, channel="#cd"):
+    msg = TextMessage(text, channel, ts)
+    frames = {(False, False): CDProto.encode(msg)}
+    history.add(channel, msg, frames)
+    return frames
+
+
+def test_replay_reuses_frames():
+    h = ChannelHistory()
+    frames = [add(h, str(i), i) for i in range(3)]
+
+    replay = h.replay("#cd")
+    assert [f is fr[False, False] for f, fr in zip(replay, frames)] == [True] * 3
+    assert h.replay("#other") == []
+
+
+def test_replay_since():
+    h = ChannelHistory()
+    for i in range(10):
+        add(h, str(i), 100 + i)
+
+    replay = h.replay("#cd", since=107)
+    assert [CDProto.decode_frame(f).message for f in replay] == ["7", "8", "9"]
+
+
+def test_limits():
+    h = ChannelHistory(max_messages=5, max_bytes=10000)
+    for i in range(20):
+        add(h, str(i), i)
+    assert [CDProto.decode_frame(f).message for f in h.replay("#cd")] == ["15", "16", "17", "18", "19"]
+
+    h = ChannelHistory(max_messages=100, max_bytes=500)
+    for i in range(20):
+        add(h, "x" * 100, i)
+    assert 0 < len(h.replay("#cd")) <= 3
+    assert h.sizes["#cd"] <= 500
+
+
+def test_other_format_is_encoded_once():
+    h = ChannelHistory()
+    add(h, "Olá", 1)
+    first = h.replay("#cd", (True, True))
+    assert CDProto.decode_frame(first[0], varint=True).message == "Olá"
+    assert h.replay("#cd", (True, True))[0] is first[0]
@@ -0,0 +1,52 @@
+"""Tests for the load generator and its regression check."""
+import asyncio
+
+from benchmarks.harness import percentile, start_server
+from benchmarks.loadgen import compare, run
+
+PORT = 5298
+
+BASELINE = {"results": {"msgs_per_sec": 1000.0, "p50_ms": 2.0, "p99_ms": 10.0, "server_cpu_s": 1.0, "server_rss_mb": 50.0}}
+
+
+def results(**changes):
+    return {"results": dict(BASELINE["results"], **changes)}
+
+
+def test_compare_within_tolerance(capsys):
+    assert compare(results(msgs_per_sec=950.0, p99_ms=10.5), BASELINE, 0.1)
+    assert compare(results(msgs_per_sec=2000.0, p50_ms=1.0), BASELINE, 0.1)
+    assert "REGRESSION" not in capsys.readouterr().out
+
+
+def test_compare_regressions(capsys):
+    assert not compare(results(msgs_per_sec=800.0), BASELINE, 0.1)
+    assert not compare(results(p99_ms=12.0), BASELINE, 0.1)
+    assert not compare(results(server_rss_mb=60.0), BASELINE, 0.1)
+    assert capsys.readouterr().out.count("REGRESSION") == 3
+
+
+def test_compare_skips_missing_metrics():
+    assert compare({"results": {"msgs_per_sec": 10.0}}, {"results": {"msgs_per_sec": 0, "p50_ms": 2.0}}, 0.1)
+
+
+def test_percentile():
+    assert percentile([3, 1, 2, 4], 50) == 3
+    assert percentile([3, 1, 2, 4], 99) == 4
+    assert percentile([], 50) != percentile([], 50)
+
+
+def test_run():
+    proc = start_server("selectors", PORT)
+    try:
+        report = asyncio.run(run(PORT, proc.pid, clients=20, channels=4, senders=4, messages=5, join_ratio=0.5, timeout=10))
+    finally:
+        proc.terminate()
+        proc.wait()
+    # Every message reaches the 5 members of its channel, sender included.
+    assert report["sent"] == 20
+    assert report["expected"] == 100
+    assert report["delivered"] == 100
+    assert report["msgs_per_sec"] > 0
+    assert report["p50_ms"] <= report["p99_ms"] <= report["max_ms"]
+    assert report["server_rss_mb"] > 0
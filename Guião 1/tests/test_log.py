@@ -0,0 +1,80 @@
+"""Tests for the batched log writer."""
+import logging
+import threading
+
+from src.log import BatchFileHandler, LazyQueueHandler, Writer
+
+
+class Recorder(logging.Handler):
+    """Handler keeping what it is given, and in which thread."""
+
+    def __init__(self):
+        super().__init__()
+        self.records = []
+        self.flushes = []
+        self.threads = set()
+        self.gate = threading.Event()
+
+    def emit(self, record):
+        self.gate.wait(3)
+        self.threads.add(threading.current_thread().name)
+        self.records.append(record.getMessage())
+
+    def flush(self):
+        self.flushes.append(len(self.records))
+
+
+def logger(writer, name):
+    log = logging.getLogger(name)
+    log.propagate = False
+    log.setLevel(logging.DEBUG)
+    log.handlers = [LazyQueueHandler(writer)]
+    return log
+
+
+def test_batches():
+    handler = Recorder()
+    writer = Writer(handler, batch=4, interval=0)
+    writer.start()
+    log = logger(writer, "test_log.batches")
+    log.info("first")
+    for i in range(9):
+        log.info("record %d", i)
+    handler.gate.set()
+    writer.stop()
+
+    assert handler.records == ["first"] + [f"record {i}" for i in range(9)]
+    assert handler.threads == {"log-writer"}
+    # One flush per batch of at most 4 records, plus the one on stop.
+    steps = [b - a for a, b in zip([0] + handler.flushes, handler.flushes)]
+    assert all(step <= 4 for step in steps)
+    assert handler.flushes[-1] == 10
+    assert len(handler.flushes) < 10
+
+
+def test_formatted_in_the_writer():
+    handler = Recorder()
+    writer = Writer(handler, interval=0)
+    log = logger(writer, "test_log.lazy")
+    arg = {"n": 1}
+    log.info("%s", arg)
+    arg["n"] = 2    # a record is only formatted once written
+    handler.gate.set()
+    writer.start()
+    writer.stop()
+    assert handler.records == ["{'n': 2}"]
+
+
+def test_stop_writes_the_queued_records(tmp_path):
+    path = tmp_path / "server.log"
+    handler = BatchFileHandler(path)
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    writer = Writer(handler)
+    writer.start()
+    log = logger(writer, "test_log.file")
+    for i in range(3):
+        log.info("record %d", i)
+    writer.stop()
+    handler.close()
+    assert path.read_text().splitlines() == ["record 0", "record 1", "record 2"]
+    assert not writer.thread.is_alive()
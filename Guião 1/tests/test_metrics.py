@@ -0,0 +1,37 @@
+"""Tests for the server counters."""
+import socket
+from types import SimpleNamespace
+
+from src.metrics import Metrics
+from src.presence import Presence
+from src.protocol import CDProto, CDProtoReader, CDProtoWriter, TextMessage
+
+
+def test_render():
+    a, b = socket.socketpair()
+    reader, writer = CDProtoReader(), CDProtoWriter()
+    reader.feed(CDProto.encode(TextMessage("Olá", "#cd", 1)))
+    reader.pop()
+    writer.write(b, CDProto.encode(TextMessage("Olá", "#cd", 1)))
+    server = SimpleNamespace(readers={b: reader}, writers={b: writer}, presence=Presence(),
+                             users={"Initial": set(), "#cd": {b}})
+    server.presence.register(b, 'fo"o')
+    m = Metrics()
+    m.channel("#cd").messages += 1
+    m.channel("#gone").messages += 1
+    m.observe_loop(0.002)
+
+    text = m.render(server)
+    assert "chat_connections 1\n" in text
+    assert f'chat_connection_frames_in_total{{connection="{b.fileno()}",user="fo\\"o"}} 1\n' in text
+    assert f"chat_bytes_out_total {writer.sent}\n" in text
+    assert 'chat_channel_messages_total{channel="#cd"} 1\n' in text
+    assert "#gone" not in text
+    assert 'chat_loop_lag_seconds_bucket{le="0.001"} 0\n' in text
+    assert 'chat_loop_lag_seconds_bucket{le="0.005"} 1\n' in text
+
+    m.close(reader, writer)
+    server.readers.clear()
+    assert "chat_frames_in_total 1\n" in m.render(server)
+    a.close()
+    b.close()
@@ -0,0 +1,69 @@
+"""Tests for the overflow policies of the client output queues."""
+import socket
+import threading
+
+from src.protocol import CDProto, CDProtoReader, JoinMessage, TextMessage
+from src.server import OverflowPolicy, Server
+
+
+def connect(server, *names):
+    """Clients registered in #cd, and their connections on the server.
+    The server loop is not running, so nothing is sent until it does."""
+    clients = [socket.create_connection(server.sock.getsockname()) for _ in names]
+    for _ in names:
+        server.accept(server.sock, None)
+    conns = {conn.getpeername(): conn for conn in server.readers}
+    for sock, name in zip(clients, names):
+        sock.settimeout(3)
+        conn = conns[sock.getsockname()]
+        server.readers[conn].feed(CDProto.encode(CDProto.register(name)) + CDProto.encode(JoinMessage("#cd")))
+        server.process(conn)
+    return clients, [conns[sock.getsockname()] for sock in clients]
+
+
+def say(server, conn, *texts):
+    server.readers[conn].feed(b"".join(CDProto.encode(TextMessage(text, "#cd")) for text in texts))
+    server.process(conn)
+
+
+def receive(sock, count):
+    reader, got = CDProtoReader(), []
+    while len(got) < count:
+        assert reader.recv(sock)
+        while (msg := reader.pop()) is not None:
+            got.append(msg.message)
+    return got
+
+
+def test_disconnect_slow_client():
+    server = Server(("localhost", 0), max_queue=4, overflow=OverflowPolicy.DISCONNECT)
+    (foo, bar), (fast, slow) = connect(server, "foo", "bar")
+    for i in range(5):
+        say(server, fast, str(i))
+        server.write(fast)
+    assert slow not in server.writers and fast in server.writers
+    assert bar.recv(1) == b""
+    assert receive(foo, 5) == [str(i) for i in range(5)]
+    foo.close()
+    bar.close()
+
+
+def test_block_pauses_the_sender():
+    server = Server(("localhost", 0), max_queue=4, overflow=OverflowPolicy.BLOCK)
+    (foo, bar), (fast, slow) = connect(server, "foo", "bar")
+    for _ in range(3):
+        server.send(slow, CDProto.encode(TextMessage("old", "#cd")))
+
+    say(server, fast, "0", "1", "2")
+    # the second message fills the queue of bar and pauses foo
+    assert server.paused == {fast: {slow}}
+    assert server.queue_depth(slow) == 5
+    # nobody to pause for a message from another worker: it is not queued
+    server.fanout(server.users["#cd"], TextMessage("lost", "#cd"))
+    assert server.queue_depth(slow) == 5 and server.writers[slow].dropped == 1
+
+    threading.Thread(target=server.loop, daemon=True).start()
+    assert receive(bar, 6) == ["old"] * 3 + ["0", "1", "2"]
+    assert receive(foo, 4) == ["0", "1", "lost", "2"]
+    foo.close()
+    bar.close()
@@ -0,0 +1,21 @@
+"""Tests for the registry of connected users."""
+from src.presence import Presence
+
+
+def test_register_and_who():
+    p = Presence()
+    p.register("c1", "foo")
+    p.register("c2", "bar")
+    p.register("c3", "foo")
+
+    assert sorted(p.online()) == ["bar", "foo"]
+    assert p.connections("foo") == {"c1", "c3"}
+    assert p.who(["c1", "c3", "c4"]) == ["foo"]
+    assert p.last_seen("foo") is not None
+
+    p.unregister("c1")
+    assert p.connections("foo") == {"c3"}
+    p.register("c3", "baz")
+    assert sorted(p.online()) == ["bar", "baz"]
+    assert p.connections("foo") == ()
+    assert p.last_seen("foo") is None
@@ -59,3 +59,49 @@ def test_recv():
 
     with pytest.raises(CDProtoBadFormat):
         CDProto.recv_msg(mock_socket(b"Hello World"))
+
+
+def test_payloads_are_cached():
+    msg = TextMessage("Hello World", "#cd", 1615852800)
+
+    assert not hasattr(msg, "__dict__")
+    assert msg.to_json() is msg.to_json()
+    assert CDProto.encode(msg)[2:] is not msg.to_json()
+    assert CDProto.encode(msg)[2:] == msg.to_json() == str(msg).encode("utf-8")
+    assert msg.to_bytes() is msg.to_bytes()
+
+
+@pytest.mark.parametrize("payload", [
+    b'{"command": "message", "message": 123, "ts": 1}',
+    b'{"command": "message", "message": null, "ts": 1}',
+    b'{"command": "message", "message": "hi", "ts": -1}',
+    b'{"command": "message", "message": "hi", "ts": "1"}',
+    b'{"command": "message", "message": "hi", "ts": 1.5}',
+    b'{"command": "message", "message": "hi", "channel": 7, "ts": 1}',
+    b'{"command": "join", "channel": ["#cd"]}',
+    b'{"command": "leave", "channel": ["a"]}',
+    b'{"command": "join", "channel": "#cd", "ts": -1}',
+    b'{"command": "register", "user": null}',
+    b'{"command": "register", "user": "student", "encoding": 1}',
+    b'{"command": "direct", "message": "hi", "to": "bar", "ts": -1}',
+])
+def test_bad_field_types(payload):
+    with pytest.raises(CDProtoBadFormat):
+        CDProto.decode(payload)
+
+
+def test_optional_fields():
+    msg = CDProto.decode(b'{"command": "message", "message": "hi", "ts": 0}')
+    assert msg.channel is None and msg.ts == 0
+    assert CDProto.decode(b'{"command": "join", "channel": "#cd", "ts": null}').ts is None
+
+
+@pytest.mark.parametrize("payload", [
+    b'{"command": "who", "channel": ["a"]}',
+    b'{"command": "direct", "message": "hi", "to": ["x"], "ts": 1}',
+    b'{"command": "direct", "message": 1, "to": "x", "ts": 1}',
+    b'{"command": "direct", "message": "hi", "to": "x", "from": {}, "ts": 1}',
+])
+def test_bad_who_and_direct(payload):
+    with pytest.raises(CDProtoBadFormat):
+        CDProto.decode(payload)
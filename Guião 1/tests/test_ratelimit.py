@@ -0,0 +1,73 @@
+"""Tests for the rate limits of the server."""
+import socket
+import threading
+import time
+
+from src.protocol import CDProto, CDProtoReader, JoinMessage, TextMessage
+from src.ratelimit import TokenBucket
+from src.server import OverflowPolicy, Server
+
+PORT = 5298
+
+
+def test_token_bucket():
+    bucket = TokenBucket(2, 4, 0.0)
+    assert bucket.refill(0.0) == 4
+    bucket.tokens = 0
+    assert bucket.wait() == 0.5
+    assert bucket.refill(1.0) == 2
+    assert bucket.refill(10.0) == 4
+
+
+def test_flood_is_throttled_not_dropped():
+    server = Server(("localhost", PORT), rate=20, burst=5, max_frames=2)
+    threading.Thread(target=server.loop, daemon=True).start()
+    sock = socket.create_connection(("localhost", PORT))
+    sock.settimeout(3)
+    CDProto.send_msg(sock, CDProto.register("flood"))
+    start = time.monotonic()
+    sock.sendall(b"".join(CDProto.encode(TextMessage(str(i))) for i in range(15)))
+
+    reader, got = CDProtoReader(), []
+    while len(got) < 15:
+        assert reader.recv(sock)
+        while (msg := reader.pop()) is not None:
+            got.append(msg.message)
+    # register and 4 messages fit in the burst, the other 11 come at 20/s
+    assert time.monotonic() - start >= 0.45
+    assert got == [str(i) for i in range(15)]
+    assert server.metrics.throttled > 0
+    sock.close()
+
+
+def test_backlogged_client_disconnected_by_a_broadcast():
+    server = Server(("localhost", 0), max_queue=4, overflow=OverflowPolicy.DISCONNECT, max_frames=2)
+    address = server.sock.getsockname()
+    foo, bar = socket.create_connection(address), socket.create_connection(address)
+    server.accept(server.sock, None)
+    server.accept(server.sock, None)
+    conns = {conn.getpeername(): conn for conn in server.readers}
+    slow, fast = conns[bar.getsockname()], conns[foo.getsockname()]
+    for conn, name in ((fast, "foo"), (slow, "bar")):
+        server.readers[conn].feed(CDProto.encode(CDProto.register(name)) + CDProto.encode(JoinMessage("#cd")))
+        server.process(conn)
+    frame = CDProto.encode(TextMessage("old", "#cd"))
+    for _ in range(4):
+        server.writers[slow].put(frame)
+    # both have frames left over: the first one's broadcast overflows the other
+    server.readers[fast].feed(CDProto.encode(TextMessage("hi", "#cd")))
+    server.readers[slow].feed(CDProto.encode(TextMessage("bye", "#cd")))
+    server.backlog[fast] = server.backlog[slow] = True
+
+    thread = threading.Thread(target=server.loop, daemon=True)
+    thread.start()
+    foo.settimeout(3)
+    bar.settimeout(3)
+    reader = CDProtoReader()
+    assert reader.recv(foo)
+    assert reader.pop().message == "hi"
+    assert bar.recv(1) == b""
+    assert thread.is_alive()
+    assert not server.backlog and slow not in server.readers
+    foo.close()
+    bar.close()
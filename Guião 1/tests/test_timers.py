@@ -0,0 +1,56 @@
+"""Tests for the timer wheel."""
+from src.timers import TimerWheel
+
+
+def wheel():
+    return TimerWheel(tick=1.0, slots=8, clock=lambda: 0.0)
+
+
+def test_expire_in_order():
+    w = wheel()
+    w.schedule("a", 2.5)
+    w.schedule("b", 5)
+
+    assert w.advance(2.0) == []
+    assert w.advance(3.0) == ["a"]
+    assert w.advance(4.0) == []
+    assert w.advance(6.0) == ["b"]
+    assert len(w) == 0
+
+
+def test_postpone_and_cancel():
+    w = wheel()
+    w.schedule("a", 2)
+    w.schedule("b", 2)
+    w.advance(1.5)
+    w.schedule("a", 2)
+    w.cancel("b")
+
+    assert w.advance(3.0) == []
+    assert w.advance(4.0) == ["a"]
+
+
+def test_bring_forward():
+    w = wheel()
+    w.schedule("a", 6)
+    w.schedule("a", 1)
+
+    assert w.advance(2.0) == ["a"]
+
+
+def test_longer_than_a_turn():
+    w = wheel()
+    w.schedule("a", 20)
+
+    for t in range(1, 20):
+        assert w.advance(float(t)) == []
+    assert w.advance(21.0) == ["a"]
+
+
+def test_stall():
+    w = wheel()
+    w.schedule("a", 3)
+    w.schedule("b", 30)
+
+    assert w.advance(25.0) == ["a"]
+    assert w.advance(31.0) == ["b"]
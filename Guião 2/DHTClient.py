@@ -1,35 +1,278 @@
 import socket
-import pickle
 import logging
+import itertools
+import time
+from bisect import bisect_left, insort
+from collections import OrderedDict
+from utils import dht_hash, contains, DATAGRAM_SIZE, MAX_DATAGRAM, MAX_ITEM
+from DHTProto import encode, decode, size, DHTProtoError
+
+
+class RouteCache:
+    """Ranges of ids owned by DHT nodes, as learned from their replies.
+
+    Keeps at most size ranges and drops the least recently used one.
+    Ranges are kept sorted by the id of their node, so finding the
+    range of an id is a binary search."""
+
+    def __init__(self, size=64):
+        self.size = size
+        self.ranges = OrderedDict()  # id of a node -> (id of its predecessor, address)
+        self.ids = []  # sorted ids of the cached nodes
+
+    def learn(self, node_id, from_id, addr):
+        """ Record that node_id, at addr, owns the ids in (from_id, node_id]."""
+        if self.size == 0 or from_id is None:
+            return
+        if node_id not in self.ranges:
+            insort(self.ids, node_id)
+        self.ranges[node_id] = (from_id, addr)
+        self.ranges.move_to_end(node_id)
+        if len(self.ranges) > self.size:
+            oldest, _ = self.ranges.popitem(last=False)
+            self.ids.remove(oldest)
+
+    def find(self, key_hash):
+        """ Address of the owner of key_hash, or None when not cached."""
+        if not self.ids:
+            return None
+        # the owner is the first node at or after key_hash
+        node_id = self.ids[bisect_left(self.ids, key_hash) % len(self.ids)]
+        from_id, addr = self.ranges[node_id]
+        if from_id != node_id and not contains(from_id, node_id, key_hash):
+            return None
+        self.ranges.move_to_end(node_id)
+        return addr
+
+    def forget(self, addr):
+        """ Drop the ranges of the node at addr."""
+        for node_id in [node_id for node_id, (_, a) in self.ranges.items() if a == addr]:
+            del self.ranges[node_id]
+            self.ids.remove(node_id)
+
+    def __len__(self):
+        return len(self.ranges)
 
 
 class DHTClient:
-    def __init__(self, address):
-        """ Initialize client."""
+    def __init__(self, address, iterative=False, timeout=1, retries=3, cache_size=64):
+        """ Initialize client.
+
+        Parameters:
+            address: address of a node in the DHT
+            iterative: look up the owner of a key hop by hop and send the
+                request to it, instead of letting the nodes forward it
+            timeout: seconds to wait for a reply before retrying
+            retries: times a request is resent before giving up
+            cache_size: node ranges remembered to send requests straight
+                to the owner of a key (0 disables it)
+        """
         self.dht_addr = address
+        self.iterative = iterative
+        self.timeout = timeout
+        self.retries = retries
+        self.request_ids = itertools.count(1)
+        self.routes = RouteCache(cache_size)
         self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self.logger = logging.getLogger("DHTClient")
 
+    def request(self, address, method, args):
+        """ Send a request and wait for the reply carrying its request id.
+        Returns the reply, or None when every attempt timed out."""
+        return self.requests([(address, method, args)])[0]
+
+    def requests(self, calls):
+        """ Send requests, given as (address, method, args), all at once and
+        wait for the replies carrying their request ids, resending the
+        unanswered ones on timeout. Returns the replies in order, None for
+        those that never came."""
+        pending = {}  # request id -> (index, address, payload)
+        for i, (address, method, args) in enumerate(calls):
+            args["req_id"] = req_id = next(self.request_ids)
+            try:
+                pending[req_id] = (i, address, encode({"method": method, "args": args}))
+            except DHTProtoError as e:
+                self.logger.error("Cannot send %s: %s", method, e)
+        replies = [None] * len(calls)
+        for _ in range(self.retries + 1):
+            for req_id, (_, address, payload) in list(pending.items()):
+                try:
+                    self.socket.sendto(payload, address)
+                except OSError as e:
+                    self.logger.error("Cannot send %d bytes to %s: %s", len(payload), address, e)
+                    del pending[req_id]
+            deadline = time.monotonic() + self.timeout
+            while pending:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.socket.settimeout(remaining)
+                try:
+                    payload, addr = self.socket.recvfrom(MAX_DATAGRAM)
+                except socket.timeout:
+                    break
+                try:
+                    out = decode(payload)
+                except DHTProtoError as e:
+                    self.logger.warning("Invalid message from %s: %s", addr, e)
+                    continue
+                call = pending.pop(out.get("req_id"), None)
+                if call is None:
+                    self.logger.debug("Ignoring late reply: %s", out)
+                    continue
+                replies[call[0]] = out
+            if not pending:
+                break
+            self.logger.warning("No reply to %d requests", len(pending))
+        return replies
+
+    def owner(self, key_hash):
+        """ Address of the node owning key_hash, by asking the nodes for the
+        next hop until one knows the owner."""
+        address = self.dht_addr
+        for _ in range(2 ** 10):
+            out = self.request(address, "LOOKUP", {"id": key_hash})
+            if out is None:
+                return None
+            args = out["args"]
+            if args["owner"]:
+                self.routes.learn(args["id"], args["from_id"], args["addr"])
+                return args["addr"]
+            address = args["addr"]
+        return None
+
+    def send(self, key, method, args):
+        """ Send a PUT/GET for key to its owner when it is cached or, in
+        iterative mode, looked up; otherwise to the bootstrap node.
+        Learns the range of the node that replies. The cached route is
+        dropped when the node does not reply or no longer owns the key;
+        a NACK (key not found or already there) keeps it."""
+        key_hash = dht_hash(key)
+        address = self.routes.find(key_hash)
+        if address is None:
+            address = self.owner(key_hash) if self.iterative else self.dht_addr
+            if address is None:
+                return None
+        out = self.request(address, method, args)
+        if out is None:
+            # the node may have left
+            self.routes.forget(address)
+        elif "owner" in out and not self.covers(out["owner"], key_hash):
+            # the node gave the key to another one
+            self.routes.forget(address)
+        self.learn(out)
+        return out
+
+    def covers(self, owner, key_hash):
+        """ Whether the range of the node that sent a reply holds key_hash,
+        as far as it knows."""
+        from_id, node_id = owner["from_id"], owner["id"]
+        return from_id is None or from_id == node_id or contains(from_id, node_id, key_hash)
+
+    def learn(self, out):
+        """ Record the range of the node that sent a reply."""
+        if out is not None and "owner" in out:
+            owner = out["owner"]
+            self.routes.learn(owner["id"], owner["from_id"], owner["addr"])
+
+    def batches(self, method, field, items, room, key=lambda item: item):
+        """ Group items by the node owning their key, in requests of about
+        room bytes. Returns the requests as (address, method, args)."""
+        groups = {}
+        for item in items:
+            key_hash = dht_hash(key(item))
+            address = self.routes.find(key_hash) or self.owner(key_hash)
+            groups.setdefault(address, []).append(item)
+        calls = []
+        for address, group in groups.items():
+            if address is None:
+                continue
+            batch, used = [], 0
+            for item in group:
+                item_size = size(item)
+                if batch and used + item_size > room:
+                    calls.append((address, method, {field: batch}))
+                    batch, used = [], 0
+                batch.append(item)
+                used += item_size
+            calls.append((address, method, {field: batch}))
+        return calls
+
+    def check(self, key, value):
+        """ Raise ValueError when key and value do not fit in a datagram;
+        values are not split across datagrams."""
+        try:
+            used = size(key) + size(value)
+        except DHTProtoError:
+            return  # logged when the request is encoded
+        if used > MAX_ITEM:
+            raise ValueError("{!r} and its value take {} bytes, over the {} of a datagram".format(key, used, MAX_ITEM))
+
+    def mput(self, items):
+        """ Store many values, sent to their owners in batches concurrently.
+        Returns whether each key was stored. Raises ValueError, storing
+        nothing, when a key and value do not fit in a datagram."""
+        for key, value in items.items():
+            self.check(key, value)
+        results = {key: False for key in items}
+        todo = list(items.items())
+        stalls = 0
+        while todo and stalls <= self.retries:
+            before = len(todo)
+            # the reply lists the keys, so it is smaller than the request
+            calls = self.batches("MPUT", "items", todo, DATAGRAM_SIZE - 256, key=lambda item: item[0])
+            todo = []
+            for (address, _, args), out in zip(calls, self.requests(calls)):
+                if out is None or out["args"]["moved"]:
+                    # the node is gone or no longer owns some of the keys
+                    self.routes.forget(address)
+                self.learn(out)
+                if out is None:
+                    todo += args["items"]
+                    continue
+                results.update((key, True) for key in out["args"]["stored"])
+                moved = set(out["args"]["moved"])
+                todo += [item for item in args["items"] if item[0] in moved]
+            stalls = stalls + 1 if len(todo) == before else 0
+        return results
+
+    def mget(self, keys):
+        """ Retrieve many keys, asked to their owners in batches concurrently.
+        Returns the value of each key, None for those not found."""
+        results = {key: None for key in keys}
+        todo = list(results)
+        stalls = 0
+        while todo and stalls <= self.retries:
+            before = len(todo)
+            # the keys take a quarter of the reply, the values the rest
+            calls = self.batches("MGET", "keys", todo, (DATAGRAM_SIZE - 256) // 4)
+            todo = []
+            for (address, _, args), out in zip(calls, self.requests(calls)):
+                if out is None or out["args"]["moved"]:
+                    self.routes.forget(address)
+                self.learn(out)
+                if out is None:
+                    todo += args["keys"]
+                    continue
+                results.update(out["args"]["values"])
+                todo += out["args"]["moved"] + out["args"]["left"]
+            stalls = stalls + 1 if len(todo) == before else 0
+        return results
+
     def put(self, key, value):
-        """ Store value to key in the DHT."""
-        msg = {"method": "PUT", "args": {"key": key, "value": value}}
-        pickled_msg = pickle.dumps(msg)
-        self.socket.sendto(pickled_msg, self.dht_addr)
-        pickled_msg, addr = self.socket.recvfrom(1024)
-        out = pickle.loads(pickled_msg)
-        if out["method"] != "ACK":
+        """ Store value to key in the DHT. Raises ValueError when they do not
+        fit in a datagram."""
+        self.check(key, value)
+        out = self.send(key, "PUT", {"key": key, "value": value})
+        if out is None or out["method"] != "ACK":
             self.logger.error("Invalid msg: %s", out)
             return False
         return True
 
     def get(self, key):
         """ Retrieve key from DHT."""
-        msg = {"method": "GET", "args": {"key": key}}
-        pickled_msg = pickle.dumps(msg)
-        self.socket.sendto(pickled_msg, self.dht_addr)
-        pickled_msg, addr = self.socket.recvfrom(1024)
-        out = pickle.loads(pickled_msg)
-        if out["method"] != "ACK":
+        out = self.send(key, "GET", {"key": key})
+        if out is None or out["method"] != "ACK":
             self.logger.error("Invalid msg: %s", out)
             return None
         return out["args"]
@@ -45,4 +288,4 @@ if __name__ == "__main__":
     # add object to DHT (this key is not on the first node -> remote search)
     client.put("2", ("xpto"))
     # retrieve from DHT (this key is not on the first node -> remote search)
-    print(client.get("2"))
\ No newline at end of file
+    print(client.get("2"))
@@ -2,8 +2,9 @@
 import socket
 import threading
 import logging
-import pickle
-from utils import dht_hash, contains
+from bisect import bisect_left
+from utils import dht_hash, contains, DATAGRAM_SIZE, MAX_DATAGRAM
+from DHTProto import encode, decode, size, DHTProtoError
 
 
 class FingerTable:
@@ -20,6 +21,9 @@ class FingerTable:
                 finger_table.append((node_id,node_addr))
                 break
         self.finger_table = finger_table
+        self.size = 2 ** m_bits
+        # distance from node_id to the start of each finger, in increasing order
+        self.starts = [2 ** i for i in range(m_bits)]
 
     def fill(self, node_id, node_addr):
         """ Fill all entries of finger_table with node_id, node_addr."""
@@ -31,28 +35,28 @@ class FingerTable:
         self.finger_table[index-1] = (node_id,node_addr)
 
     def find(self, identification):
-        """ Get node address of closest preceding node (in finger table) of identification. """
-        ret = self.finger_table[-1][1]
-        for i in range(len(self.finger_table)):
-            if(contains(self.node_id, self.finger_table[i][0], identification)):
-                ret = self.finger_table[i-1][1]
-                break
-        return ret
+        """ Get node address of closest preceding node (in finger table) of identification.
+
+        Fingers starting at or after identification point at or past it, so
+        the search starts from the last finger starting before it, found by
+        binary search on the starts. Falls back to the successor."""
+        distance = (identification - self.node_id) % self.size
+        for i in range(bisect_left(self.starts, distance) - 1, -1, -1):
+            node_id, node_addr = self.finger_table[i]
+            if 0 < (node_id - self.node_id) % self.size < distance:
+                return node_addr
+        return self.finger_table[0][1]
 
     def refresh(self):
         """ Retrieve finger table entries."""
-        i=1
-        table_size=len(self.finger_table)
-        return_list=[]
-        while(i-1<table_size):
-            return_list.append((i, (self.node_id + 2**(i-1) + 0) % pow(2, self.m_bits),self.finger_table[i-1][1]))
-            i+=1
-        return return_list
+        return [(i + 1, (self.node_id + start) % self.size, self.finger_table[i][1]) for i, start in enumerate(self.starts)]
 
     def getIdxFromId(self, id):
-        for i in range(self.m_bits):
-            if contains(self.node_id, (self.node_id + 2 ** i + 0) % pow(2, self.m_bits),id):
-                return i+1+0
+        """ Index (from 1) of the finger whose start is id."""
+        distance = (id - self.node_id) % self.size
+        i = bisect_left(self.starts, distance)
+        if distance and i < self.m_bits:
+            return i + 1
 
     def __repr__(self):
         return str(self.as_list)
@@ -103,19 +107,25 @@ class DHTNode(threading.Thread):
 
     def send(self, address, msg):
         """ Send msg to address. """
-        payload = pickle.dumps(msg)
-        self.socket.sendto(payload, address)
+        try:
+            self.socket.sendto(encode(msg), address)
+        except (DHTProtoError, OSError) as e:
+            self.logger.error("Cannot send %s to %s: %s", msg["method"], address, e)
 
     def recv(self):
-        """ Retrieve msg payload and from address."""
+        """ Retrieve msg and from address."""
         try:
-            payload, addr = self.socket.recvfrom(1024)
+            payload, addr = self.socket.recvfrom(MAX_DATAGRAM)
         except socket.timeout:
             return None, None
 
         if len(payload) == 0:
             return None, addr
-        return payload, addr
+        try:
+            return decode(payload), addr
+        except DHTProtoError as e:
+            self.logger.warning("Invalid message from %s: %s", addr, e)
+            return None, addr
 
     def node_join(self, args):
         """Process JOIN_REQ message.
@@ -207,51 +217,139 @@ class DHTNode(threading.Thread):
         for finger in self.finger_table.refresh():
             self.send(self.successor_addr, {"method": "SUCCESSOR", 'args': {"id": finger[1], "from": self.addr}})
 
-    def put(self, key, value, address):
+    def ownership(self):
+        """ Range of ids this node owns, as sent to clients."""
+        return {"id": self.identification, "addr": self.addr, "from_id": self.predecessor_id}
+
+    def owns(self, key_hash):
+        """ Whether key_hash is in the range of this node. A node that has
+        not been notified of its predecessor yet only owns the whole ring
+        when it is alone in it."""
+        if self.successor_id == self.identification:  # I'm the only node in the DHT
+            return True
+        if self.predecessor_id is None:
+            return False
+        return self.predecessor_id == self.identification or contains(self.predecessor_id, self.identification, key_hash)
+
+    def lookup(self, args, address):
+        """Process LOOKUP message, one step of an iterative lookup.
+            Replies with the owner of the id and the range it owns, or with
+            the next node to ask.
+
+        Parameters:
+            args (dict): id to look up and req_id of the request
+            address: address of the client
+        """
+
+        self.logger.debug("Lookup: %s", args)
+        key_hash = args["id"]
+        if self.successor_id == self.identification:  # I'm the only node in the DHT
+            reply = {"owner": True, "id": self.identification, "addr": self.addr, "from_id": self.identification}
+        elif contains(self.identification, self.successor_id, key_hash):
+            reply = {"owner": True, "id": self.successor_id, "addr": self.successor_addr, "from_id": self.identification}
+        elif self.predecessor_id is not None and contains(self.predecessor_id, self.identification, key_hash):
+            reply = dict(self.ownership(), owner=True)
+        else:
+            reply = {"owner": False, "addr": self.finger_table.find(key_hash)}
+        self.send(address, {"method": "LOOKUP_REP", "args": reply, "req_id": args.get("req_id")})
+
+    def put(self, key, value, address, req_id=None):
         """Store value in DHT.
 
         Parameters:
         key: key of the data
         value: data to be stored
         address: address where to send ack/nack
+        req_id: request id of the client, echoed in the ack/nack
         """
         key_hash = dht_hash(key)
         self.logger.debug("Put: %s %s", key, key_hash)
 
         #TODO Replace next code:
         if not contains(self.identification, self.successor_id, key_hash) == False:
-            self.send(self.successor_addr,{"method": "PUT", "args": {"key": key, "value": value,"from": address}})
-        elif not contains(self.predecessor_id, self.identification, key_hash) == False:
+            self.send(self.successor_addr,{"method": "PUT", "args": {"key": key, "value": value,"from": address, "req_id": req_id}})
+        elif self.owns(key_hash):
             if key in self.keystore:
-                self.send(address, {"method": "NACK"})
+                self.send(address, {"method": "NACK", "req_id": req_id, "owner": self.ownership()})
             else:
                 self.keystore[key] = value
-                self.send(address , {"method": "ACK"})
+                self.send(address , {"method": "ACK", "req_id": req_id, "owner": self.ownership()})
         else:
-            self.send(self.finger_table.find(key_hash), {"method": "PUT", "args": {"key": key, "value": value,"from": address}})
+            self.send(self.finger_table.find(key_hash), {"method": "PUT", "args": {"key": key, "value": value,"from": address, "req_id": req_id}})
 
 
-    def get(self, key, address):
+    def get(self, key, address, req_id=None):
         """Retrieve value from DHT.
 
         Parameters:
         key: key of the data
         address: address where to send ack/nack
+        req_id: request id of the client, echoed in the ack/nack
         """
         key_hash = dht_hash(key)
         self.logger.debug("Get: %s %s", key, key_hash)
 
         #TODO Replace next code:
         if not contains(self.identification, self.successor_id, key_hash) == False:
-            self.send(self.successor_addr,{"method": "GET", "args": {"key": key, "from":address}})
-        elif not contains(self.predecessor_id, self.identification, key_hash) == False:
+            self.send(self.successor_addr,{"method": "GET", "args": {"key": key, "from":address, "req_id": req_id}})
+        elif self.owns(key_hash):
             if key in self.keystore:
                 value = self.keystore[key]
-                self.send(address , {'method': 'ACK', "args": value})
+                self.send(address , {'method': 'ACK', "args": value, "req_id": req_id, "owner": self.ownership()})
             else:
-                self.send(address, {"method": "NACK"})
+                self.send(address, {"method": "NACK", "req_id": req_id, "owner": self.ownership()})
         else:
-            self.send(self.finger_table.find(key_hash),{"method": "GET", "args": {"key": key, "from":address}})
+            self.send(self.finger_table.find(key_hash),{"method": "GET", "args": {"key": key, "from":address, "req_id": req_id}})
+
+    def mput(self, items, address, req_id=None):
+        """Store a batch of values whose keys this node owns.
+
+        Parameters:
+        items: list of (key, value)
+        address: address where to send the reply, which lists the keys
+            stored, the keys already there and the keys of other nodes
+        req_id: request id of the client, echoed in the reply
+        """
+        self.logger.debug("Mput: %d keys", len(items))
+        reply = {"stored": [], "exists": [], "moved": []}
+        for key, value in items:
+            if not self.owns(dht_hash(key)):
+                reply["moved"].append(key)
+            elif key in self.keystore:
+                reply["exists"].append(key)
+            else:
+                self.keystore[key] = value
+                reply["stored"].append(key)
+        self.send(address, {"method": "ACK", "args": reply, "req_id": req_id, "owner": self.ownership()})
+
+    def mget(self, keys, address, req_id=None):
+        """Retrieve a batch of keys this node owns.
+
+        Parameters:
+        keys: list of keys
+        address: address where to send the reply, with the values found,
+            the keys missing, the keys of other nodes and the keys left
+            out for the reply to fit in a datagram
+        req_id: request id of the client, echoed in the reply
+        """
+        self.logger.debug("Mget: %d keys", len(keys))
+        reply = {"values": {}, "missing": [], "moved": [], "left": []}
+        # every key goes in the reply once, the values in what is left
+        room = DATAGRAM_SIZE - 256 - sum(size(key) for key in keys)
+        for key in keys:
+            if not self.owns(dht_hash(key)):
+                reply["moved"].append(key)
+            elif key not in self.keystore:
+                reply["missing"].append(key)
+            else:
+                value_size = size(self.keystore[key])
+                # the first value goes in even if it does not fit, in a larger datagram
+                if value_size <= room or not reply["values"]:
+                    reply["values"][key] = self.keystore[key]
+                    room -= value_size
+                else:
+                    reply["left"].append(key)
+        self.send(address, {"method": "ACK", "args": reply, "req_id": req_id, "owner": self.ownership()})
 
     def run(self):
         self.socket.bind(self.addr)
@@ -263,9 +361,8 @@ class DHTNode(threading.Thread):
                 "args": {"addr": self.addr, "id": self.identification},
             }
             self.send(self.dht_address, join_msg)
-            payload, addr = self.recv()
-            if payload is not None:
-                output = pickle.loads(payload)
+            output, addr = self.recv()
+            if output is not None:
                 self.logger.debug("O: %s", output)
                 if output["method"] == "JOIN_REP":
                     args = output["args"]
@@ -276,9 +373,8 @@ class DHTNode(threading.Thread):
                     self.logger.info(self)
 
         while not self.done:
-            payload, addr = self.recv()
-            if payload is not None:
-                output = pickle.loads(payload)
+            output, addr = self.recv()
+            if output is not None:
                 self.logger.info("O: %s", output)
                 if output["method"] == "JOIN_REQ":
                     self.node_join(output["args"])
@@ -289,9 +385,16 @@ class DHTNode(threading.Thread):
                         output["args"]["key"],
                         output["args"]["value"],
                         output["args"].get("from", addr),
+                        output["args"].get("req_id"),
                     )
                 elif output["method"] == "GET":
-                    self.get(output["args"]["key"], output["args"].get("from", addr))
+                    self.get(output["args"]["key"], output["args"].get("from", addr), output["args"].get("req_id"))
+                elif output["method"] == "LOOKUP":
+                    self.lookup(output["args"], addr)
+                elif output["method"] == "MPUT":
+                    self.mput(output["args"]["items"], output["args"].get("from", addr), output["args"].get("req_id"))
+                elif output["method"] == "MGET":
+                    self.mget(output["args"]["keys"], output["args"].get("from", addr), output["args"].get("req_id"))
                 elif output["method"] == "PREDECESSOR":
                     # Reply with predecessor id
                     self.send(
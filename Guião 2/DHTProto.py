@@ -0,0 +1,498 @@
+""" Binary wire format of the DHT messages.
+
+A datagram holds one message: a header with the version, the code of the
+method and the length of the body, then the body. Each method has its
+own body layout: a struct.Struct with the ids, request id, port and
+lengths of its fields, followed by the host, key and tagged values, so
+the common messages take one pack or unpack call and a few slices.
+Missing ids and request ids (None) are sent as all ones.
+
+A message that does not fit the layout of its method (an id over 16
+bits, a list as an address, an extra field, ...) is sent tagged instead:
+the code of the method has its high bit set and the body is the tagged
+dict of the message.
+
+A tagged value is a type byte and the value, with integers and lengths
+as varints. Decoding only builds None, bools, ints, floats, strings,
+bytes, lists, tuples and dicts, so unlike pickle a datagram cannot run
+code.
+
+Large values are not split across datagrams: a message takes a single
+datagram of up to utils.MAX_DATAGRAM bytes, and DHTClient refuses to put
+a value that does not fit in one (utils.MAX_ITEM)."""
+import struct
+
+VERSION = 2
+
+METHODS = ("JOIN_REQ", "JOIN_REP", "NOTIFY", "PREDECESSOR", "STABILIZE", "SUCCESSOR", "SUCCESSOR_REP",
+           "PUT", "GET", "ACK", "NACK", "LOOKUP", "LOOKUP_REP", "MPUT", "MGET")
+CODES = {method: code for code, method in enumerate(METHODS)}
+# high bit of the method code of a tagged message
+TAGGED = 0x80
+
+# version, method code and body length
+HEADER = struct.Struct(">BBI")
+# ids and request ids standing for None
+NO_ID = 0xFFFF
+NO_REQ_ID = 0xFFFFFFFF
+
+# type bytes of tagged values
+NONE, FALSE, TRUE, INT, NEG, FLOAT, STR, BYTES, LIST, TUPLE, DICT = range(11)
+
+_double = struct.Struct(">d")
+# type byte and length of short strings, type byte and value of small ints
+_short = {tag: [bytes((tag, n)) for n in range(0x80)] for tag in (STR, INT)}
+
+
+class DHTProtoError(Exception):
+    """Datagram that is not a valid message."""
+
+
+def _varint(out, n):
+    while n > 0x7F:
+        out.append(n & 0x7F | 0x80)
+        n >>= 7
+    out.append(n)
+
+
+def _value(out, value):
+    """Append the tagged encoding of value to the bytearray out."""
+    kind = type(value)
+    if kind is str:
+        data = value.encode()
+        if len(data) < 0x80:
+            out += _short[STR][len(data)]
+        else:
+            out.append(STR)
+            _varint(out, len(data))
+        out += data
+    elif kind is int:
+        if 0 <= value < 0x80:
+            out += _short[INT][value]
+        elif value >= 0:
+            out.append(INT)
+            _varint(out, value)
+        else:
+            out.append(NEG)
+            _varint(out, -value)
+    elif value is None:
+        out.append(NONE)
+    elif kind is tuple or kind is list:
+        out.append(TUPLE if kind is tuple else LIST)
+        _varint(out, len(value))
+        for item in value:
+            # short strings and small ints inline, as in most lists
+            if type(item) is str and len(item) < 0x80 and item.isascii():
+                out += _short[STR][len(item)]
+                out += item.encode()
+            elif type(item) is int and 0 <= item < 0x80:
+                out += _short[INT][item]
+            else:
+                _value(out, item)
+    elif kind is dict:
+        out.append(DICT)
+        _varint(out, len(value))
+        for key, item in value.items():
+            if type(key) is str and len(key) < 0x80 and key.isascii():
+                out += _short[STR][len(key)]
+                out += key.encode()
+            else:
+                _value(out, key)
+            _value(out, item)
+    elif kind is bool:
+        out.append(TRUE if value else FALSE)
+    elif kind is float:
+        out.append(FLOAT)
+        out += _double.pack(value)
+    elif kind is bytes:
+        out.append(BYTES)
+        _varint(out, len(value))
+        out += value
+    else:
+        raise DHTProtoError("cannot encode {}".format(kind.__name__))
+
+
+def size(value):
+    """ Bytes taken by value in a message."""
+    out = bytearray()
+    _value(out, value)
+    return len(out)
+
+
+def _read_varint(data, pos):
+    n = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        n |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return n, pos
+        shift += 7
+
+
+def _read(data, pos):
+    """Decode the tagged value at pos. Returns it and the position after."""
+    tag = data[pos]
+    if tag == STR:
+        length = data[pos + 1]
+        if length < 0x80:
+            pos += 2
+        else:
+            length, pos = _read_varint(data, pos + 1)
+        end = pos + length
+        if end > len(data):
+            raise IndexError
+        return data[pos:end].decode(), end
+    if tag == INT:
+        n = data[pos + 1]
+        if n < 0x80:
+            return n, pos + 2
+        return _read_varint(data, pos + 1)
+    pos += 1
+    if tag == NONE:
+        return None, pos
+    if tag == TUPLE or tag == LIST:
+        length, pos = _read_varint(data, pos)
+        items = []
+        for _ in range(length):
+            if data[pos] == STR and data[pos + 1] < 0x80:
+                end = pos + 2 + data[pos + 1]
+                items.append(data[pos + 2:end].decode())
+                pos = end
+            elif data[pos] == INT and data[pos + 1] < 0x80:
+                items.append(data[pos + 1])
+                pos += 2
+            else:
+                item, pos = _read(data, pos)
+                items.append(item)
+        return (tuple(items) if tag == TUPLE else items), pos
+    if tag == DICT:
+        length, pos = _read_varint(data, pos)
+        items = {}
+        for _ in range(length):
+            if data[pos] == STR and data[pos + 1] < 0x80:
+                end = pos + 2 + data[pos + 1]
+                key = data[pos + 2:end].decode()
+                pos = end
+            else:
+                key, pos = _read(data, pos)
+            items[key], pos = _read(data, pos)
+        return items, pos
+    if tag == NEG:
+        n, pos = _read_varint(data, pos)
+        return -n, pos
+    if tag == TRUE or tag == FALSE:
+        return tag == TRUE, pos
+    if tag == FLOAT:
+        return _double.unpack_from(data, pos)[0], pos + 8
+    if tag == BYTES:
+        length, pos = _read_varint(data, pos)
+        end = pos + length
+        if end > len(data):
+            raise IndexError
+        return data[pos:end], end
+    raise DHTProtoError("unknown type {}".format(tag))
+
+
+
+def _id(value, none=NO_ID):
+    """ Value of an id field: an int under none, none standing for None."""
+    if value is None:
+        return none
+    if type(value) is not int or not 0 <= value < none:
+        raise TypeError
+    return value
+
+
+def _none(value, none=NO_ID):
+    return None if value == none else value
+
+
+def _addr(addr):
+    """ Host, as bytes, and port of an address field."""
+    if type(addr) is not tuple or len(addr) != 2 or type(addr[0]) is not str or type(addr[1]) is not int:
+        raise TypeError
+    return addr[0].encode(), addr[1]
+
+
+def _text(value):
+    if type(value) is not str:
+        raise TypeError
+    return value.encode()
+
+
+class IdAddr:
+    """ Body of the messages whose args are a node id and an address."""
+
+    keys = {"method", "args"}
+    layout = struct.Struct(">HBH")  # id, host length, port; then the host
+
+    def __init__(self, id_field, addr_field):
+        self.id_field = id_field
+        self.addr_field = addr_field
+        self.fields = {id_field, addr_field}
+
+    def encode(self, msg):
+        args = msg["args"]
+        if len(args) != 2:
+            raise TypeError
+        host, port = _addr(args[self.addr_field])
+        return self.layout.pack(_id(args[self.id_field]), len(host), port) + host
+
+    def decode(self, data, pos):
+        node_id, length, port = self.layout.unpack_from(data, pos)
+        pos += self.layout.size
+        args = {self.id_field: _none(node_id), self.addr_field: (data[pos:pos + length].decode(), port)}
+        return {"args": args}, pos + length
+
+
+class Empty:
+    """ Body of PREDECESSOR: nothing."""
+
+    keys = {"method"}
+    fields = None
+
+    def encode(self, msg):
+        return b""
+
+    def decode(self, data, pos):
+        return {}, pos
+
+
+class Stabilize:
+    """ Body of STABILIZE: the id of the predecessor of the sender."""
+
+    keys = {"method", "args"}
+    fields = None
+    layout = struct.Struct(">H")
+
+    def encode(self, msg):
+        return self.layout.pack(_id(msg["args"]))
+
+    def decode(self, data, pos):
+        node_id, = self.layout.unpack_from(data, pos)
+        return {"args": _none(node_id)}, pos + self.layout.size
+
+
+class SuccessorRep:
+    """ Body of SUCCESSOR_REP: the id asked for and its successor."""
+
+    keys = {"method", "args"}
+    fields = {"req_id", "successor_id", "successor_addr"}
+    layout = struct.Struct(">HHBH")  # id asked for, successor id, host length, port; then the host
+
+    def encode(self, msg):
+        args = msg["args"]
+        if len(args) != 3:
+            raise TypeError
+        host, port = _addr(args["successor_addr"])
+        return self.layout.pack(_id(args["req_id"]), _id(args["successor_id"]), len(host), port) + host
+
+    def decode(self, data, pos):
+        req_id, successor_id, length, port = self.layout.unpack_from(data, pos)
+        pos += self.layout.size
+        args = {"req_id": _none(req_id), "successor_id": _none(successor_id),
+                "successor_addr": (data[pos:pos + length].decode(), port)}
+        return {"args": args}, pos + length
+
+
+class Lookup:
+    """ Body of LOOKUP: the id looked up and the request id."""
+
+    keys = {"method", "args"}
+    fields = {"id", "req_id"}
+    layout = struct.Struct(">HI")
+
+    def encode(self, msg):
+        args = msg["args"]
+        if len(args) != 2:
+            raise TypeError
+        return self.layout.pack(_id(args["id"]), _id(args["req_id"], NO_REQ_ID))
+
+    def decode(self, data, pos):
+        node_id, req_id = self.layout.unpack_from(data, pos)
+        return {"args": {"id": _none(node_id), "req_id": _none(req_id, NO_REQ_ID)}}, pos + self.layout.size
+
+
+class LookupRep:
+    """ Body of LOOKUP_REP: whether the sender knows the owner, then the
+    owner and the range it owns, or the next node to ask."""
+
+    keys = {"method", "args", "req_id"}
+    fields = {"owner", "addr", "id", "from_id"}
+    layout = struct.Struct(">BIHHBH")  # flags, req_id, id, from_id, host length, port; then the host
+    OWNER = 0x01
+
+    def encode(self, msg):
+        args = msg["args"]
+        owner = args["owner"]
+        if owner is True and len(args) == 4:
+            node_id, from_id = _id(args["id"]), _id(args["from_id"])
+        elif owner is False and len(args) == 2:
+            node_id = from_id = NO_ID
+        else:
+            raise TypeError
+        host, port = _addr(args["addr"])
+        return self.layout.pack(self.OWNER if owner else 0, _id(msg["req_id"], NO_REQ_ID), node_id, from_id, len(host), port) + host
+
+    def decode(self, data, pos):
+        flags, req_id, node_id, from_id, length, port = self.layout.unpack_from(data, pos)
+        pos += self.layout.size
+        args = {"owner": bool(flags & self.OWNER), "addr": (data[pos:pos + length].decode(), port)}
+        if flags & self.OWNER:
+            args["id"], args["from_id"] = _none(node_id), _none(from_id)
+        return {"args": args, "req_id": _none(req_id, NO_REQ_ID)}, pos + length
+
+
+class Request:
+    """ Body of PUT, GET, MPUT and MGET: a flags byte telling whether the
+    args have an address to reply to, the request id, that address, then
+    the string key and the tagged value, items or keys of the method."""
+
+    keys = {"method", "args"}
+    layout = struct.Struct(">BIBHH")  # flags, req_id, host length, port, key length; then the host and key
+    FROM = 0x01
+
+    def __init__(self, key_field, value_field):
+        self.key_field = key_field
+        self.value_field = value_field
+        self.fields = {key_field, value_field, "from", "req_id"} - {None}
+
+    def encode(self, msg):
+        args = msg["args"]
+        if len(args) != len(self.fields) - ("from" not in args):
+            raise TypeError
+        flags, host, port = 0, b"", 0
+        if "from" in args:
+            flags = self.FROM
+            host, port = _addr(args["from"])
+        key = b"" if self.key_field is None else _text(args[self.key_field])
+        out = bytearray(self.layout.pack(flags, _id(args["req_id"], NO_REQ_ID), len(host), port, len(key)))
+        out += host
+        out += key
+        if self.value_field is not None:
+            _value(out, args[self.value_field])
+        return bytes(out)
+
+    def decode(self, data, pos):
+        flags, req_id, host_length, port, key_length = self.layout.unpack_from(data, pos)
+        host = pos + self.layout.size
+        key = host + host_length
+        pos = key + key_length
+        args = {}
+        if self.key_field is not None:
+            args[self.key_field] = data[key:pos].decode()
+        if self.value_field is not None:
+            args[self.value_field], pos = _read(data, pos)
+        if flags & self.FROM:
+            args["from"] = (data[host:key].decode(), port)
+        args["req_id"] = _none(req_id, NO_REQ_ID)
+        return {"args": args}, pos
+
+
+class Reply:
+    """ Body of ACK and NACK: a flags byte telling whether they have args
+    and an owner, the request id, the id, predecessor id and address of
+    the owner (the node replying), then the tagged args."""
+
+    keys = {"method", "args", "req_id", "owner"}
+    fields = None
+    layout = struct.Struct(">BIHHBH")  # flags, req_id, id, from_id, host length, port; then the host
+    ARGS = 0x01
+    OWNER = 0x02
+
+    def encode(self, msg):
+        flags, node_id, from_id, host, port = 0, NO_ID, NO_ID, b"", 0
+        if "args" in msg:
+            flags |= self.ARGS
+        if "owner" in msg:
+            owner = msg["owner"]
+            if type(owner) is not dict or len(owner) != 3:
+                raise TypeError
+            flags |= self.OWNER
+            node_id, from_id = _id(owner["id"]), _id(owner["from_id"])
+            host, port = _addr(owner["addr"])
+        out = bytearray(self.layout.pack(flags, _id(msg["req_id"], NO_REQ_ID), node_id, from_id, len(host), port))
+        out += host
+        if flags & self.ARGS:
+            _value(out, msg["args"])
+        return bytes(out)
+
+    def decode(self, data, pos):
+        flags, req_id, node_id, from_id, length, port = self.layout.unpack_from(data, pos)
+        pos += self.layout.size
+        host = data[pos:pos + length].decode()
+        pos += length
+        msg = {}
+        if flags & self.ARGS:
+            msg["args"], pos = _read(data, pos)
+        msg["req_id"] = _none(req_id, NO_REQ_ID)
+        if flags & self.OWNER:
+            msg["owner"] = {"id": _none(node_id), "addr": (host, port), "from_id": _none(from_id)}
+        return msg, pos
+
+
+# body layout of each method
+CODECS = {
+    "JOIN_REQ": IdAddr("id", "addr"),
+    "JOIN_REP": IdAddr("successor_id", "successor_addr"),
+    "NOTIFY": IdAddr("predecessor_id", "predecessor_addr"),
+    "PREDECESSOR": Empty(),
+    "STABILIZE": Stabilize(),
+    "SUCCESSOR": IdAddr("id", "from"),
+    "SUCCESSOR_REP": SuccessorRep(),
+    "PUT": Request("key", "value"),
+    "GET": Request("key", None),
+    "ACK": Reply(),
+    "NACK": Reply(),
+    "LOOKUP": Lookup(),
+    "LOOKUP_REP": LookupRep(),
+    "MPUT": Request(None, "items"),
+    "MGET": Request(None, "keys"),
+}
+
+
+def encode(msg):
+    """ Datagram of a message, a dict with a method and optional args,
+    req_id and owner."""
+    method = msg["method"]
+    codec = CODECS[method]
+    args = msg.get("args")
+    if codec.fields is not None and type(args) is dict and not args.keys() <= codec.fields:
+        raise DHTProtoError("unknown fields in {}".format(sorted(args)))
+    code = CODES[method]
+    try:
+        if not msg.keys() <= codec.keys:
+            raise TypeError
+        body = codec.encode(msg)
+    except (TypeError, ValueError, KeyError, struct.error):
+        # the message does not fit the layout of its method
+        code |= TAGGED
+        body = bytearray()
+        _value(body, {name: value for name, value in msg.items() if name != "method"})
+    return HEADER.pack(VERSION, code, len(body)) + body
+
+
+def decode(data):
+    """ Message of a datagram. Raises DHTProtoError when it is not one."""
+    try:
+        version, code, length = HEADER.unpack_from(data)
+        if version != VERSION:
+            raise DHTProtoError("unsupported version {}".format(version))
+        method = code & ~TAGGED
+        if method >= len(METHODS):
+            raise DHTProtoError("unknown method {}".format(method))
+        if HEADER.size + length != len(data):
+            raise DHTProtoError("{} bytes for a body of {}".format(len(data), length))
+        if code & TAGGED:
+            msg, pos = _read(data, HEADER.size)
+            if type(msg) is not dict:
+                raise DHTProtoError("tagged message is not a dict")
+        else:
+            msg, pos = CODECS[METHODS[method]].decode(data, HEADER.size)
+    except (IndexError, TypeError, UnicodeDecodeError, RecursionError, struct.error) as e:
+        raise DHTProtoError("malformed message") from e
+    if pos != len(data):
+        raise DHTProtoError("{} bytes for a message of {}".format(len(data), pos))
+    msg["method"] = METHODS[method]
+    return msg
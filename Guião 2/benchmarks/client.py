@@ -0,0 +1,92 @@
+"""Benchmark: hops and latency per client operation on a localhost ring.
+
+Starts a ring of 32 DHTNode threads, waits for it to stabilize and runs
+puts and gets of random keys with each kind of DHTClient: recursive or
+iterative, without and with the routing cache, and with mput/mget in
+batches. Hops are the PUT, GET, MPUT, MGET and LOOKUP messages handled
+by nodes per operation; the share of them
+handled by the bootstrap node shows how much of a hotspot it is. Run from
+the assignment folder with ``python -m benchmarks.client``."""
+import random
+import time
+
+from DHTClient import DHTClient
+from DHTNode import DHTNode
+from utils import dht_hash
+
+NODES = 32
+BASE_PORT = 7000
+OPS = 300
+STABILIZE = 25
+
+
+def ports(n):
+    """n ports whose nodes get distinct ids."""
+    chosen, ids = [], set()
+    port = BASE_PORT
+    while len(chosen) < n:
+        node_id = dht_hash(("localhost", port).__str__())
+        if node_id not in ids:
+            ids.add(node_id)
+            chosen.append(port)
+        port += 1
+    return chosen
+
+
+def counted(node, counts):
+    """Counts the requests handled by node in counts[node.addr]."""
+    for name in ("put", "get", "mput", "mget", "lookup"):
+        method = getattr(node, name)
+
+        def wrapper(*args, method=method):
+            counts[node.addr] = counts.get(node.addr, 0) + 1
+            return method(*args)
+        setattr(node, name, wrapper)
+
+
+def start_ring(counts):
+    nodes = []
+    bootstrap = None
+    for port in ports(NODES):
+        node = DHTNode(("localhost", port), bootstrap, timeout=0.5)
+        counted(node, counts)
+        node.start()
+        nodes.append(node)
+        bootstrap = bootstrap or node.addr
+        time.sleep(0.1)
+    time.sleep(STABILIZE)
+    return nodes
+
+
+def run(client, keys, counts, batched=False):
+    counts.clear()
+    start = time.perf_counter()
+    if batched:
+        ok = sum(client.mput({key: key for key in keys}).values())
+        ok += sum(key == value for key, value in client.mget(keys).items())
+    else:
+        ok = sum(client.put(key, key) for key in keys)
+        ok += sum(client.get(key) == key for key in keys)
+    elapsed = time.perf_counter() - start
+    ops = 2 * len(keys)
+    hops = sum(counts.values())
+    return ok / ops, hops / ops, counts.get(client.dht_addr, 0) / max(hops, 1), elapsed / ops
+
+
+if __name__ == "__main__":
+    counts = {}
+    nodes = start_ring(counts)
+    bootstrap = nodes[0].addr
+    rng = random.Random(1)
+    print(f"{'client':>20} {'ok':>5} {'hops/op':>8} {'bootstrap':>10} {'latency':>9}")
+    for name, iterative, cache_size, batched in [("recursive", False, 0, False), ("recursive + cache", False, 64, False),
+                                                 ("iterative", True, 0, False), ("iterative + cache", True, 64, False),
+                                                 ("mput/mget", False, 64, True)]:
+        keys = [f"{name}-{rng.random()}" for _ in range(OPS)]
+        client = DHTClient(bootstrap, iterative=iterative, cache_size=cache_size)
+        ok, hops, hotspot, latency = run(client, keys, counts, batched)
+        print(f"{name:>20} {ok:>5.0%} {hops:>8.2f} {hotspot:>10.0%} {latency * 1e3:>7.2f}ms")
+    for node in nodes:
+        node.done = True
+    for node in nodes:
+        node.join()
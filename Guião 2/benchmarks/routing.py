@@ -0,0 +1,82 @@
+"""Benchmark: lookup hops on a simulated Chord ring.
+
+Builds rings of N nodes with random ids in a 2**16 id space and exact
+finger tables, then routes lookups of random keys from random nodes the
+way DHTNode.get does: a key between a node and its successor goes to the
+successor, a key the node owns stops there, any other goes to
+FingerTable.find. Reports the mean and maximum hops with the current
+find and with the previous one, which picked the finger before the first
+one past the key, and the cost of a find call. Rings are routed with
+exact tables and with tables being refreshed, where each finger still
+holds the successor it was filled with on join with probability 1/2. Run from the assignment
+folder with ``python -m benchmarks.routing``."""
+import random
+import timeit
+from bisect import bisect_left
+
+from DHTNode import FingerTable
+from utils import contains
+
+M_BITS = 16
+SIZES = (64, 128, 256, 512, 1024)
+LOOKUPS = 2000
+MAX_HOPS = 5000
+
+
+def legacy_find(table: FingerTable, identification):
+    ret = table.finger_table[-1][1]
+    for i in range(len(table.finger_table)):
+        if contains(table.node_id, table.finger_table[i][0], identification):
+            ret = table.finger_table[i - 1][1]
+            break
+    return ret
+
+
+def ring(n: int, rng: random.Random, stale: float = 0) -> dict:
+    """Finger tables of n nodes, by node id; a node's address is its id.
+    A fraction stale of the fingers is left pointing at the successor."""
+    ids = sorted(rng.sample(range(2 ** M_BITS), n))
+
+    def successor(key):
+        return ids[bisect_left(ids, key) % n]
+
+    tables = {}
+    for node_id in ids:
+        table = FingerTable(node_id, node_id, M_BITS)
+        table.fill(successor(node_id + 1), successor(node_id + 1))
+        for i, start in enumerate(table.starts):
+            if rng.random() >= stale:
+                finger = successor((node_id + start) % table.size)
+                table.update(i + 1, finger, finger)
+        tables[node_id] = table
+    return tables
+
+
+def hops(tables: dict, ids: list, start, key, find) -> int:
+    node, count = start, 0
+    while count < MAX_HOPS:
+        table = tables[node]
+        successor = table.finger_table[0][0]
+        predecessor = ids[ids.index(node) - 1]
+        if contains(predecessor, node, key):
+            return count
+        node = successor if contains(node, successor, key) else find(table, key)
+        count += 1
+    return count
+
+
+if __name__ == "__main__":
+    rng = random.Random(1)
+    print(f"{'tables':>10} {'nodes':>6} {'log2':>5} {'hops':>6} {'max':>4} {'old hops':>9} {'old max':>8} {'find':>8} {'old find':>9}")
+    for n, stale in [(n, stale) for stale in (0, 0.5) for n in SIZES]:
+        tables = ring(n, rng, stale)
+        ids = sorted(tables)
+        lookups = [(rng.choice(ids), rng.randrange(2 ** M_BITS)) for _ in range(LOOKUPS)]
+        new = [hops(tables, ids, s, k, FingerTable.find) for s, k in lookups]
+        old = [hops(tables, ids, s, k, legacy_find) for s, k in lookups]
+        table = tables[ids[0]]
+        keys = [k for _, k in lookups[:200]]
+        t_new = min(timeit.repeat(lambda: [table.find(k) for k in keys], number=20, repeat=5)) / (20 * len(keys))
+        t_old = min(timeit.repeat(lambda: [legacy_find(table, k) for k in keys], number=20, repeat=5)) / (20 * len(keys))
+        print(f"{'refreshing' if stale else 'exact':>10} {n:>6} {n.bit_length() - 1:>5} {sum(new) / LOOKUPS:>6.2f} {max(new):>4} "
+              f"{sum(old) / LOOKUPS:>9.2f} {max(old):>8} {t_new * 1e6:>6.2f}us {t_old * 1e6:>7.2f}us")
@@ -0,0 +1,38 @@
+"""Benchmark: DHTProto against pickle for the DHT messages.
+
+For a few typical messages, from the stabilize traffic to batches,
+reports the datagram size and the time to encode and decode one with
+DHTProto and with pickle. Run from the assignment folder with
+``python -m benchmarks.wire``."""
+import pickle
+import timeit
+
+from DHTProto import encode, decode
+
+OWNER = {"id": 770, "addr": ("localhost", 5000), "from_id": 752}
+MESSAGES = {
+    "PREDECESSOR": {"method": "PREDECESSOR"},
+    "STABILIZE": {"method": "STABILIZE", "args": 654},
+    "NOTIFY": {"method": "NOTIFY", "args": {"predecessor_id": 260, "predecessor_addr": ("localhost", 5002)}},
+    "SUCCESSOR": {"method": "SUCCESSOR", "args": {"id": 771, "from": ("localhost", 5000)}},
+    "SUCCESSOR_REP": {"method": "SUCCESSOR_REP", "args": {"req_id": 771, "successor_id": 895, "successor_addr": ("localhost", 6000)}},
+    "PUT": {"method": "PUT", "args": {"key": "Aveiro", "value": [0, 1, 2], "from": ("127.0.0.1", 40000), "req_id": 1234}},
+    "GET ACK": {"method": "ACK", "args": "ovos moles", "req_id": 1234, "owner": OWNER},
+    "MPUT 20": {"method": "MPUT", "args": {"items": [(f"key-{i}", f"value {i}") for i in range(20)], "req_id": 1234}},
+    "MGET ACK 20": {"method": "ACK", "args": {"values": {f"key-{i}": f"value {i}" for i in range(20)}, "missing": [], "moved": [], "left": []},
+                    "req_id": 1234, "owner": OWNER},
+}
+
+
+def per_op(stmt, number=20000):
+    return min(timeit.repeat(stmt, number=number, repeat=5)) / number
+
+
+if __name__ == "__main__":
+    print(f"{'message':>14} {'bytes':>6} {'pickle':>7} {'encode':>9} {'pickle':>9} {'decode':>9} {'pickle':>9}")
+    for name, msg in MESSAGES.items():
+        data, pickled = encode(msg), pickle.dumps(msg)
+        assert decode(data) == msg
+        times = [per_op(lambda: encode(msg)), per_op(lambda: pickle.dumps(msg)),
+                 per_op(lambda: decode(data)), per_op(lambda: pickle.loads(pickled))]
+        print(f"{name:>14} {len(data):>6} {len(pickled):>7} " + " ".join(f"{t * 1e6:>7.2f}us" for t in times))
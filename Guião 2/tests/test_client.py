@@ -0,0 +1,144 @@
+"""Tests the client lookup modes."""
+import socket
+import time
+import pytest
+import DHTProto
+from DHTClient import DHTClient, RouteCache
+from utils import dht_hash
+
+
+@pytest.fixture()
+def client():
+    return DHTClient(("localhost", 5000), iterative=True)
+
+
+def test_iterative_put_get(client):
+    assert client.put("Ilhavo", "bacalhau")
+    assert client.get("Ilhavo") == "bacalhau"
+    assert len(client.routes)
+
+    # the other mode finds the same node
+    assert DHTClient(("localhost", 5000)).get("Ilhavo") == "bacalhau"
+
+
+def test_iterative_uses_cached_owner(client):
+    assert client.put("Ovar", "pao de lo")
+    ranges = dict(client.routes.ranges)
+    assert client.get("Ovar") == "pao de lo"
+    assert client.routes.ranges == ranges
+    assert client.get("Vagos") is None
+
+
+def test_timeout():
+    client = DHTClient(("localhost", 5999), timeout=0.1, retries=2)
+    start = time.monotonic()
+    assert not client.put("Aveiro", "ovos moles")
+    assert 0.3 <= time.monotonic() - start < 1
+
+
+def test_recursive_learns_owner():
+    client = DHTClient(("localhost", 5000))
+    assert client.put("Espinho", "praia")
+    assert client.routes.find(dht_hash("Espinho")) is not None
+    assert client.get("Espinho") == "praia"
+
+
+def test_route_cache():
+    routes = RouteCache(2)
+    routes.learn(100, 900, ("localhost", 1))
+    routes.learn(500, 100, ("localhost", 5))
+    assert routes.find(950) == ("localhost", 1)
+    assert routes.find(50) == ("localhost", 1)
+    assert routes.find(300) == ("localhost", 5)
+    assert routes.find(700) is None
+
+    # 500 is now the least recently used
+    routes.find(100)
+    routes.learn(800, 600, ("localhost", 8))
+    assert routes.find(300) is None
+    assert routes.find(700) == ("localhost", 8)
+
+    routes.forget(("localhost", 8))
+    assert routes.find(700) is None
+    assert len(routes) == 1
+
+
+def test_nack_keeps_the_route():
+    client = DHTClient(("localhost", 5999))
+    client.routes.learn(770, 752, ("localhost", 5000))
+    key_hash = dht_hash("13")  # 765
+
+    owner = {"id": 770, "addr": ("localhost", 5000), "from_id": 752}
+    client.request = lambda address, method, args: {"method": "NACK", "req_id": 1, "owner": owner}
+    assert client.get("13") is None
+    assert client.routes.find(key_hash) == ("localhost", 5000)
+
+    # a node joined between 752 and 770 and took the key
+    owner = {"id": 770, "addr": ("localhost", 5000), "from_id": 766}
+    assert client.get("13") is None
+    assert client.routes.find(key_hash) is None
+
+    client.routes.learn(770, 752, ("localhost", 5000))
+    client.request = lambda address, method, args: None
+    assert client.get("13") is None
+    assert client.routes.find(key_hash) is None
+
+
+@pytest.mark.parametrize("iterative", [False, True])
+def test_mput_mget(iterative):
+    client = DHTClient(("localhost", 5000), iterative=iterative)
+    items = {f"batch-{iterative}-{i}": i * "x" for i in range(100)}
+    assert client.mput(items) == {key: True for key in items}
+    assert client.mput({"batch-{}-1".format(iterative): "again"}) == {"batch-{}-1".format(iterative): False}
+
+    values = client.mget(list(items) + ["not stored"])
+    assert values == dict(items, **{"not stored": None})
+    assert DHTClient(("localhost", 5000)).get("batch-{}-7".format(iterative)) == "xxxxxxx"
+
+
+def test_large_values():
+    client = DHTClient(("localhost", 5000))
+    value = "Aveiro" * 5000
+    assert client.put("big", value)
+    assert client.put("Mealhada", "leitao")
+    assert client.get("big") == value
+    assert client.mget(["big", "Mealhada"]) == {"big": value, "Mealhada": "leitao"}
+
+
+def test_oversized_values_are_rejected():
+    client = DHTClient(("localhost", 5000))
+    with pytest.raises(ValueError):
+        client.put("huge", "x" * 70000)
+    with pytest.raises(ValueError):
+        client.mput({"small": "x", "huge": b"x" * 65500})
+    assert client.get("huge") is None
+    assert client.get("small") is None
+
+
+def message(method, *body, code=0):
+    return DHTProto.HEADER.pack(DHTProto.VERSION, DHTProto.CODES[method] | code, len(body)) + bytes(body)
+
+
+REPLY = tuple(DHTProto.Reply.layout.pack(DHTProto.Reply.ARGS, 1, 0, 0, 0, 0))
+MALFORMED = [
+    b"",
+    b"\x02",
+    message("ACK", *REPLY, DHTProto.FLOAT, 1, 2, 3, 4, 5),
+    message("ACK", *REPLY, DHTProto.DICT, 1, DHTProto.LIST, 1, DHTProto.STR, 1, 97, DHTProto.INT, 1),
+    message("NOTIFY", 0x01, 0x03, 1, 4),
+    message("NOTIFY", 0x00, 0x01, 0x07, 0x00, 0x00),
+    message("PUT", DHTProto.LIST, 0, code=DHTProto.TAGGED),
+]
+
+
+def test_node_survives_malformed_datagrams():
+    for payload in MALFORMED[1:]:
+        with pytest.raises(DHTProto.DHTProtoError):
+            DHTProto.decode(payload)
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    for payload in MALFORMED:
+        sock.sendto(payload, ("localhost", 5000))
+    sock.close()
+
+    client = DHTClient(("localhost", 5000), retries=1)
+    assert client.request(("localhost", 5000), "LOOKUP", {"id": 0}) is not None
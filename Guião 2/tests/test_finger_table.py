@@ -35,3 +35,16 @@ def test_finger_table():
         (3, 14, ("localhost", 5003)),
         (4, 2, ("localhost", 5004)),
     ]
+
+
+def test_find_closest_preceding():
+    f = FingerTable(10, ("localhost", 5000), 4)
+    f.fill(12, ("localhost", 5012))
+    f.update(4, 2, ("localhost", 5002))
+
+    # the successor owns 11 and 12; the last finger is past them
+    assert f.find(11) == ("localhost", 5012)
+    assert f.find(12) == ("localhost", 5012)
+    assert f.find(1) == ("localhost", 5012)
+    assert f.find(5) == ("localhost", 5002)
+    assert f.find(10) == ("localhost", 5012)
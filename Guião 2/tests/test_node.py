@@ -0,0 +1,32 @@
+"""Tests the request handling of a node."""
+import pytest
+from DHTNode import DHTNode
+from utils import dht_hash
+
+
+@pytest.fixture()
+def node():
+    """ A node that joined the DHT and was not notified of its predecessor yet."""
+    node = DHTNode(("localhost", 5100), ("localhost", 5000))
+    node.successor_id, node.successor_addr = 770, ("localhost", 5000)
+    node.finger_table.fill(node.successor_id, node.successor_addr)
+    node.sent = []
+    node.send = lambda address, msg: node.sent.append((address, msg))
+    yield node
+    node.socket.close()
+
+
+def test_put_get_before_notify(node):
+    key = next(str(i) for i in range(100) if not (node.identification < dht_hash(str(i)) <= 770))
+    node.put(key, "value", ("localhost", 1), 1)
+    node.get(key, ("localhost", 1), 2)
+    assert [msg["method"] for _, msg in node.sent] == ["PUT", "GET"]
+    assert not node.keystore
+
+
+def test_alone_owns_everything(node):
+    node.successor_id, node.successor_addr = node.identification, node.addr
+    node.put("A", "value", ("localhost", 1), 1)
+    node.get("A", ("localhost", 1), 2)
+    assert [msg["method"] for _, msg in node.sent] == ["ACK", "ACK"]
+    assert node.sent[1][1]["args"] == "value"
@@ -0,0 +1,77 @@
+"""Tests the DHT wire format."""
+import pickle
+import pytest
+from DHTProto import CODES, HEADER, TAGGED, VERSION, encode, decode, DHTProtoError
+
+MESSAGES = [
+    {"method": "JOIN_REQ", "args": {"addr": ("localhost", 5001), "id": 959}},
+    {"method": "JOIN_REP", "args": {"successor_id": 770, "successor_addr": ("localhost", 5000)}},
+    {"method": "NOTIFY", "args": {"predecessor_id": 260, "predecessor_addr": ("localhost", 5002)}},
+    {"method": "PREDECESSOR"},
+    {"method": "STABILIZE", "args": None},
+    {"method": "STABILIZE", "args": 257},
+    {"method": "SUCCESSOR", "args": {"id": 771, "from": ("localhost", 5000)}},
+    {"method": "SUCCESSOR_REP", "args": {"req_id": 771, "successor_id": 895, "successor_addr": ("localhost", 6000)}},
+    {"method": "PUT", "args": {"key": "A", "value": [0, 1, (2, "três")], "req_id": 1}},
+    {"method": "PUT", "args": {"key": "A", "value": {"x": -1.5, "y": b"\x00", "z": True}, "from": ("127.0.0.1", 40000), "req_id": None}},
+    {"method": "GET", "args": {"key": "A", "from": ("127.0.0.1", 40000), "req_id": 2 ** 40}},
+    {"method": "ACK", "req_id": 1, "owner": {"id": 770, "addr": ("localhost", 5000), "from_id": None}},
+    {"method": "ACK", "args": [0, 1, 2], "req_id": 2, "owner": {"id": 770, "addr": ("localhost", 5000), "from_id": 752}},
+    {"method": "NACK", "req_id": 3, "owner": {"id": 770, "addr": ("localhost", 5000), "from_id": 752}},
+    {"method": "LOOKUP", "args": {"id": 115, "req_id": 4}},
+    {"method": "LOOKUP", "args": {"id": 11, "req_id": 11}, "req_id": 11},
+    {"method": "LOOKUP_REP", "args": {"owner": False, "addr": ("localhost", 5001)}, "req_id": 4},
+    {"method": "LOOKUP_REP", "args": {"owner": True, "id": 257, "addr": ("localhost", 5003), "from_id": 959}, "req_id": 5},
+    {"method": "MPUT", "args": {"items": [("a", 1), ("b", "")], "req_id": 6}},
+    {"method": "MGET", "args": {"keys": ["a", "b"], "req_id": 7}},
+    {"method": "ACK", "args": {"values": {"a": 1}, "missing": ["b"], "moved": [], "left": []}, "req_id": 7},
+    # values that do not fit the kind of their field
+    {"method": "JOIN_REP", "args": {"successor_id": None, "successor_addr": ["localhost", 5000]}},
+    {"method": "SUCCESSOR", "args": {"id": 2 ** 20, "from": ("localhost", 5000)}},
+    {"method": "GET", "args": {"key": b"A", "from": ("h" * 300, 1), "req_id": -1}},
+    {"method": "NOTIFY", "args": {"predecessor_id": True, "predecessor_addr": ("localhost", 70000)}},
+    {"method": "ACK", "req_id": 1, "owner": [770, ("localhost", 5000)]},
+]
+
+
+@pytest.mark.parametrize("msg", MESSAGES)
+def test_roundtrip(msg):
+    data = encode(msg)
+    assert decode(data) == msg
+    assert len(data) < len(pickle.dumps(msg))
+
+
+def test_large_value():
+    msg = {"method": "ACK", "args": "x" * 100000, "req_id": 1}
+    assert decode(encode(msg)) == msg
+
+
+def test_invalid():
+    data = encode(MESSAGES[8])
+    with pytest.raises(DHTProtoError):
+        decode(data[:-3])
+    with pytest.raises(DHTProtoError):
+        decode(data + b"\x00")
+    with pytest.raises(DHTProtoError):
+        decode(bytes([VERSION + 1]) + data[1:])
+    with pytest.raises(DHTProtoError):
+        decode(pickle.dumps(MESSAGES[8]))
+    with pytest.raises(DHTProtoError):
+        encode({"method": "PUT", "args": {"key": "A", "value": object()}})
+    with pytest.raises(DHTProtoError):
+        encode({"method": "GET", "args": {"key": "A", "unknown": 1}})
+
+
+def test_header():
+    data = encode(MESSAGES[8])
+    assert HEADER.unpack_from(data) == (VERSION, CODES["PUT"], len(data) - HEADER.size)
+    # a message that does not fit the layout of its method is tagged
+    assert encode(MESSAGES[-5])[1] == CODES["JOIN_REP"] | TAGGED
+
+
+def test_fields_keep_their_types():
+    msg = decode(encode({"method": "SUCCESSOR_REP", "args": {"req_id": 1, "successor_id": 0, "successor_addr": ("127.0.0.1", 0)}}))
+    assert [type(value) for value in msg["args"].values()] == [int, int, tuple]
+    msg = decode(encode({"method": "NOTIFY", "args": {"predecessor_id": True, "predecessor_addr": ["localhost", 1]}}))
+    assert msg["args"]["predecessor_id"] is True
+    assert type(msg["args"]["predecessor_addr"]) is list
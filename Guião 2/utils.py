@@ -1,3 +1,12 @@
+# Size of the datagrams batches are packed in, under the usual path MTU
+DATAGRAM_SIZE = 1400
+# Largest datagram nodes and clients read, for single values over DATAGRAM_SIZE
+MAX_DATAGRAM = 65507
+# Largest key and value, as encoded, a PUT can carry in one datagram; values
+# are not split across datagrams, larger ones are refused by DHTClient
+MAX_ITEM = MAX_DATAGRAM - 256
+
+
 def dht_hash(text, seed=0, maximum=2**10):
     """ FNV-1a Hash Function. """
     fnv_prime = 16777619